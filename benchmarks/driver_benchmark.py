@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Compare the database drivers supported by the collection on the queries the plugins run.
+
+Every installed driver (mysqlclient and PyMySQL) runs each query against the
+same Racktables database, and the median and best wall clock times are
+printed side by side. The queries are read only.
+
+    python benchmarks/driver_benchmark.py --host rackhost.local --user rackuser \\
+        --password 'sup3r$3cur3' --database rackdb --iterations 10
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'module_utils', 'racktables.py')
+
+# (name, sql, args) - taken from the lookups and modules, widened to the whole table where they
+# normally filter, so that row decoding dominates the timings
+QUERIES = (
+    ('networks lookup', "SELECT INET_NTOA(IPv4Network.ip),IPv4Network.mask,IPv4Network.name,VLANIPv4.vlan_id,IPv4Network.id FROM IPv4Network,VLANIPv4 WHERE VLANIPv4.ipv4net_id = IPv4Network.id", None),
+    ('network tags', "SELECT TS.entity_id, TT.tag FROM TagStorage TS, TagTree TT WHERE TS.entity_realm='ipv4net' AND TT.id=TS.tag_id", None),
+    ('object lookup', "SELECT RTO.id, RTO.name, RTO.label, RTD.dict_value, RTO.asset_no, RTO.has_problems, RTO.comment FROM Object RTO, Dictionary RTD WHERE RTD.dict_key=RTO.objtype_id", None),
+    ('address scan', "SELECT ip FROM IPv4Allocation WHERE ip BETWEEN %s AND %s UNION SELECT ip FROM IPv4Address WHERE ip BETWEEN %s AND %s", (0, 2 ** 32 - 1, 0, 2 ** 32 - 1)),
+    ('network usage', "SELECT ip, MAX(allocated) FROM (SELECT ip, 1 AS allocated FROM IPv4Allocation UNION ALL SELECT ip, 0 AS allocated FROM IPv4Address) U GROUP BY ip ORDER BY ip", None),
+    ('ports', "SELECT id, object_id, name, iif_id, type, l2address, reservation_comment, label FROM Port", None),
+)
+
+
+def loadModuleUtils():
+    # Load the module_utils file directly, so the collection doesn't need to be installed
+    spec = importlib.util.spec_from_file_location('racktables_module_utils', MODULE_UTILS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timeQuery(connection, sql, args, iterations):
+    timings = []
+    rows = 0
+    for i in range(iterations):
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, args)
+            rows = len(cursor.fetchall())
+        timings.append(time.perf_counter() - start)
+        connection.rollback()
+    return rows, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', required=True)
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--driver', action='append', choices=['mysqlclient', 'pymysql'], help='Only benchmark this driver, may be repeated')
+    options = parser.parse_args()
+
+    racktables = loadModuleUtils()
+    drivers = [driver for driver in racktables.DRIVER_PREFERENCE if driver in racktables.DRIVERS and (not options.driver or driver in options.driver)]
+    if not drivers:
+        sys.exit("None of the requested drivers are installed")
+
+    results = {}
+    for driver in drivers:
+        connection = racktables.dbConnect(options.host, options.port, options.user, options.password, options.database, driver=driver)
+        try:
+            for name, sql, args in QUERIES:
+                # One untimed run so every driver starts with a warm buffer pool
+                timeQuery(connection, sql, args, 1)
+                results[(name, driver)] = timeQuery(connection, sql, args, options.iterations)
+        finally:
+            connection.close()
+
+    print('{:<16} {:>9} {:<12} {:>11} {:>11} {:>13}'.format('query', 'rows', 'driver', 'median ms', 'best ms', 'rows/s'))
+    for name, sql, args in QUERIES:
+        for driver in drivers:
+            rows, timings = results[(name, driver)]
+            median = statistics.median(timings)
+            print('{:<16} {:>9} {:<12} {:>11.1f} {:>11.1f} {:>13.0f}'.format(name, rows, driver, median * 1000, min(timings) * 1000, rows / median if median else 0))
+
+
+if __name__ == '__main__':
+    main()
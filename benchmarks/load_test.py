@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Run the provisioning modules with many concurrent workers to find lock contention and connection limits.
+
+Each worker stands in for an Ansible fork. It provisions its share of hosts
+one after the other: racktables_object creates the object,
+racktables_object_port adds eth0, and racktables_ipv4_allocation gives it
+the next free address from the networks with --tags. Like Ansible, every
+module call runs in a new python process, so connection setup is part of
+the latency.
+
+Point it at a stand-in database loaded with the Racktables schema, never
+at production. For example, a MariaDB container with at least one IPv4
+network tagged for the test. The objects it creates are decommissioned
+at the end unless --keep is given.
+
+    python benchmarks/load_test.py --host 127.0.0.1 --user racktables --password secret \\
+        --database racktables --tags loadtest --workers 1,5,10,25 --hosts 200
+
+For each worker count it prints the throughput, the p50 and p99 latency
+of every module, the deadlocks and lock wait timeouts (and how many
+calls were retried because of them), and the peak and mean number of
+connections the server saw.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+MODULE_UTILS = os.path.join(REPO, 'plugins', 'module_utils', 'racktables.py')
+MODULES = ('racktables_object', 'racktables_object_port', 'racktables_ipv4_allocation')
+
+# MySQL error codes worth retrying: deadlock found, and lock wait timeout exceeded
+RETRYABLE = {'1213': 'deadlocks', '1205': 'lock_timeouts'}
+
+
+def percentile(values, fraction):
+    # Nearest rank, good enough for a few hundred samples
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def collectionsRoot():
+    """A temporary ansible_collections tree pointing at this checkout, so the modules import as they would when installed."""
+    root = tempfile.mkdtemp(prefix='racktables-load-')
+    namespace = os.path.join(root, 'ansible_collections', 'cwilloughby_bw')
+    os.makedirs(namespace)
+    os.symlink(REPO, os.path.join(namespace, 'racktables'))
+    return root
+
+
+def runModule(module, args, root, workdir):
+    """Runs a module the way Ansible does, in a new interpreter with its arguments in a file. Returns (seconds, result)."""
+    argsFile = os.path.join(workdir, 'args-{}.json'.format(uuid.uuid4().hex))
+    with open(argsFile, 'w') as f:
+        json.dump({'ANSIBLE_MODULE_ARGS': args}, f)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, os.path.join(REPO, 'plugins', 'modules', module + '.py'), argsFile], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    elapsed = time.perf_counter() - start
+    os.remove(argsFile)
+    try:
+        result = json.loads(process.stdout.decode('utf-8'))
+    except ValueError:
+        result = dict(failed=True, msg=(process.stdout + process.stderr).decode('utf-8', 'replace').strip()[-500:])
+    return elapsed, result
+
+
+def worker(job):
+    """Provisions a list of hosts in order, returning one sample per module call."""
+    names, options, root, workdir = job
+    connection = dict(rt_host=options['host'], rt_port=options['port'], rt_username=options['user'], rt_password=options['password'], rt_database=options['database'], rt_driver=options['driver'])
+    samples = []
+    for name in names:
+        calls = (
+            ('racktables_object', dict(name=name, type=options['type'])),
+            ('racktables_object_port', dict(object=name, name='eth0')),
+            ('racktables_ipv4_allocation', dict(object=name, interface='eth0', tags=options['tags'])),
+        )
+        for module, args in calls:
+            args.update(connection)
+            sample = dict(module=module, seconds=0.0, failed=False, retries=0, deadlocks=0, lock_timeouts=0, msg='')
+            for attempt in range(options['retries'] + 1):
+                elapsed, result = runModule(module, args, root, workdir)
+                sample['seconds'] += elapsed
+                msg = str(result.get('msg', ''))
+                retryable = [key for code, key in RETRYABLE.items() if code in msg]
+                for key in retryable:
+                    sample[key] += 1
+                if result.get('failed') and retryable and attempt < options['retries']:
+                    sample['retries'] += 1
+                    continue
+                sample['failed'] = bool(result.get('failed'))
+                sample['msg'] = msg
+                break
+            samples.append(sample)
+            if sample['failed']:
+                # The later modules need the earlier ones to have worked
+                break
+    return samples
+
+
+def serverStatus(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS LIKE %s", name)
+        row = cursor.fetchone()
+    return int(row[1]) if row else 0
+
+
+class ConnectionSampler(threading.Thread):
+    """Polls the server's connection count while a run is going, over a connection of its own."""
+
+    def __init__(self, connect, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.connect = connect
+        self.interval = interval
+        self.samples = []
+        self.stopping = threading.Event()
+
+    def run(self):
+        connection = self.connect()
+        try:
+            while not self.stopping.is_set():
+                self.samples.append(serverStatus(connection, 'Threads_connected'))
+                self.stopping.wait(self.interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def loadModuleUtils():
+    spec = importlib.util.spec_from_file_location('racktables_module_utils', MODULE_UTILS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def runLoad(workers, options, root, workdir, monitor, connect):
+    prefix = 'loadtest-{}-{}'.format(workers, uuid.uuid4().hex[:8])
+    names = ['{}-{:05d}'.format(prefix, i) for i in range(options['hosts'])]
+    # Hand the hosts out round robin, like Ansible's linear strategy with this many forks
+    jobs = [(names[i::workers], options, root, workdir) for i in range(workers)]
+
+    sampler = ConnectionSampler(connect, options['sample_interval'])
+    lockWaits = serverStatus(monitor, 'Innodb_row_lock_waits')
+    sampler.start()
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers)
+    try:
+        samples = [sample for samples in pool.map(worker, jobs) for sample in samples]
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+    lockWaits = serverStatus(monitor, 'Innodb_row_lock_waits') - lockWaits
+    return names, samples, elapsed, sampler.samples, lockWaits
+
+
+def report(workers, samples, elapsed, connections, lockWaits):
+    print('\n{} workers: {} module calls in {:.1f}s, {:.1f} calls/s, {} row lock waits'.format(workers, len(samples), elapsed, len(samples) / elapsed if elapsed else 0, lockWaits))
+    if connections:
+        print('connections: peak {}, mean {:.1f}'.format(max(connections), sum(connections) / float(len(connections))))
+    print('{:<28} {:>6} {:>7} {:>9} {:>9} {:>10} {:>9} {:>8}'.format('module', 'calls', 'failed', 'p50 ms', 'p99 ms', 'deadlocks', 'timeouts', 'retries'))
+    for module in MODULES:
+        moduleSamples = [sample for sample in samples if sample['module'] == module]
+        latencies = [sample['seconds'] for sample in moduleSamples if not sample['failed']]
+        print('{:<28} {:>6} {:>7} {:>9.0f} {:>9.0f} {:>10} {:>9} {:>8}'.format(
+            module,
+            len(moduleSamples),
+            sum(1 for sample in moduleSamples if sample['failed']),
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            sum(sample['deadlocks'] for sample in moduleSamples),
+            sum(sample['lock_timeouts'] for sample in moduleSamples),
+            sum(sample['retries'] for sample in moduleSamples),
+        ))
+    failures = sorted(set(sample['msg'] for sample in samples if sample['failed']))
+    for msg in failures[:5]:
+        print('  failed: {}'.format(msg))
+
+
+def cleanup(names, options, root, workdir):
+    connection = dict(rt_host=options['host'], rt_port=options['port'], rt_username=options['user'], rt_password=options['password'], rt_database=options['database'], rt_driver=options['driver'])
+    for i in range(0, len(names), 1000):
+        args = dict(names=names[i:i + 1000])
+        args.update(connection)
+        elapsed, result = runModule('racktables_object_decommission', args, root, workdir)
+        if result.get('failed'):
+            print('cleanup failed: {}'.format(result.get('msg')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', required=True)
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--driver', default='auto', choices=['auto', 'mysqlclient', 'pymysql'])
+    parser.add_argument('--tags', required=True, action='append', help='Tag of the networks to allocate addresses from, may be repeated')
+    parser.add_argument('--type', default='VM', help='Object type of the test objects')
+    parser.add_argument('--workers', default='1,5,10', help='Comma separated worker counts to run, one after the other')
+    parser.add_argument('--hosts', type=int, default=100, help='Hosts to provision in each run')
+    parser.add_argument('--retries', type=int, default=3, help='Times to retry a call that failed on a deadlock or lock wait timeout')
+    parser.add_argument('--sample-interval', type=float, default=0.2, help='Seconds between connection count samples')
+    parser.add_argument('--keep', action='store_true', help="Don't decommission the test objects afterwards")
+    options = vars(parser.parse_args())
+
+    racktables = loadModuleUtils()
+    def connect():
+        return racktables.dbConnect(options['host'], options['port'], options['user'], options['password'], options['database'], driver=options['driver'])
+    monitor = connect()
+    root = collectionsRoot()
+    workdir = tempfile.mkdtemp(prefix='racktables-load-args-')
+    try:
+        for workers in [int(count) for count in options['workers'].split(',')]:
+            names, samples, elapsed, connections, lockWaits = runLoad(workers, options, root, workdir, monitor, connect)
+            report(workers, samples, elapsed, connections, lockWaits)
+            if not options['keep']:
+                cleanup(names, options, root, workdir)
+    finally:
+        monitor.close()
+        shutil.rmtree(root)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
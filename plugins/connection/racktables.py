@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    author: Chandler Willoughby
+    name: racktables
+    short_description: Keep Racktables database sessions open across tasks
+    description:
+      - Runs modules locally on the controller, like the C(local) connection, and keeps their database sessions open between tasks
+      - The Racktables modules borrow an authenticated session from this connection instead of connecting to the database on every task
+      - Sessions are pooled per database server and credentials, so modules keep passing I(rt_host), I(rt_username) and the other connection options as usual
+      - One pool is kept per persistent connection, which Ansible keys on C(ansible_host), C(ansible_port) and C(ansible_user).
+        Set C(ansible_host) to the same value for every host that uses this connection to have them all share one pool
+      - Each leased session runs its queries on a thread of its own. A query that is still running after a moment is
+        left to finish there while the connection answers other modules, so a query waiting on a row lock only holds up
+        the module that sent it
+    version_added: "1.1.0"
+    requirements:
+      - mysqlclient or PyMySQL (python3 library)
+    options:
+      rt_pool_size:
+        description:
+          - The maximum number of sessions kept open to each database server
+          - Modules wait for a free session once this many are in use
+        type: int
+        default: 4
+        vars:
+          - name: ansible_racktables_pool_size
+      rt_lease_timeout:
+        description:
+          - Seconds a module can hold a session without using it before the session is rolled back and handed to another module
+          - This only matters when a module dies without giving its session back
+        type: int
+        default: 60
+        vars:
+          - name: ansible_racktables_lease_timeout
+      persistent_connect_timeout:
+        description:
+          - Seconds the connection stays open without any module using it before it is shut down, closing all of its sessions
+        type: int
+        default: 60
+        ini:
+          - section: persistent_connection
+            key: connect_timeout
+        env:
+          - name: ANSIBLE_PERSISTENT_CONNECT_TIMEOUT
+        vars:
+          - name: ansible_connect_timeout
+      persistent_command_timeout:
+        description:
+          - Seconds to wait for a single query to complete
+          - A query that takes longer is left to finish on its own and its session is closed afterwards, instead of being
+            handed to another module
+        type: int
+        default: 30
+        ini:
+          - section: persistent_connection
+            key: command_timeout
+        env:
+          - name: ANSIBLE_PERSISTENT_COMMAND_TIMEOUT
+        vars:
+          - name: ansible_command_timeout
+      persistent_log_messages:
+        description:
+          - Log every request and response to the Ansible log file
+          - This includes the database credentials the modules send, only enable it for debugging
+        type: boolean
+        default: false
+        ini:
+          - section: persistent_connection
+            key: log_messages
+        env:
+          - name: ANSIBLE_PERSISTENT_LOG_MESSAGES
+        vars:
+          - name: ansible_persistent_log_messages
+"""
+
+EXAMPLES = """
+- hosts: vms
+  connection: cwilloughby_bw.racktables.racktables
+  vars:
+    # Share one pool of sessions between every host in the play
+    ansible_host: racktables
+  tasks:
+    - name: Create a new Racktables object
+      racktables_object:
+        name: "{{ inventory_hostname }}"
+        rt_host: rackhost.local
+        rt_username: rackuser
+        rt_password: sup3r$3cur3
+        rt_database: rackdb
+"""
+
+import datetime
+import decimal
+import hashlib
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from ansible.errors import AnsibleConnectionFailure
+from ansible.module_utils._text import to_text
+from ansible.plugins.connection import NetworkConnectionBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, dbConnect
+
+
+# Seconds a request waits for its query before answering that it is still running, so the connection can serve
+# the other modules while it runs
+REQUEST_SLICE = 0.5
+
+
+def nativeValue(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return to_text(bytes(value), errors='surrogate_or_strict')
+    return value
+
+
+class Lease(object):
+    """A session leased to a module, and the thread its queries run on.
+
+    Only that thread touches the session while the lease is held, so a query
+    blocked on the server holds up nothing but the module that sent it.
+    """
+
+    def __init__(self, key, session):
+        self.key = key
+        self.session = session
+        self.lastUsed = time.time()
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        self.started = None
+
+    def submit(self, fn, *args):
+        self.pending = self.worker.submit(fn, *args)
+        self.started = time.time()
+
+    def giveBack(self):
+        """Roll the session back on its thread once any running query ends, returns the future of that."""
+        returned = self.worker.submit(self.session.rollback)
+        self.worker.shutdown(wait=False)
+        return returned
+
+
+class Connection(NetworkConnectionBase):
+    """Pool of Racktables database sessions shared by the modules of a play."""
+
+    transport = 'cwilloughby_bw.racktables.racktables'
+    has_pipelining = False
+
+    def __init__(self, play_context, new_stdin, *args, **kwargs):
+        super(Connection, self).__init__(play_context, new_stdin, *args, **kwargs)
+        # Sessions that aren't leased to a module, keyed by server and credentials
+        self._idle = {}
+        # Leases by token
+        self._leases = {}
+        # Released leases being rolled back on their thread, as (lease, future of the rollback, whether to keep the session)
+        self._returning = []
+
+    def _connect(self):
+        if not HAVE_DB_DRIVER:
+            raise AnsibleConnectionFailure("Can't use the racktables connection: neither mysqlclient nor PyMySQL is installed")
+        self._connected = True
+        return self
+
+    def _sessionCount(self, key):
+        return len(self._idle.get(key, [])) + sum(1 for lease in self._leases.values() if lease.key == key) + sum(1 for lease, returned, keep in self._returning if lease.key == key)
+
+    def _collectReturned(self):
+        for entry in list(self._returning):
+            lease, returned, keep = entry
+            if not returned.done():
+                continue
+            self._returning.remove(entry)
+            if keep and returned.exception() is None:
+                self._idle.setdefault(lease.key, []).append(lease.session)
+            else:
+                try:
+                    lease.session.close()
+                except Exception:
+                    pass
+
+    def _reclaimExpired(self):
+        expiry = time.time() - self.get_option('rt_lease_timeout')
+        for token, lease in list(self._leases.items()):
+            if lease.pending is None and lease.lastUsed < expiry:
+                self.queue_message('vvvv', 'reclaiming expired racktables session lease %s' % token)
+                self._release(token)
+
+    def _lease(self, token):
+        try:
+            lease = self._leases[token]
+        except KeyError:
+            raise AnsibleConnectionFailure("The Racktables session lease has expired or was already released")
+        lease.lastUsed = time.time()
+        return lease
+
+    def _release(self, token, keep=True):
+        lease = self._leases.pop(token)
+        self._returning.append((lease, lease.giveBack(), keep))
+        self._collectReturned()
+
+    def _run(self, token, fn, *args):
+        lease = self._lease(token)
+        if lease.pending is not None:
+            raise AnsibleConnectionFailure("A query is already running on this Racktables session")
+        lease.submit(fn, lease.session, *args)
+        return self._wait(token, lease)
+
+    def _wait(self, token, lease):
+        try:
+            result = lease.pending.result(timeout=REQUEST_SLICE)
+        except FutureTimeout:
+            if time.time() - lease.started > self.get_option('persistent_command_timeout'):
+                # The session can't be used until the query ends, it is closed then rather than handed out again
+                self._release(token, keep=False)
+                raise AnsibleConnectionFailure("The Racktables query didn't complete within %s seconds" % self.get_option('persistent_command_timeout'))
+            return dict(pending=True)
+        finally:
+            lease.lastUsed = time.time()
+            if lease.pending is not None and lease.pending.done():
+                lease.pending = None
+        return dict(pending=False, result=result)
+
+    def rt_acquire(self, params):
+        """Lease a session to the given database, returns the token used for the other calls."""
+        self._collectReturned()
+        self._reclaimExpired()
+        key = hashlib.sha256(to_text(repr(sorted(params.items()))).encode('utf-8')).hexdigest()
+        session = None
+        while self._idle.get(key):
+            candidate = self._idle[key].pop()
+            try:
+                candidate.ping()
+                session = candidate
+                break
+            except Exception:
+                candidate.close()
+        if session is None:
+            if self._sessionCount(key) >= self.get_option('rt_pool_size'):
+                raise AnsibleConnectionFailure("Racktables session pool exhausted")
+            session = dbConnect(**params)
+        token = str(uuid.uuid4())
+        self._leases[token] = Lease(key, session)
+        return token
+
+    @staticmethod
+    def _execute(session, sql, args, many):
+        with session.cursor() as cursor:
+            if many:
+                cursor.executemany(sql, args)
+            else:
+                cursor.execute(sql, args)
+            rows = None
+            if cursor.description:
+                rows = [[nativeValue(value) for value in row] for row in cursor.fetchall()]
+            return dict(rows=rows, rowcount=cursor.rowcount, lastrowid=cursor.lastrowid)
+
+    def rt_execute(self, token, sql, args=None, many=False):
+        """Run a query on the leased session. The response is pending while it runs, see rt_wait."""
+        return self._run(token, self._execute, sql, args, many)
+
+    def rt_commit(self, token):
+        return self._run(token, lambda session: session.commit())
+
+    def rt_rollback(self, token):
+        return self._run(token, lambda session: session.rollback())
+
+    def rt_wait(self, token):
+        """Wait a little longer for the request still running on the leased session."""
+        lease = self._lease(token)
+        if lease.pending is None:
+            raise AnsibleConnectionFailure("No query is running on this Racktables session")
+        return self._wait(token, lease)
+
+    def rt_release(self, token):
+        if token in self._leases:
+            self._release(token)
+
+    def close(self):
+        for token in list(self._leases):
+            self._release(token)
+        self._collectReturned()
+        # Sessions still busy with a query are left to the process exit
+        self._returning = []
+        for sessions in self._idle.values():
+            for session in sessions:
+                try:
+                    session.close()
+                except Exception:
+                    pass
+        self._idle = {}
+        super(Connection, self).close()
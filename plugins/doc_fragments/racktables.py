@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+class ModuleDocFragment(object):
+
+    DOCUMENTATION = r'''
+options:
+    rt_host:
+        description:
+            - Hostname of the database server backing Racktables
+        required: true
+        type: str
+    rt_port:
+        description:
+            - Port for the database connection, defaults to 3306
+        required: false
+        type: int
+        default: 3306
+    rt_username:
+        description:
+            - Username that has administrative access to the racktables database
+        required: true
+        type: str
+    rt_password:
+        description:
+            - Password for the administrative user
+        required: true
+        type: str
+    rt_database:
+        description:
+            - Name of the database which backs Racktables
+        required: true
+        type: str
+    rt_read_host:
+        description:
+            - A list of read replicas of the Racktables database, as C(host) or C(host:port)
+            - Lookups, check mode and the reads made before deciding on a change use a randomly chosen replica, writes always go to I(rt_host)
+            - The primary is used if none of the replicas can be reached
+        required: false
+        type: list
+        elements: str
+    rt_read_your_writes:
+        description:
+            - Wait for the chosen replica to apply every transaction already committed on the primary before reading from it
+            - Requires GTIDs to be enabled, otherwise reads fall back to the primary
+        required: false
+        type: bool
+        default: false
+    rt_read_timeout:
+        description:
+            - Seconds to wait when connecting to a replica, and for it to catch up when I(rt_read_your_writes) is set
+        required: false
+        type: int
+        default: 5
+    rt_driver:
+        description:
+            - The database driver to connect with
+            - C(auto) uses mysqlclient when it is installed, as it decodes large results much faster, and PyMySQL otherwise
+        required: false
+        type: str
+        choices: [ auto, mysqlclient, pymysql ]
+        default: auto
+    rt_profile:
+        description:
+            - Directory to write a profile of the run to, for attaching to bug reports
+            - Each run writes a C(.prof) file for pstats and a C(.json) summary with the time spent on SQL, the local cache and pings, the peak memory and the busiest functions and allocation sites
+            - Can also be switched on with the C(RACKTABLES_PROFILE) environment variable, for modules it has to be set on the managed host, for example with the C(environment) keyword
+        required: false
+        type: path
+        env:
+            - name: RACKTABLES_PROFILE
+notes:
+    - When the play uses the C(cwilloughby_bw.racktables.racktables) connection, modules borrow a database session kept open by the connection instead of connecting on every task
+'''
+
+    CACHE = r'''
+options:
+    rt_cache_path:
+        description:
+            - Path to an SQLite file holding a local copy of the Racktables data, it is created if it doesn't exist
+            - When set, the lookup answers from this file and only pulls what changed in Racktables since the last refresh
+            - Use a separate file for each Racktables database
+        required: false
+        type: path
+        env:
+            - name: RACKTABLES_CACHE_PATH
+    rt_cache_max_age:
+        description:
+            - Seconds a refresh of the cache is trusted for, lookups made within this time don't query the database at all
+            - Set to 0 to check for changes on every lookup
+        required: false
+        type: int
+        default: 30
+        env:
+            - name: RACKTABLES_CACHE_MAX_AGE
+    rt_cache_reconcile_interval:
+        description:
+            - Seconds between full comparisons of the cache with the database
+            - Deletions, and changes that Racktables doesn't record in its history, such as those made by the modules in this collection, only show up in the cache after the next full comparison
+        required: false
+        type: int
+        default: 3600
+        env:
+            - name: RACKTABLES_CACHE_RECONCILE_INTERVAL
+'''
+
+    INSTANCES = r'''
+options:
+    rt_instances:
+        description:
+            - Query several Racktables instances at once, such as one per region, and merge their results
+            - Each entry is a dictionary with a C(name) for the instance and any of the C(rt_) connection options, including I(rt_cache_path), which take precedence over the lookup's own for that instance
+            - The lookup's own connection options, I(rt_host) included, can be left out when every instance sets them
+            - The instances are queried concurrently, and every item of the result gets an C(instance) key with the name of the instance it came from, which defaults to its I(rt_host)
+            - The lookup's own I(rt_cache_path) isn't used for the instances, as a cache file only holds one database
+            - An instance that fails or times out is left out of the result with a warning, the lookup only fails when none of them answered
+        required: false
+        type: list
+        elements: dict
+    rt_instance_timeout:
+        description:
+            - Seconds each instance in I(rt_instances) has to connect and answer
+        required: false
+        type: int
+        default: 30
+    rt_instance_workers:
+        description:
+            - Number of instances in I(rt_instances) queried at the same time
+        required: false
+        type: int
+        default: 8
+'''
+
+    MEMO = r'''
+options:
+    rt_memo_ttl:
+        description:
+            - Seconds the result of a call is reused for by later calls with the same arguments, such as the same lookup in a template rendered for every host
+            - Set to 0 to always query Racktables
+        required: false
+        type: int
+        default: 30
+        env:
+            - name: RACKTABLES_MEMO_TTL
+    rt_memo_size:
+        description:
+            - Number of results kept in memory, the least recently used are dropped first
+        required: false
+        type: int
+        default: 128
+        env:
+            - name: RACKTABLES_MEMO_SIZE
+    rt_memo_dir:
+        description:
+            - Directory to also keep the results in, so they are shared between the processes Ansible runs each host's tasks in
+            - Without it, results are only reused within the same task for the same host, such as in a loop
+            - The files hold the results of the lookups, use a directory only you can read
+        required: false
+        type: path
+        env:
+            - name: RACKTABLES_MEMO_DIR
+notes:
+    - Changes made to Racktables while the play runs, including by the modules in this collection, show up in the results after at most I(rt_memo_ttl) seconds
+    - Lookups whose results are used to claim something, such as racktables_ipv4_nextfree and racktables_rack_space, are never memoized
+'''
@@ -0,0 +1,225 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    lookup: racktables_cable_trace
+    author: Chandler Willoughby
+    version_added: "1.1.0"
+    short_description: Trace the cables from the ports of an object to the far end
+    requirements:
+      - mysqlclient or PyMySQL (python3 library)
+    description:
+      - Follows the cables (Link) from each port, and through patch panels along their backend links (LinkBackend, Racktables 0.21 and later), until a port with no further link is reached
+      - On MySQL 8.0 and MariaDB 10.2 or later the links of every port connected to the traced ports are read with a single recursive query, and the paths are then followed in memory
+      - Older servers are walked a hop at a time, with the links of every traced port loaded together in each round
+      - A path that comes back to a port it already went through stops there and is flagged as a loop
+      - When a port has several backend links, the one to the port with the lowest id is followed
+    options:
+        object:
+            description: The name of the object to trace from
+            required: true
+            type: string
+        ports:
+            description:
+              - The names of the ports to trace
+              - Every port of the object is traced when this isn't set
+            required: false
+            type: list
+        method:
+            description:
+              - C(auto) uses a recursive query when the server supports it, C(recursive) and C(breadth_first) force either way
+            required: false
+            type: string
+            default: auto
+            choices: [ auto, recursive, breadth_first ]
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.instances
+      - cwilloughby_bw.racktables.racktables.memo
+"""
+
+EXAMPLES = """
+- name: follow the uplink of a server
+  debug: msg="{{ lookup('racktables_cable_trace', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', object='coolhost.local', ports=['eth0']) }}"
+
+- name: map every port of a switch to what is at the other end
+  debug: msg="{{ item.port }} -> {{ item.far_end.object | default('nothing') }} {{ item.far_end.port | default('') }}"
+  loop: "{{ query('racktables_cable_trace', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', object='sw1.lab1') }}"
+"""
+
+RETURN = """
+  _list:
+    description:
+      - One entry per traced port, in the order of I(ports) or by port name, with its C(object), C(port), C(label) and C(type)
+      - C(hops) lists the ports the path goes through after it, each with its C(object), C(port), C(label), the C(link) it was reached by (C(front) for a cable, C(back) for a backend link) and that link's C(cable) id
+      - C(far_end) is the last of the hops, or null when the port isn't linked
+      - C(loop) is true when the path came back to a port it had already gone through
+    type: list
+"""
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native
+from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_memo import memoized
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
+
+# Maximum number of values bound into a single IN (...) clause
+BATCH_SIZE = 1000
+
+# Cables between ports, and the backend links Racktables 0.21 added for patch panels
+LINK_TABLES = (('front', 'Link'), ('back', 'LinkBackend'))
+
+# Every port connected to the starting ports is collected first, joining each link table on either end of its links
+# so only the links of the ports reached are read. UNION drops the ports reached again so loops end, and the links
+# found from both of their ends. {steps} holds STEP_SQL and {links} LINKS_SQL for each link table.
+STEP_SQL = """
+    UNION
+    SELECT L.portb FROM component C JOIN {0} L ON L.porta=C.id
+    UNION
+    SELECT L.porta FROM component C JOIN {0} L ON L.portb=C.id"""
+LINKS_SQL = """SELECT '{0}', L.porta, L.portb, L.cable FROM component C JOIN {1} L ON L.porta=C.id
+UNION
+SELECT '{0}', L.porta, L.portb, L.cable FROM component C JOIN {1} L ON L.portb=C.id"""
+COMPONENT_SQL = """WITH RECURSIVE component (id) AS (
+    SELECT P.id FROM Port P WHERE P.id IN ({ids}){steps}
+)
+{links}"""
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+def supportsRecursiveQueries(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT VERSION()")
+        version = cursor.fetchone()[0]
+    numbers = [int(part) for part in version.split('-')[0].split('.')[:3] if part.isdigit()]
+    if 'mariadb' in version.lower():
+        return numbers >= [10, 2, 2]
+    return numbers >= [8, 0, 1]
+
+def portDetails(port):
+    return {"object":port[1],"port":port[2],"label":port[3]}
+
+class LookupModule(LookupBase):
+
+    @profiled_lookup('racktables_cable_trace')
+    @memoized('racktables_cable_trace')
+    @fan_out
+    def run(self, terms, variables=None, **kwargs):
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_cable_trace): neither mysqlclient nor PyMySQL is installed")
+        self.set_options(var_options=variables, direct=kwargs)
+        try:
+            connection = RacktablesDB(lookup_params(self)).read
+        except RacktablesError as e:
+            raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
+
+        method = self.get_option('method')
+        if method == 'auto':
+            method = 'recursive' if supportsRecursiveQueries(connection) else 'breadth_first'
+
+        rt_port_sql = "SELECT P.id, O.name, P.name, P.label, POI.oif_name FROM Port P JOIN `Object` O ON O.id=P.object_id LEFT JOIN PortOuterInterface POI ON POI.id=P.type WHERE "
+        # Port id -> (id, object, name, label, type)
+        ports = {}
+        # (link type, port id) -> [(other port id, cable)], sorted by port id
+        links = {}
+        with connection.cursor() as cursor:
+            cursor.execute(rt_port_sql + "O.name=%s ORDER BY P.name, P.id",self.get_option('object'))
+            objectPorts = cursor.fetchall()
+            if not objectPorts:
+                cursor.execute("SELECT id FROM `Object` WHERE name=%s",self.get_option('object'))
+                if not cursor.fetchone():
+                    raise AnsibleError("Object {} doesn't exist".format(self.get_option('object')))
+            ports.update((port[0], port) for port in objectPorts)
+
+            if self.get_option('ports'):
+                byName = {}
+                for port in objectPorts:
+                    byName.setdefault(port[2], port)
+                missing = [name for name in self.get_option('ports') if name not in byName]
+                if missing:
+                    raise AnsibleError("The following ports do not exist on {}: {}".format(self.get_option('object'), ', '.join(missing)))
+                startPorts = [byName[name] for name in self.get_option('ports')]
+            else:
+                startPorts = list(objectPorts)
+
+            linkTables = list(LINK_TABLES)
+            try:
+                cursor.execute("SELECT 1 FROM LinkBackend LIMIT 0")
+                cursor.fetchall()
+            except DBError:
+                # Racktables before 0.21 only has cables
+                linkTables = linkTables[:1]
+
+            def addLink(linkType, near, far, cable):
+                if (linkType, near) in links and (far, cable) in links[(linkType, near)]:
+                    return
+                links.setdefault((linkType, near), []).append((far, cable))
+                seen.add(far)
+
+            frontier = sorted(set(port[0] for port in startPorts))
+            seen = set(frontier)
+            if method == 'recursive':
+                steps = ''.join(STEP_SQL.format(table) for linkType, table in linkTables)
+                linkSql = "\nUNION\n".join(LINKS_SQL.format(linkType, table) for linkType, table in linkTables)
+                for batch in batches(frontier):
+                    try:
+                        cursor.execute(COMPONENT_SQL.format(ids=inPlaceholders(batch), steps=steps, links=linkSql),batch)
+                    except DBError as e:
+                        raise AnsibleError("The recursive cable trace query failed, set method=breadth_first for servers older than MySQL 8.0 or MariaDB 10.2: %s" % to_native(e))
+                    for linkType, porta, portb, cable in cursor.fetchall():
+                        addLink(linkType, porta, portb, cable)
+                        addLink(linkType, portb, porta, cable)
+            else:
+                # Load the links of every port reached so far, one hop further each round
+                while frontier:
+                    known = set(seen)
+                    for linkType, table in linkTables:
+                        for batch in batches(frontier):
+                            cursor.execute("SELECT porta, portb, cable FROM {0} WHERE porta IN ({1}) OR portb IN ({1})".format(table, inPlaceholders(batch)),batch + batch)
+                            for porta, portb, cable in cursor.fetchall():
+                                addLink(linkType, porta, portb, cable)
+                                addLink(linkType, portb, porta, cable)
+                    frontier = sorted(seen - known)
+
+            unknown = sorted(seen - set(ports))
+            for batch in batches(unknown):
+                cursor.execute(rt_port_sql + "P.id IN ({})".format(inPlaceholders(batch)),batch)
+                ports.update((port[0], port) for port in cursor.fetchall())
+
+        for linked in links.values():
+            linked.sort(key=lambda link: link[0])
+
+        result = []
+        for port in startPorts:
+            traceObject = {"object":"","port":"","label":"","type":"","hops":[],"far_end":None,"loop":False}
+            traceObject['object'] = port[1]
+            traceObject['port'] = port[2]
+            traceObject['label'] = port[3]
+            traceObject['type'] = port[4]
+            visited = set([port[0]])
+            current = port[0]
+            # Start with the cable when there is one, then alternate between cables and backend links
+            linkType = 'front' if ('front', current) in links or ('back', current) not in links else 'back'
+            while (linkType, current) in links:
+                far, cable = links[(linkType, current)][0]
+                if far in visited:
+                    traceObject['loop'] = True
+                    break
+                hop = portDetails(ports[far])
+                hop['link'] = linkType
+                hop['cable'] = cable
+                traceObject['hops'].append(hop)
+                visited.add(far)
+                current = far
+                linkType = 'back' if linkType == 'front' else 'front'
+            if traceObject['hops']:
+                traceObject['far_end'] = portDetails(ports[current])
+            result.append(traceObject)
+        return result
@@ -0,0 +1,179 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    lookup: racktables_find
+    author: Chandler Willoughby
+    version_added: "1.1.0"
+    short_description: Find the objects that own a list of IPv4 addresses or MAC addresses
+    requirements:
+      - mysqlclient or PyMySQL (python3 library)
+    description:
+      - Returns one entry per requested address with the objects, interfaces and networks it belongs to
+      - Addresses are resolved in batches, so thousands of them only take a handful of queries
+    options:
+        ips:
+            description: A list of IPv4 addresses to look for
+            required: false
+            type: list
+        macs:
+            description:
+              - A list of MAC addresses (or other port L2 addresses) to look for
+              - Any of the usual notations are accepted, such as C(00:25:b5:00:0a:1f), C(00-25-B5-00-0A-1F) or C(0025.b500.0a1f)
+            required: false
+            type: list
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.cache
+      - cwilloughby_bw.racktables.racktables.instances
+      - cwilloughby_bw.racktables.racktables.memo
+"""
+
+EXAMPLES = """
+- name: find the owners of addresses seen in the logs
+  debug: msg="{{ query('racktables_find', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', ips=['10.0.0.10','10.0.0.11'], macs=['00:25:b5:00:0a:1f']) }}"
+
+- name: find an address in whichever region has it
+  debug: msg="{{ query('racktables_find', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', ips=['10.0.0.10'], rt_instances=regions) | selectattr('found') | list }}"
+  vars:
+    regions:
+      - { name: us, rt_host: rack-us.local }
+      - { name: eu, rt_host: rack-eu.local }
+"""
+
+RETURN = """
+  _list:
+    description:
+      - One entry per requested address, IPv4 addresses first, in the order they were given
+      - IPv4 entries have the allocations of the address in C(objects), its IPv4Address C(name), C(comment) and C(reserved) flag, and the C(network) it belongs to
+      - MAC entries have the C(ports) with that address, each with the owning object and the addresses allocated on the port's interface
+      - C(found) is false when Racktables knows nothing about the address
+    type: list
+"""
+
+import ipaddress
+import re
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native, to_text
+from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_cache import cached_connection
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_memo import memoized
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
+
+# Maximum number of values bound into a single IN (...) clause
+BATCH_SIZE = 1000
+
+# Lengths in hex digits of the L2 addresses Racktables stores: MAC-48, EUI-64/WWN and IPoIB
+L2ADDRESS_LENGTHS = (12, 16, 40)
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+def normalizeL2Address(l2address):
+    # Racktables stores L2 addresses as uppercase hex digits without separators
+    normalized = re.sub(r'[\s:.-]', '', l2address).upper()
+    if len(normalized) not in L2ADDRESS_LENGTHS or not re.match(r'^[0-9A-F]+$', normalized):
+        raise AnsibleError("{} is not a valid MAC address".format(l2address))
+    return normalized
+
+class LookupModule(LookupBase):
+
+    @profiled_lookup('racktables_find')
+    @memoized('racktables_find')
+    @fan_out
+    def run(self, terms, variables=None, **kwargs):
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_find): neither mysqlclient nor PyMySQL is installed")
+        self.set_options(var_options=variables, direct=kwargs)
+
+        addresses = []
+        for ip in self.get_option('ips') or []:
+            try:
+                addresses.append(int(ipaddress.IPv4Address(to_text(ip).strip())))
+            except ValueError:
+                raise AnsibleError("{} is not a valid IPv4 address".format(ip))
+        l2addresses = [normalizeL2Address(to_text(mac)) for mac in self.get_option('macs') or []]
+        if not addresses and not l2addresses:
+            return []
+
+        try:
+            params = lookup_params(self)
+            connection = cached_connection(self, params) or RacktablesDB(params).read
+        except RacktablesError as e:
+            raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
+
+        with connection.cursor() as cursor:
+            # Every network, most specific first, for the longest prefix match below
+            cursor.execute("SELECT N.ip, N.mask, N.name, V.vlan_id FROM IPv4Network N LEFT JOIN VLANIPv4 V ON V.ipv4net_id=N.id ORDER BY N.mask DESC")
+            networksByMask = {}
+            for network in cursor.fetchall():
+                networksByMask.setdefault(network[1], {})[network[0]] = dict(network='{}/{}'.format(ipaddress.IPv4Address(network[0]), network[1]), name=network[2], vlan=network[3])
+            masks = sorted(networksByMask, reverse=True)
+
+            def findNetwork(ip):
+                for mask in masks:
+                    network = networksByMask[mask].get(ip & (0xFFFFFFFF << (32 - mask)) & 0xFFFFFFFF)
+                    if network:
+                        return network
+                return None
+
+            uniqueAddresses = list(dict.fromkeys(addresses))
+            allocations = {}
+            addressDetails = {}
+            for batch in batches(uniqueAddresses):
+                cursor.execute("SELECT A.ip, O.name, A.name, A.type FROM IPv4Allocation A, `Object` O WHERE O.id=A.object_id AND A.ip IN ({}) ORDER BY O.name".format(inPlaceholders(batch)),batch)
+                for row in cursor.fetchall():
+                    allocations.setdefault(row[0], []).append(dict(name=row[1], ifname=row[2], type=row[3]))
+                cursor.execute("SELECT ip, name, comment, reserved FROM IPv4Address WHERE ip IN ({})".format(inPlaceholders(batch)),batch)
+                for row in cursor.fetchall():
+                    addressDetails[row[0]] = row
+
+            uniqueL2Addresses = list(dict.fromkeys(l2addresses))
+            ports = {}
+            for batch in batches(uniqueL2Addresses):
+                cursor.execute("SELECT P.l2address, P.object_id, O.name, P.name, P.label FROM Port P, `Object` O WHERE O.id=P.object_id AND P.l2address IN ({}) ORDER BY O.name, P.name".format(inPlaceholders(batch)),batch)
+                for row in cursor.fetchall():
+                    ports.setdefault(row[0], []).append(row[1:])
+
+            # Addresses allocated on the interfaces that own the requested MACs
+            portAddresses = {}
+            objectIds = sorted(set(port[0] for matches in ports.values() for port in matches))
+            for batch in batches(objectIds):
+                cursor.execute("SELECT object_id, name, ip FROM IPv4Allocation WHERE object_id IN ({}) ORDER BY ip".format(inPlaceholders(batch)),batch)
+                for row in cursor.fetchall():
+                    portAddresses.setdefault((row[0], row[1]), []).append(row[2])
+
+        result = []
+        for ip in addresses:
+            details = addressDetails.get(ip)
+            addressObject = {"query":"","type":"ip","found":False,"objects":[],"name":"","comment":"","reserved":False,"network":None}
+            addressObject['query'] = str(ipaddress.IPv4Address(ip))
+            addressObject['objects'] = allocations.get(ip, [])
+            if details:
+                addressObject['name'] = details[1]
+                addressObject['comment'] = details[2]
+                addressObject['reserved'] = details[3] == 'yes'
+            addressObject['network'] = findNetwork(ip)
+            addressObject['found'] = bool(addressObject['objects'] or details)
+            result.append(addressObject)
+        for l2address, original in zip(l2addresses, self.get_option('macs')):
+            portObject = {"query":"","type":"mac","l2address":"","found":False,"ports":[]}
+            portObject['query'] = original
+            portObject['l2address'] = l2address
+            for objectId, objectName, ifname, label in ports.get(l2address, []):
+                portObject['ports'].append(dict(
+                    object=objectName,
+                    ifname=ifname,
+                    label=label,
+                    addresses=[dict(address=str(ipaddress.IPv4Address(ip)), network=findNetwork(ip)) for ip in portAddresses.get((objectId, ifname), [])],
+                ))
+            portObject['found'] = bool(portObject['ports'])
+            result.append(portObject)
+        return result
@@ -0,0 +1,199 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    lookup: racktables_hierarchy
+    author: Chandler Willoughby
+    version_added: "1.1.0"
+    short_description: Lookup every ancestor or descendant of objects in Racktables
+    requirements:
+      - mysqlclient or PyMySQL (python3 library)
+    description:
+      - Follows the parent and child links between objects, as managed by racktables_object_link, for example from a cluster to its hypervisors, their VMs and their containers
+      - On MySQL 8.0 and MariaDB 10.2 or later the whole hierarchy is read with a single recursive query
+      - Older servers are walked one level at a time, with the objects of each level fetched together
+      - Objects linked in a loop are only returned once
+    options:
+        objects:
+            description: The names of the objects to start from
+            required: true
+            type: list
+        direction:
+            description: Whether to return the objects below (C(descendants)) or above (C(ancestors)) each object
+            required: false
+            type: string
+            default: descendants
+            choices: [ descendants, ancestors ]
+        depth:
+            description:
+              - How many levels of links to follow, 1 only returns the direct children or parents
+              - 0 follows the links all the way
+            required: false
+            type: int
+            default: 0
+        method:
+            description:
+              - C(auto) uses a recursive query when the server supports it, C(recursive) and C(breadth_first) force either way
+            required: false
+            type: string
+            default: auto
+            choices: [ auto, recursive, breadth_first ]
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.instances
+      - cwilloughby_bw.racktables.racktables.memo
+"""
+
+EXAMPLES = """
+- name: list every VM and container in a cluster
+  debug: msg="{{ lookup('racktables_hierarchy', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', objects=['cluster1.lab1']) }}"
+
+- name: find the hypervisor and cluster a VM runs on
+  debug: msg="{{ lookup('racktables_hierarchy', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', objects=['vm1.lab1'], direction='ancestors') }}"
+"""
+
+RETURN = """
+  _list:
+    description:
+      - One entry per requested object, with its C(object) name, whether it was C(found), and the related C(objects)
+      - Each related object has its C(name), C(type), its C(depth) from the requested object and the C(parent) (or C(child) for ancestors) it was reached through, ordered by depth and name
+      - An object reachable along several paths is listed once, at its smallest depth
+    type: list
+"""
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native
+from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_memo import memoized
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
+
+# Maximum number of values bound into a single IN (...) clause
+BATCH_SIZE = 1000
+
+# MySQL stops recursive queries at cte_max_recursion_depth, 1000 by default
+MAX_DEPTH = 1000
+
+# The recursive query keeps the path it followed as ',id,id,...,' so links leading back into it can be skipped.
+# {near} is the end of the link already reached, {far} the end to follow, parent and child for descendants.
+HIERARCHY_SQL = """WITH RECURSIVE hierarchy (root_id, id, via_id, depth, path) AS (
+    SELECT RTO.id, RTE.{far}_entity_id, RTE.{near}_entity_id, 1, CAST(CONCAT(',', RTO.id, ',', RTE.{far}_entity_id, ',') AS CHAR(8000))
+    FROM `Object` RTO, EntityLink RTE
+    WHERE RTE.{near}_entity_id=RTO.id AND RTE.parent_entity_type='object' AND RTE.child_entity_type='object' AND RTO.name IN ({names}) AND RTE.{far}_entity_id<>RTO.id
+    UNION ALL
+    SELECT H.root_id, RTE.{far}_entity_id, RTE.{near}_entity_id, H.depth + 1, CONCAT(H.path, RTE.{far}_entity_id, ',')
+    FROM hierarchy H, EntityLink RTE
+    WHERE RTE.{near}_entity_id=H.id AND RTE.parent_entity_type='object' AND RTE.child_entity_type='object' AND H.depth < %s AND LOCATE(CONCAT(',', RTE.{far}_entity_id, ','), H.path)=0
+)
+SELECT H.root_id, H.id, H.via_id, H.depth FROM hierarchy H ORDER BY H.root_id, H.id, H.depth, H.via_id"""
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+def supportsRecursiveQueries(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT VERSION()")
+        version = cursor.fetchone()[0]
+    numbers = [int(part) for part in version.split('-')[0].split('.')[:3] if part.isdigit()]
+    if 'mariadb' in version.lower():
+        return numbers >= [10, 2, 2]
+    return numbers >= [8, 0, 1]
+
+class LookupModule(LookupBase):
+
+    @profiled_lookup('racktables_hierarchy')
+    @memoized('racktables_hierarchy')
+    @fan_out
+    def run(self, terms, variables=None, **kwargs):
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_hierarchy): neither mysqlclient nor PyMySQL is installed")
+        self.set_options(var_options=variables, direct=kwargs)
+        names = list(dict.fromkeys(self.get_option('objects')))
+        depth = self.get_option('depth')
+        if depth < 0:
+            raise AnsibleError("depth must not be negative")
+        depth = min(depth or MAX_DEPTH, MAX_DEPTH)
+        near, far = ('parent', 'child') if self.get_option('direction') == 'descendants' else ('child', 'parent')
+        try:
+            connection = RacktablesDB(lookup_params(self)).read
+        except RacktablesError as e:
+            raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
+
+        method = self.get_option('method')
+        if method == 'auto':
+            method = 'recursive' if supportsRecursiveQueries(connection) else 'breadth_first'
+
+        rtObjects = {}
+
+        def getObjects(cursor, sql, values):
+            for batch in batches(values):
+                cursor.execute("SELECT RTO.id, RTO.name, RTD.dict_value FROM `Object` RTO, Dictionary RTD WHERE RTD.dict_key=RTO.objtype_id AND " + sql.format(inPlaceholders(batch)),batch)
+                rtObjects.update((row[0], row[1:]) for row in cursor.fetchall())
+
+        # (root id, related id) -> (depth, id the related object was reached through)
+        related = {}
+        with connection.cursor() as cursor:
+            getObjects(cursor, "RTO.name IN ({})", names)
+            roots = dict((rtObject[0], objectId) for objectId, rtObject in rtObjects.items())
+            if not roots:
+                return [{"object":name,"found":False,"objects":[]} for name in names]
+
+            if method == 'recursive':
+                for batch in batches(names):
+                    try:
+                        cursor.execute(HIERARCHY_SQL.format(near=near, far=far, names=inPlaceholders(batch)),batch + [depth])
+                    except DBError as e:
+                        raise AnsibleError("The recursive hierarchy query failed, set method=breadth_first for servers older than MySQL 8.0 or MariaDB 10.2: %s" % to_native(e))
+                    for rootId, objectId, viaId, level in cursor.fetchall():
+                        # Rows come ordered by depth and then by the id they were reached through, the first one wins
+                        if objectId != rootId and (rootId, objectId) not in related:
+                            related[(rootId, objectId)] = (level, viaId)
+            else:
+                # Walk every requested object's hierarchy together, one level per round of queries
+                links = {}
+                frontier = sorted(roots.values())
+                seen = set(frontier)
+                for level in range(depth):
+                    if not frontier:
+                        break
+                    for batch in batches(frontier):
+                        cursor.execute("SELECT {near}_entity_id, {far}_entity_id FROM EntityLink WHERE parent_entity_type='object' AND child_entity_type='object' AND {near}_entity_id IN ({ids}) ORDER BY {near}_entity_id, {far}_entity_id".format(near=near, far=far, ids=inPlaceholders(batch)),batch)
+                        for nearId, farId in cursor.fetchall():
+                            links.setdefault(nearId, []).append(farId)
+                    frontier = sorted(set(farId for nearId in frontier for farId in links.get(nearId, [])) - seen)
+                    seen.update(frontier)
+                for rootId in roots.values():
+                    visited = set([rootId])
+                    current = [rootId]
+                    for level in range(1, depth + 1):
+                        reached = {}
+                        for nearId in sorted(current):
+                            for farId in links.get(nearId, []):
+                                if farId not in visited and farId not in reached:
+                                    reached[farId] = nearId
+                        for farId, nearId in reached.items():
+                            related[(rootId, farId)] = (level, nearId)
+                        visited.update(reached)
+                        current = list(reached)
+                        if not current:
+                            break
+
+            getObjects(cursor, "RTO.id IN ({})", sorted(set(objectId for rootId, objectId in related) - set(rtObjects)))
+
+        via = 'parent' if near == 'parent' else 'child'
+        hierarchies = {}
+        for (rootId, objectId), (level, viaId) in related.items():
+            hierarchies.setdefault(rootId, []).append({"name":rtObjects[objectId][0],"type":rtObjects[objectId][1],"depth":level,via:rtObjects[viaId][0]})
+        result = []
+        for name in names:
+            hierarchyObject = {"object":name,"found":False,"objects":[]}
+            if name in roots:
+                hierarchyObject['found'] = True
+                hierarchyObject['objects'] = sorted(hierarchies.get(roots[name], []), key=lambda related: (related['depth'], related['name']))
+            result.append(hierarchyObject)
+        return result
@@ -7,7 +7,7 @@ DOCUMENTATION = """
     version_added: "0.0"
     short_description: Lookup the next free ipv4 address that matches the provided tags
     requirements:
-      - PyMySql (python3 library)
+      - mysqlclient or PyMySQL (python3 library)
     description:
       - Returns a new IPv4 address/gateway/netmask that matches the provided tags
     options:
@@ -15,27 +15,8 @@ DOCUMENTATION = """
             description: A list containg the tags that the networks should have
             required: true
             type: list
-        rt_host:
-            description: Hostname of the database server backing Racktables
-            required: true
-            type: string
-        rt_port:
-            description: Port for the database connection, defaults to 3306
-            required: false
-            type: integer
-            default: 3306
-        rt_username:
-            description: Username that has administrative access to the racktables database
-            required: true
-            type: string
-        rt_password:
-            description: Password for the administrative user
-            required: true
-            type: string
-        rt_database:
-            description: Name of the database which backs Racktables
-            required: true
-            type: string
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
 """
 
 EXAMPLES = """
@@ -50,29 +31,26 @@ RETURN = """
     type: dict
 """
 
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
+import ipaddress
+import os
 
 from ansible.errors import AnsibleError
 from ansible.module_utils._text import to_native
 from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup, phase
 
 class LookupModule(LookupBase):
 
+    @profiled_lookup('racktables_ipv4_nextfree')
     def run(self, terms, variables=None, **kwargs):
-        if HAVE_PYMYSQL is False:
-            raise AnsibleError("Can't LOOKUP(racktables_ipv4_nextfree): module PyMySQL is not installed")
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_ipv4_nextfree): neither mysqlclient nor PyMySQL is installed")
         self.set_options(var_options=variables, direct=kwargs)
         result = []
         try:
-            connection = pymysql.connect(host=self.get_option('rt_host'),port=self.get_option('rt_port'),user=self.get_option('rt_username'),password=self.get_option('rt_password'),db=self.get_option('rt_database'))
-        except Exception as e:
+            connection = RacktablesDB(lookup_params(self)).read
+        except RacktablesError as e:
             raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
         rt_network_sql_start = "SELECT INET_NTOA(IPv4Network.ip),IPv4Network.mask,IPv4Network.name,VLANIPv4.vlan_id FROM IPv4Network,TagStorage,VLANIPv4 WHERE IPv4Network.id=TagStorage.entity_id AND TagStorage.entity_realm='ipv4net' AND TagStorage.tag_id in ( "
         rt_network_sql_tags = ""
@@ -96,7 +74,8 @@ class LookupModule(LookupBase):
                     # Check if the IP is registered anywhere in Racktables
                     if not cursor.fetchall():
                         # Check if the IP responds to pings
-                        pingtest = os.system("ping -c 1 -W 2 " + str(address) + ">/dev/null")
+                        with phase('ping'):
+                            pingtest = os.system("ping -c 1 -W 2 " + str(address) + ">/dev/null")
                         if pingtest == 0:
                             raise AnsibleError("The address {} wasn't in Racktables, but responded to a ping. Please investigate!".format(str(address)))
                         else:
@@ -0,0 +1,94 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    lookup: racktables_ipv4_nextfree_network
+    author: Chandler Willoughby
+    version_added: "1.1.0"
+    short_description: Lookup the first free subnet of a given size inside a container network
+    requirements:
+      - mysqlclient or PyMySQL (python3 library)
+    description:
+      - Returns the first aligned network of the requested size that doesn't overlap any network already in Racktables
+      - The result is only a suggestion, use the racktables_ipv4_network module to claim a subnet safely when several plays may run at once
+    options:
+        container:
+            description:
+              - The network to carve the subnet out of, in CIDR notation
+              - It doesn't need to exist in Racktables
+              - Either I(container) or I(container_tags) is required
+            required: false
+            type: string
+        container_tags:
+            description:
+              - Carve the subnet out of the first network that has all of these tags and has room for it
+            required: false
+            type: list
+        mask:
+            description: The prefix length of the subnet, for example 29 for a /29
+            required: true
+            type: int
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+"""
+
+EXAMPLES = """
+- name: find a free /29 in the lab supernet
+  debug: msg="{{ lookup('racktables_ipv4_nextfree_network', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', container='10.0.0.0/8', mask=29) }}"
+"""
+
+RETURN = """
+  _network:
+    description:
+      - Dictionary with the free C(network) in CIDR notation, its C(netmask), and the C(container) and C(container_name) it was carved from
+    type: dict
+"""
+
+import ipaddress
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native, to_text
+from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_ipam import carveSubnet, formatNetwork, getTaggedNetworks
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
+
+class LookupModule(LookupBase):
+
+    @profiled_lookup('racktables_ipv4_nextfree_network')
+    def run(self, terms, variables=None, **kwargs):
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_ipv4_nextfree_network): neither mysqlclient nor PyMySQL is installed")
+        self.set_options(var_options=variables, direct=kwargs)
+        mask = self.get_option('mask')
+        if mask < 1 or mask > 32:
+            raise AnsibleError("mask must be between 1 and 32")
+        if not self.get_option('container') and not self.get_option('container_tags'):
+            raise AnsibleError("Either container or container_tags is required")
+        try:
+            connection = RacktablesDB(lookup_params(self)).read
+        except RacktablesError as e:
+            raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
+
+        if self.get_option('container'):
+            try:
+                container = ipaddress.IPv4Network(to_text(self.get_option('container')))
+            except ValueError as e:
+                raise AnsibleError("The container {} is not a valid IPv4 network: {}".format(self.get_option('container'), to_native(e)))
+            containers = [(int(container.network_address), container.prefixlen, '')]
+        else:
+            containers = [network[1:] for network in getTaggedNetworks(connection, sorted(set(self.get_option('container_tags'))))]
+            if not containers:
+                raise AnsibleError("No networks were returned, please check your provided tags")
+
+        carved = carveSubnet(connection, containers, mask)
+        if not carved:
+            raise AnsibleError("There is no free /{} left in {}".format(mask, ', '.join(formatNetwork(container[0], container[1]) for container in containers)))
+        ip, container = carved
+        subnet = ipaddress.IPv4Network(formatNetwork(ip, mask))
+        networkObject={"network":"","netmask":"","container":"","container_name":""}
+        networkObject['network'] = str(subnet)
+        networkObject['netmask'] = str(subnet.netmask)
+        networkObject['container'] = formatNetwork(container[0], container[1])
+        networkObject['container_name'] = container[2]
+        return [networkObject]
@@ -0,0 +1,186 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    lookup: racktables_network_usage
+    author: Chandler Willoughby
+    version_added: "1.1.0"
+    short_description: Report how full the IPv4 networks in Racktables are
+    requirements:
+      - mysqlclient or PyMySQL (python3 library)
+    description:
+      - Returns the used, reserved and free address counts and the largest free block of each network
+      - An address is used when it is allocated to an object, and reserved when it is marked as reserved in Racktables without being allocated
+      - The network and broadcast addresses aren't counted, except in /31 and /32 networks
+      - Addresses in nested networks count towards both the inner and the outer network
+    options:
+        tags:
+            description:
+              - Only report on the networks that have all of these tags
+              - Every network is reported on when this isn't set
+            required: false
+            type: list
+        threshold:
+            description:
+              - Flag networks whose used and reserved addresses reach this percentage of their size
+            required: false
+            type: int
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.cache
+      - cwilloughby_bw.racktables.racktables.instances
+      - cwilloughby_bw.racktables.racktables.memo
+"""
+
+EXAMPLES = """
+- name: warn about production networks that are nearly full
+  debug: msg="{{ item.network }} is {{ item.used_percent }}% full"
+  loop: "{{ query('racktables_network_usage', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', tags=['Production'], threshold=90) | selectattr('alert') }}"
+"""
+
+RETURN = """
+  _list:
+    description:
+      - One entry per network, ordered by address, with its C(network), C(name), C(vlan), C(size), C(used), C(reserved), C(free) and C(used_percent)
+      - C(largest_free) has the C(start), C(end) and C(size) of the longest run of free addresses, or is null when the network is full
+      - C(alert) is true when I(threshold) is set and reached
+    type: list
+"""
+
+import ipaddress
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native
+from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_cache import cached_connection
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_memo import memoized
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
+
+# Maximum number of address ranges ORed into a single query
+BATCH_SIZE = 1000
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def hostRange(ip, mask):
+    size = 2 ** (32 - mask)
+    if mask >= 31:
+        return ip, ip + size - 1
+    return ip + 1, ip + size - 2
+
+class NetworkUsage(object):
+    """Running counts for one network while the sweep is inside it."""
+
+    def __init__(self, network):
+        self.network = network
+        self.end = network[1] + 2 ** (32 - network[2]) - 1
+        self.first, self.last = hostRange(network[1], network[2])
+        self.used = 0
+        self.reserved = 0
+        self.lastOccupied = self.first - 1
+        self.largestFree = (0, 0)
+
+    def freeBlock(self, until):
+        # The free addresses between the last occupied one and until, exclusive
+        size = until - self.lastOccupied - 1
+        if size > self.largestFree[1]:
+            self.largestFree = (self.lastOccupied + 1, size)
+
+    def add(self, ip, allocated):
+        if ip < self.first or ip > self.last:
+            return
+        self.freeBlock(ip)
+        self.lastOccupied = ip
+        if allocated:
+            self.used += 1
+        else:
+            self.reserved += 1
+
+    def report(self, threshold):
+        self.freeBlock(self.last + 1)
+        size = self.last - self.first + 1
+        usedPercent = round(100.0 * (self.used + self.reserved) / size, 1)
+        networkObject = {"network":"","name":"","vlan":"","size":0,"used":0,"reserved":0,"free":0,"used_percent":0,"largest_free":None,"alert":False}
+        networkObject['network'] = '{}/{}'.format(ipaddress.IPv4Address(self.network[1]), self.network[2])
+        networkObject['name'] = self.network[3]
+        networkObject['vlan'] = self.network[4]
+        networkObject['size'] = size
+        networkObject['used'] = self.used
+        networkObject['reserved'] = self.reserved
+        networkObject['free'] = size - self.used - self.reserved
+        networkObject['used_percent'] = usedPercent
+        if self.largestFree[1]:
+            start, blockSize = self.largestFree
+            networkObject['largest_free'] = dict(start=str(ipaddress.IPv4Address(start)), end=str(ipaddress.IPv4Address(start + blockSize - 1)), size=blockSize)
+        networkObject['alert'] = threshold is not None and usedPercent >= threshold
+        return networkObject
+
+class LookupModule(LookupBase):
+
+    @profiled_lookup('racktables_network_usage')
+    @memoized('racktables_network_usage')
+    @fan_out
+    def run(self, terms, variables=None, **kwargs):
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_network_usage): neither mysqlclient nor PyMySQL is installed")
+        self.set_options(var_options=variables, direct=kwargs)
+        tags = sorted(set(self.get_option('tags') or []))
+        threshold = self.get_option('threshold')
+        try:
+            params = lookup_params(self)
+            connection = cached_connection(self, params) or RacktablesDB(params).read
+        except RacktablesError as e:
+            raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
+
+        with connection.cursor() as cursor:
+            # Outer networks sort before the networks nested in them
+            if tags:
+                cursor.execute("SELECT N.id, N.ip, N.mask, N.name, V.vlan_id FROM IPv4Network N LEFT JOIN VLANIPv4 V ON V.ipv4net_id=N.id, TagStorage TS, TagTree TT WHERE TS.entity_realm='ipv4net' AND TS.entity_id=N.id AND TT.id=TS.tag_id AND TT.tag IN ({}) GROUP BY N.id, N.ip, N.mask, N.name, V.vlan_id HAVING COUNT(DISTINCT TT.id)=%s ORDER BY N.ip, N.mask".format(','.join(['%s'] * len(tags))),tags + [len(tags)])
+            else:
+                cursor.execute("SELECT N.id, N.ip, N.mask, N.name, V.vlan_id FROM IPv4Network N LEFT JOIN VLANIPv4 V ON V.ipv4net_id=N.id ORDER BY N.ip, N.mask")
+            networks = cursor.fetchall()
+            if not networks:
+                return []
+            # Networks are either nested or apart, so the outermost ones cover every address to scan
+            ranges = []
+            for network in networks:
+                end = network[1] + 2 ** (32 - network[2]) - 1
+                if ranges and network[1] <= ranges[-1][1]:
+                    ranges[-1][1] = max(ranges[-1][1], end)
+                else:
+                    ranges.append([network[1], end])
+            # Every occupied address in the networks, flagged when at least one object has it allocated
+            addresses = []
+            for batch in batches(ranges):
+                between = ' OR '.join(['ip BETWEEN %s AND %s'] * len(batch))
+                values = [ip for ipRange in batch for ip in ipRange]
+                cursor.execute("SELECT ip, MAX(allocated) FROM (SELECT ip, 1 AS allocated FROM IPv4Allocation WHERE {0} UNION ALL SELECT ip, 0 AS allocated FROM IPv4Address WHERE reserved='yes' AND ({0})) U GROUP BY ip ORDER BY ip".format(between),values + values)
+                addresses.extend(cursor.fetchall())
+
+        # Sweep the addresses once, keeping a stack of the networks that contain the current address, innermost last
+        reports = {}
+        stack = []
+        nextNetwork = 0
+
+        def closeNetworks(until):
+            while stack and stack[-1].end < until:
+                usage = stack.pop()
+                reports[usage.network[0]] = usage.report(threshold)
+
+        for ip, allocated in addresses:
+            while nextNetwork < len(networks) and networks[nextNetwork][1] <= ip:
+                closeNetworks(networks[nextNetwork][1])
+                stack.append(NetworkUsage(networks[nextNetwork]))
+                nextNetwork += 1
+            closeNetworks(ip)
+            for usage in stack:
+                usage.add(ip, allocated)
+        for network in networks[nextNetwork:]:
+            closeNetworks(network[1])
+            stack.append(NetworkUsage(network))
+        closeNetworks(2 ** 32)
+
+        return [reports[network[0]] for network in networks]
@@ -7,7 +7,7 @@ DOCUMENTATION = """
     version_added: "0.0"
     short_description: Lookup networks in Racktables with the provided tags
     requirements:
-      - PyMySql (python3 library)
+      - mysqlclient or PyMySQL (python3 library)
     description:
       - Returns a list of networks matching the provided tags
     options:
@@ -15,32 +15,20 @@ DOCUMENTATION = """
             description: A list containg the tags that the networks should have
             required: true
             type: list
-        rt_host:
-            description: Hostname of the database server backing Racktables
-            required: true
-            type: string
-        rt_port:
-            description: Port for the database connection, defaults to 3306
-            required: false
-            type: integer
-            default: 3306
-        rt_username:
-            description: Username that has administrative access to the racktables database
-            required: true
-            type: string
-        rt_password:
-            description: Password for the administrative user
-            required: true
-            type: string
-        rt_database:
-            description: Name of the database which backs Racktables
-            required: true
-            type: string
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.cache
+      - cwilloughby_bw.racktables.racktables.instances
+      - cwilloughby_bw.racktables.racktables.memo
 """
 
 EXAMPLES = """
 - name: lookup object network information
   debug: msg="{{ lookup('racktables_networks', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', tags=('Production')) }}"
+
+- name: list the production networks of every region
+  debug: msg="{{ item.instance }} {{ item.network }} {{ item.name }}"
+  loop: "{{ query('racktables_networks', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', tags=['Production'], rt_instances=[{'name':'us','rt_host':'rack-us.local'},{'name':'eu','rt_host':'rack-eu.local'},{'name':'apac','rt_host':'rack-apac.local','rt_read_host':['rack-apac-ro.local']}], rt_instance_timeout=10) }}"
 """
 
 RETURN = """
@@ -50,29 +38,29 @@ RETURN = """
     type: list
 """
 
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
-
 from ansible.errors import AnsibleError
 from ansible.module_utils._text import to_native
 from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_cache import cached_connection
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_memo import memoized
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
 
 class LookupModule(LookupBase):
 
+    @profiled_lookup('racktables_networks')
+    @memoized('racktables_networks')
+    @fan_out
     def run(self, terms, variables=None, **kwargs):
-        if HAVE_PYMYSQL is False:
-            raise AnsibleError("Can't LOOKUP(racktables_networks): module PyMySQL is not installed")
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_networks): neither mysqlclient nor PyMySQL is installed")
         self.set_options(var_options=variables, direct=kwargs)
         result = []
         try:
-            connection = pymysql.connect(host=self.get_option('rt_host'),port=self.get_option('rt_port'),user=self.get_option('rt_username'),password=self.get_option('rt_password'),db=self.get_option('rt_database'))
-        except Exception as e:
+            params = lookup_params(self)
+            connection = cached_connection(self, params) or RacktablesDB(params).read
+        except RacktablesError as e:
             raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
         rt_network_sql_start = "SELECT INET_NTOA(IPv4Network.ip),IPv4Network.mask,IPv4Network.name,VLANIPv4.vlan_id,IPv4Network.id FROM IPv4Network,TagStorage,VLANIPv4 WHERE IPv4Network.id=TagStorage.entity_id AND TagStorage.entity_realm='ipv4net' AND TagStorage.tag_id in ( "
         rt_network_sql_tags = ""
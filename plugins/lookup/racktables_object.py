@@ -7,7 +7,7 @@ DOCUMENTATION = """
     version_added: "0.0"
     short_description: Lookup an object in Racktables
     requirements:
-      - PyMySql (python3 library)
+      - mysqlclient or PyMySQL (python3 library)
     description:
       - Returns a single object from Racktables
     options:
@@ -15,27 +15,11 @@ DOCUMENTATION = """
             description: The name of the object to lookup
             required: true
             type: string
-        rt_host:
-            description: Hostname of the database server backing Racktables
-            required: true
-            type: string
-        rt_port:
-            description: Port for the database connection, defaults to 3306
-            required: false
-            type: integer
-            default: 3306
-        rt_username:
-            description: Username that has administrative access to the racktables database
-            required: true
-            type: string
-        rt_password:
-            description: Password for the administrative user
-            required: true
-            type: string
-        rt_database:
-            description: Name of the database which backs Racktables
-            required: true
-            type: string
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.cache
+      - cwilloughby_bw.racktables.racktables.instances
+      - cwilloughby_bw.racktables.racktables.memo
 """
 
 EXAMPLES = """
@@ -50,29 +34,31 @@ RETURN = """
     type: dict
 """
 
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
+import ipaddress
 
 from ansible.errors import AnsibleError
 from ansible.module_utils._text import to_native
 from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_cache import cached_connection
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_memo import memoized
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
 
 class LookupModule(LookupBase):
 
+    @profiled_lookup('racktables_object')
+    @memoized('racktables_object')
+    @fan_out
     def run(self, terms, variables=None, **kwargs):
-        if HAVE_PYMYSQL is False:
-            raise AnsibleError("Can't LOOKUP(racktables_object): module PyMySQL is not installed")
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_object): neither mysqlclient nor PyMySQL is installed")
         self.set_options(var_options=variables, direct=kwargs)
         result = []
         try:
-            connection = pymysql.connect(host=self.get_option('rt_host'),port=self.get_option('rt_port'),user=self.get_option('rt_username'),password=self.get_option('rt_password'),db=self.get_option('rt_database'))
-        except Exception as e:
+            params = lookup_params(self)
+            connection = cached_connection(self, params) or RacktablesDB(params).read
+        except RacktablesError as e:
             raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
         rt_object_sql="SELECT RTO.id, RTO.name, RTO.label, RTD.dict_value, RTO.asset_no, RTO.has_problems, RTO.comment FROM Object RTO, Dictionary RTD WHERE RTD.dict_key=RTO.objtype_id AND RTO.name=%s"
         rt_object_addresses_sql="SELECT INET_NTOA(ip), name, `type` FROM IPv4Allocation WHERE object_id=%s;"
@@ -94,7 +80,7 @@ class LookupModule(LookupBase):
               addressObject={"address":"","netmask":"","gateway":"","netname":"","ifname":"","vlan":""}
               addressObject["address"]=address[0]
               addressObject["ifname"]=address[1]
-              cursor.execute("SELECT id,INET_NTOA(ip),mask,name from IPv4Network where (INET_ATON(%s) ^ `ip` & ~(POW(2,32-`mask`)-1))=0 ORDER BY mask DESC LIMIT 1",addressObject["address"])
+              cursor.execute("SELECT id,INET_NTOA(ip),mask,name from IPv4Network where ip<=INET_ATON(%s) AND ip+POW(2,32-mask)>INET_ATON(%s) ORDER BY mask DESC LIMIT 1",(addressObject["address"],addressObject["address"]))
               network=cursor.fetchone()
               subnet=ipaddress.IPv4Network('{}/{}'.format(network[1],network[2]))
               addressObject["netmask"]=str(subnet.netmask)
@@ -0,0 +1,127 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    lookup: racktables_rack_space
+    author: Chandler Willoughby
+    version_added: "1.1.0"
+    short_description: Find racks with enough contiguous free units to mount a device
+    requirements:
+      - mysqlclient or PyMySQL (python3 library)
+    description:
+      - Returns the racks that have I(units) contiguous free units, with every unit a device of that height could start at
+      - The racks are chosen by name, row, location or tags, and every filter given must match
+      - A position is free when none of the requested atoms are taken, absent or unusable in Racktables
+      - The result is only a suggestion, use the racktables_rack_mount module to claim the units
+    options:
+        racks:
+            description: Only consider the racks with these names
+            required: false
+            type: list
+        row:
+            description: Only consider the racks in this row
+            required: false
+            type: string
+        location:
+            description: Only consider the racks in the rows of this location
+            required: false
+            type: string
+        tags:
+            description: Only consider the racks that have all of these tags
+            required: false
+            type: list
+        units:
+            description: The height of the device in units
+            required: false
+            type: int
+            default: 1
+        atoms:
+            description:
+              - The parts of each unit the device takes up, any of C(front), C(interior) and C(rear)
+              - Defaults to a full depth device
+            required: false
+            type: list
+            default: [ front, interior, rear ]
+        order:
+            description:
+              - C(fullest) lists the fullest racks first, to keep racks packed
+              - C(emptiest) lists the emptiest racks first, to spread devices out
+            required: false
+            type: string
+            default: fullest
+            choices: [ fullest, emptiest ]
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.instances
+"""
+
+EXAMPLES = """
+- name: find room for a 2U server in row A
+  debug: msg="{{ lookup('racktables_rack_space', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', row='A', units=2) }}"
+
+- name: mount it in the first slot found
+  racktables_rack_mount:
+    object: "test.lab1"
+    rack: "{{ slot.rack }}"
+    unit: "{{ slot.start_units[0] }}"
+    height: 2
+  vars:
+    slot: "{{ query('racktables_rack_space', rt_host='rackhost.local', rt_username='rackuser', rt_password='sup3r$3cur3', rt_database='rackdb', row='A', units=2) | first }}"
+"""
+
+RETURN = """
+  _list:
+    description:
+      - One entry per rack with room for the device, ordered by I(order) and then by name
+      - Each has the C(rack), C(row), C(location), C(height), C(used_percent) of its atoms and the C(start_units) the device could be mounted at, lowest first
+    type: list
+"""
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native
+from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_rackspace import ATOMS, atomMask, buildOccupancy, findFreeStarts, getRacks, getRackSpace, usedPercent
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
+
+class LookupModule(LookupBase):
+
+    @profiled_lookup('racktables_rack_space')
+    @fan_out
+    def run(self, terms, variables=None, **kwargs):
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_rack_space): neither mysqlclient nor PyMySQL is installed")
+        self.set_options(var_options=variables, direct=kwargs)
+        units = self.get_option('units')
+        if units < 1:
+            raise AnsibleError("units must be at least 1")
+        atoms = self.get_option('atoms')
+        invalid = [atom for atom in atoms if atom not in ATOMS]
+        if invalid or not atoms:
+            raise AnsibleError("atoms must be a list of {}".format(', '.join(ATOMS)))
+        try:
+            connection = RacktablesDB(lookup_params(self)).read
+        except RacktablesError as e:
+            raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
+
+        racks = getRacks(connection, racks=self.get_option('racks'), row=self.get_option('row'), location=self.get_option('location'), tags=sorted(set(self.get_option('tags') or [])))
+        occupancy = buildOccupancy(racks, getRackSpace(connection, [rack[0] for rack in racks]))
+
+        mask = atomMask(atoms)
+        result = []
+        for rackId, name, height, row, location in racks:
+            starts = findFreeStarts(occupancy[rackId], units, mask)
+            if not starts:
+                continue
+            rackObject = {"rack":"","row":"","location":"","height":0,"used_percent":0,"start_units":[]}
+            rackObject['rack'] = name
+            rackObject['row'] = row
+            rackObject['location'] = location
+            rackObject['height'] = height
+            rackObject['used_percent'] = usedPercent(occupancy[rackId])
+            rackObject['start_units'] = starts
+            result.append(rackObject)
+        # Sorts are stable, so racks with the same fill stay in name order
+        result.sort(key=lambda rack: rack['used_percent'], reverse=self.get_option('order') == 'fullest')
+        return result
@@ -7,7 +7,7 @@ DOCUMENTATION = """
     version_added: "0.0"
     short_description: Lookup vlans in Racktables with the provided domain
     requirements:
-      - PyMySql (python3 library)
+      - mysqlclient or PyMySQL (python3 library)
     description:
       - Returns a list of vlans provisioned in the provided domain
     options:
@@ -15,27 +15,11 @@ DOCUMENTATION = """
             description: The domain we should fetch VLANs from
             required: true
             type: string
-        rt_host:
-            description: Hostname of the database server backing Racktables
-            required: true
-            type: string
-        rt_port:
-            description: Port for the database connection, defaults to 3306
-            required: false
-            type: integer
-            default: 3306
-        rt_username:
-            description: Username that has administrative access to the racktables database
-            required: true
-            type: string
-        rt_password:
-            description: Password for the administrative user
-            required: true
-            type: string
-        rt_database:
-            description: Name of the database which backs Racktables
-            required: true
-            type: string
+    extends_documentation_fragment:
+      - cwilloughby_bw.racktables.racktables
+      - cwilloughby_bw.racktables.racktables.cache
+      - cwilloughby_bw.racktables.racktables.instances
+      - cwilloughby_bw.racktables.racktables.memo
 """
 
 EXAMPLES = """
@@ -50,29 +34,29 @@ RETURN = """
     type: list
 """
 
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
-
 from ansible.errors import AnsibleError
 from ansible.module_utils._text import to_native
 from ansible.plugins.lookup import LookupBase
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, RacktablesError, lookup_params
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_cache import cached_connection
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_instances import fan_out
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_memo import memoized
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_lookup
 
 class LookupModule(LookupBase):
 
+    @profiled_lookup('racktables_vlans')
+    @memoized('racktables_vlans')
+    @fan_out
     def run(self, terms, variables=None, **kwargs):
-        if HAVE_PYMYSQL is False:
-            raise AnsibleError("Can't LOOKUP(racktables_networks): module PyMySQL is not installed")
+        if HAVE_DB_DRIVER is False:
+            raise AnsibleError("Can't LOOKUP(racktables_networks): neither mysqlclient nor PyMySQL is installed")
         self.set_options(var_options=variables, direct=kwargs)
         result = []
         try:
-            connection = pymysql.connect(host=self.get_option('rt_host'),port=self.get_option('rt_port'),user=self.get_option('rt_username'),password=self.get_option('rt_password'),db=self.get_option('rt_database'))
-        except Exception as e:
+            params = lookup_params(self)
+            connection = cached_connection(self, params) or RacktablesDB(params).read
+        except RacktablesError as e:
             raise AnsibleError("Encountered an issue while connecting to the database, this was the original exception: %s" % to_native(e))
         rt_vlan_sql = "SELECT vdesc.vlan_id, vdesc.vlan_descr  FROM VLANDomain vdom, VLANDescription vdesc WHERE vdom.description = '{}' and vdesc.domain_id = vdom.id "
         with connection.cursor() as cursor:
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import atexit
+import random
+import time
+
+from ansible.module_utils.connection import Connection, ConnectionError
+try:
+    from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import phase
+except ImportError:
+    # Loaded straight from the file, as the benchmarks do, without the collection installed
+    import contextlib
+
+    def phase(name):
+        return contextlib.nullcontext()
+
+# Database drivers, in order of preference. mysqlclient (MySQLdb) decodes rows in C and is
+# noticeably faster on large result sets, PyMySQL is pure python and easier to install.
+DRIVERS = {}
+try:
+    import MySQLdb
+    import MySQLdb.cursors
+    DRIVERS['mysqlclient'] = MySQLdb
+except ImportError:
+    pass
+try:
+    import pymysql
+    import pymysql.cursors
+    DRIVERS['pymysql'] = pymysql
+except ImportError:
+    pass
+DRIVER_PREFERENCE = ('mysqlclient', 'pymysql')
+HAVE_DB_DRIVER = bool(DRIVERS)
+
+# Errors raised by any of the database drivers, or relayed from a session borrowed from the racktables connection
+DBError = tuple(driver.MySQLError for driver in DRIVERS.values()) + (ConnectionError,)
+
+# Options shared by every plugin in the collection, see the racktables doc fragment
+RACKTABLES_OPTIONS = (
+    'rt_host', 'rt_port', 'rt_username', 'rt_password', 'rt_database',
+    'rt_read_host', 'rt_read_your_writes', 'rt_read_timeout', 'rt_driver',
+)
+
+
+class RacktablesError(Exception):
+    pass
+
+
+def racktables_argument_spec():
+    return dict(
+        rt_host=dict(type='str',required=True),
+        rt_port=dict(type='int',required=False,default=3306),
+        rt_username=dict(type='str',required=True),
+        rt_password=dict(type='str',required=True,no_log=True),
+        rt_database=dict(type='str',required=True),
+        rt_read_host=dict(type='list',elements='str',required=False),
+        rt_read_your_writes=dict(type='bool',required=False,default=False),
+        rt_read_timeout=dict(type='int',required=False,default=5),
+        rt_driver=dict(type='str',required=False,default='auto',choices=['auto', 'mysqlclient', 'pymysql']),
+        rt_profile=dict(type='path',required=False),
+    )
+
+
+def lookup_params(lookup):
+    params = dict((option, lookup.get_option(option)) for option in RACKTABLES_OPTIONS)
+    # Set on the copies of a lookup that query one of several instances, see racktables_instances
+    params['rt_timeout'] = getattr(lookup, 'rt_timeout', None)
+    return params
+
+
+def getDriver(name='auto'):
+    if name == 'auto':
+        for preferred in DRIVER_PREFERENCE:
+            if preferred in DRIVERS:
+                return preferred
+        raise RacktablesError("Neither mysqlclient nor PyMySQL is installed")
+    if name not in DRIVERS:
+        raise RacktablesError("The {} database driver is not installed".format(name))
+    return name
+
+
+def dbConnect(host, port, user, password, database, driver='auto', **kwargs):
+    driver = getDriver(driver)
+    if driver == 'mysqlclient':
+        connection = MySQLdb.connect(host=host,port=port,user=user,passwd=password,db=database,charset='utf8mb4',**kwargs)
+    else:
+        connection = pymysql.connect(host=host,port=port,user=user,password=password,database=database,charset='utf8mb4',**kwargs)
+    return DriverConnection(connection, DRIVERS[driver])
+
+
+def normalizeArgs(args):
+    # PyMySQL accepts a single bare value as the query arguments, MySQLdb only takes a sequence or a mapping
+    if args is None or isinstance(args, (tuple, list, dict)):
+        return args
+    return (args,)
+
+
+class DriverCursor(object):
+    """A cursor of either driver, taking query arguments the same way for both."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, sql, args=None):
+        with phase('sql'):
+            return self._cursor.execute(sql, normalizeArgs(args))
+
+    def executemany(self, sql, args):
+        with phase('sql'):
+            return self._cursor.executemany(sql, list(args))
+
+    def fetchone(self):
+        with phase('sql'):
+            return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        with phase('sql'):
+            return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        with phase('sql'):
+            return self._cursor.fetchall()
+
+
+class DriverConnection(object):
+    """A connection made by either driver.
+
+    cursor(streaming=True) returns an unbuffered, server side cursor that
+    fetches rows as they are read instead of all at once.
+    """
+
+    def __init__(self, connection, driver):
+        self._connection = connection
+        self.driver = driver
+
+    @property
+    def open(self):
+        return bool(self._connection.open)
+
+    def cursor(self, streaming=False):
+        if streaming:
+            return DriverCursor(self._connection.cursor(self.driver.cursors.SSCursor))
+        return DriverCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def ping(self):
+        # Raises when the server has gone away, without reconnecting
+        if self.driver is DRIVERS.get('pymysql'):
+            self._connection.ping(reconnect=False)
+        else:
+            self._connection.ping()
+
+    def close(self):
+        self._connection.close()
+
+
+class PersistentCursor(object):
+    """The subset of the DB-API cursor the plugins use, run through a borrowed session."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self.lastrowid = None
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self, sql, args, many):
+        with phase('sql'):
+            response = self.connection._call('rt_execute', sql, args, many)
+        self._rows = [tuple(row) for row in response['rows'] or []]
+        self._rows.reverse()
+        self.rowcount = response['rowcount']
+        self.lastrowid = response['lastrowid']
+        return self.rowcount
+
+    def execute(self, sql, args=None):
+        return self._run(sql, args, False)
+
+    def executemany(self, sql, args):
+        return self._run(sql, list(args), True)
+
+    def fetchone(self):
+        return self._rows.pop() if self._rows else None
+
+    def fetchmany(self, size=1):
+        return tuple(self._rows.pop() for i in range(min(size, len(self._rows))))
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows))
+
+    def close(self):
+        self._rows = []
+
+
+class PersistentConnection(object):
+    """A database session leased from the racktables connection plugin.
+
+    The lease is given back when the module exits, so the session stays open
+    for the next task instead of being torn down.
+    """
+
+    def __init__(self, socket_path, params, timeout):
+        self._rpc = Connection(socket_path)
+        self._token = None
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self._token = self._rpc.rt_acquire(params)
+                break
+            except ConnectionError as e:
+                if 'pool exhausted' not in str(e) or time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        atexit.register(self.close)
+
+    @property
+    def open(self):
+        return self._token is not None
+
+    def _call(self, method, *args):
+        response = getattr(self._rpc, method)(self._token, *args)
+        # The connection answers while a query is still running, so it can serve other modules meanwhile
+        while response['pending']:
+            response = self._rpc.rt_wait(self._token)
+        return response['result']
+
+    def cursor(self, streaming=False):
+        # Results always come back whole over the socket, so there is nothing to stream
+        return PersistentCursor(self)
+
+    def commit(self):
+        self._call('rt_commit')
+
+    def rollback(self):
+        self._call('rt_rollback')
+
+    def close(self):
+        if self._token is not None:
+            try:
+                self._rpc.rt_release(self._token)
+            except ConnectionError:
+                pass
+            self._token = None
+
+
+def splitHost(host, defaultPort):
+    if ':' in host:
+        host, port = host.rsplit(':', 1)
+        return host, int(port)
+    return host, defaultPort
+
+
+class RacktablesDB(object):
+    """Connections to the Racktables primary and, optionally, one of its read replicas.
+
+    Writes and locking reads go through ``primary``. Lookups, check mode and the
+    reads a module makes to decide whether anything needs to change go through
+    ``read``, which is the primary unless ``rt_read_host`` is set.
+
+    Both borrow their session from the racktables connection when the play uses
+    it, and connect directly otherwise.
+    """
+
+    def __init__(self, params, module=None, persistent=True):
+        self.params = params
+        self.module = module
+        # Set when the play uses the racktables connection, which lends out persistent sessions
+        self.socket_path = getattr(module, '_socket_path', None) if persistent else None
+        self._primary = None
+        self._read = None
+
+    def fail(self, msg):
+        if self.module is not None:
+            self.module.fail_json(msg=msg)
+        raise RacktablesError(msg)
+
+    def _connect(self, host, port, pooled=False, **kwargs):
+        params = dict(host=host,port=port,user=self.params['rt_username'],password=self.params['rt_password'],database=self.params['rt_database'],driver=self.params.get('rt_driver') or 'auto')
+        if pooled and self.socket_path:
+            try:
+                return PersistentConnection(self.socket_path, params, kwargs.get('connect_timeout', 30))
+            except ConnectionError as e:
+                if 'Method not found' not in str(e):
+                    raise
+                # The play uses some other persistent connection, connect directly instead
+                self.socket_path = None
+        if self.params.get('rt_timeout'):
+            for timeout in ('connect_timeout', 'read_timeout', 'write_timeout'):
+                kwargs.setdefault(timeout, self.params['rt_timeout'])
+        params.update(kwargs)
+        return dbConnect(**params)
+
+    @property
+    def primary(self):
+        if self._primary is None:
+            try:
+                self._primary = self._connectPooled() or self._connect(self.params['rt_host'], self.params['rt_port'])
+            except Exception as e:
+                self.fail("An error occured while connecting to your Racktables database, please check your connection info and try again: {}".format(e))
+        return self._primary
+
+    @property
+    def read(self):
+        if self._read is None:
+            self._read = self._connectReplica() or self.primary
+        return self._read
+
+    @property
+    def is_replica(self):
+        return self._read is not None and self._read is not self._primary
+
+    def _connectPooled(self):
+        if not self.socket_path:
+            return None
+        try:
+            return self._connect(self.params['rt_host'], self.params['rt_port'], pooled=True)
+        except Exception:
+            return None
+
+    def _connectReplica(self):
+        replicas = list(self.params.get('rt_read_host') or [])
+        random.shuffle(replicas)
+        for replica in replicas:
+            host, port = splitHost(replica, self.params['rt_port'])
+            try:
+                connection = self._connect(host, port, pooled=True, connect_timeout=self.params['rt_read_timeout'])
+            except Exception:
+                continue
+            if not self.params.get('rt_read_your_writes') or self._waitForReplica(connection):
+                return connection
+            connection.close()
+        return None
+
+    def _waitForReplica(self, replica):
+        """Block until the replica has applied everything the primary has committed.
+
+        This relies on GTIDs, if they aren't enabled on the server there is no way
+        to tell how far behind the replica is and the primary is used instead.
+        """
+        try:
+            with self.primary.cursor() as cursor:
+                cursor.execute("SELECT VERSION()")
+                mariadb = 'mariadb' in cursor.fetchone()[0].lower()
+                cursor.execute("SELECT @@GLOBAL.gtid_binlog_pos" if mariadb else "SELECT @@GLOBAL.gtid_executed")
+                position = cursor.fetchone()[0]
+            if not position:
+                return False
+            with replica.cursor() as cursor:
+                if mariadb:
+                    cursor.execute("SELECT MASTER_GTID_WAIT(%s, %s)",(position,self.params['rt_read_timeout']))
+                else:
+                    cursor.execute("SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s)",(position,self.params['rt_read_timeout']))
+                # Both functions return 0 once the replica has caught up
+                return cursor.fetchone()[0] == 0
+        except DBError:
+            return False
+
+    def close(self):
+        for connection in (self._read, self._primary):
+            if connection is not None and connection.open:
+                connection.close()
+        self._read = None
+        self._primary = None
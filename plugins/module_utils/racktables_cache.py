@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import socket
+import sqlite3
+import struct
+import time
+import zlib
+
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, RacktablesDB, RacktablesError
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import phase
+
+# Bump when CACHE_TABLES changes, existing cache files are then rebuilt from scratch
+CACHE_VERSION = '2'
+
+# Rows per bucket when comparing checksums with the database
+BUCKET_SIZE = 1024
+
+# Maximum number of values bound into a single IN (...) clause
+BATCH_SIZE = 1000
+
+# Tables mirrored into the cache.
+#   key: the columns that identify a row
+#   bucket: the integer column rows are grouped on when comparing checksums
+#   object: the column holding the object id, rows of changed objects are fetched again on every refresh
+#   address: the column holding an IPv4 address, rows of addresses with new IPv4Log entries are fetched again on every refresh
+#   always: compare checksums on every refresh instead of only when reconciling, for the tables without change tracking
+CACHE_TABLES = (
+    dict(name='Object', columns=('id', 'name', 'label', 'objtype_id', 'asset_no', 'has_problems', 'comment'), key=('id',), bucket='id', object='id'),
+    dict(name='Port', columns=('id', 'object_id', 'name', 'iif_id', 'type', 'l2address', 'reservation_comment', 'label'), key=('id',), bucket='id', object='object_id'),
+    dict(name='IPv4Allocation', columns=('object_id', 'ip', 'name', 'type'), key=('object_id', 'ip'), bucket='object_id', object='object_id', address='ip'),
+    dict(name='IPv4Address', columns=('ip', 'name', 'comment', 'reserved'), key=('ip',), bucket='ip', address='ip'),
+    dict(name='IPv4Network', columns=('id', 'ip', 'mask', 'name', 'comment'), key=('id',), bucket='id', always=True),
+    dict(name='VLANIPv4', columns=('domain_id', 'vlan_id', 'ipv4net_id'), key=('ipv4net_id',), bucket='ipv4net_id', always=True),
+    dict(name='VLANDomain', columns=('id', 'group_id', 'description'), key=('id',), bucket='id', always=True),
+    dict(name='VLANDescription', columns=('domain_id', 'vlan_id', 'vlan_type', 'vlan_descr'), key=('domain_id', 'vlan_id'), bucket='domain_id', always=True),
+    dict(name='TagTree', columns=('id', 'parent_id', 'is_assignable', 'tag'), key=('id',), bucket='id', always=True),
+    dict(name='TagStorage', columns=('entity_realm', 'entity_id', 'tag_id'), key=('entity_realm', 'entity_id', 'tag_id'), bucket='entity_id', always=True),
+    dict(name='Dictionary', columns=('dict_key', 'chapter_id', 'dict_value'), key=('dict_key',), bucket='dict_key', always=True),
+)
+
+# Extra indexes for the queries the lookups run against the cache
+CACHE_INDEXES = (
+    ('Object', ('name',)),
+    ('Port', ('object_id',)),
+    ('Port', ('l2address',)),
+    ('IPv4Allocation', ('ip',)),
+    ('IPv4Network', ('ip', 'mask')),
+    ('TagStorage', ('tag_id',)),
+)
+
+
+def cache_params(lookup):
+    params = dict((option, lookup.get_option(option)) for option in ('rt_cache_path', 'rt_cache_max_age', 'rt_cache_reconcile_interval'))
+    # A cache file only holds one database, a copy of the lookup querying one of several instances only uses the one the instance sets
+    instance = getattr(lookup, 'rt_instance', None)
+    if instance is not None:
+        params['rt_cache_path'] = instance.get('rt_cache_path')
+    return params
+
+
+def cached_connection(lookup, params):
+    """Returns a connection to the lookup's cache, or None when the cache isn't enabled."""
+    options = cache_params(lookup)
+    if not options['rt_cache_path']:
+        return None
+    try:
+        cache = RacktablesCache(options['rt_cache_path'], params)
+        cache.refresh(RacktablesDB(params), options['rt_cache_max_age'], options['rt_cache_reconcile_interval'])
+    except (sqlite3.Error, EnvironmentError) as e:
+        raise RacktablesError("Unable to use the cache at {}: {}".format(options['rt_cache_path'], e))
+    except DBError as e:
+        raise RacktablesError("Unable to refresh the cache at {}: {}".format(options['rt_cache_path'], e))
+    return cache.connection
+
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+
+def batches(values):
+    values = sorted(values)
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+
+def rowChecksum(row):
+    # Matches CRC32(CONCAT_WS('|', IFNULL(col, '\N'), ...)) computed by the database
+    return zlib.crc32('|'.join('\\N' if value is None else str(value) for value in row).encode('utf-8'))
+
+
+def inetNtoa(value):
+    return None if value is None else socket.inet_ntoa(struct.pack('!I', int(value)))
+
+
+def inetAton(value):
+    return None if value is None else struct.unpack('!I', socket.inet_aton(value))[0]
+
+
+class CacheCursor(object):
+    """Runs the lookups' MySQL flavoured queries against the cache."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cursor.close()
+
+    def execute(self, sql, args=None):
+        if args is None:
+            args = ()
+        elif not isinstance(args, (tuple, list)):
+            args = (args,)
+        with phase('cache'):
+            self.cursor.execute(sql.replace('%s', '?'), args)
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        with phase('cache'):
+            row = self.cursor.fetchone()
+        return tuple(row) if row is not None else None
+
+    def fetchmany(self, size=1):
+        with phase('cache'):
+            return tuple(tuple(row) for row in self.cursor.fetchmany(size))
+
+    def fetchall(self):
+        with phase('cache'):
+            return tuple(tuple(row) for row in self.cursor.fetchall())
+
+
+class CacheConnection(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args):
+        return CacheCursor(self.db.cursor())
+
+
+class RacktablesCache(object):
+    """A local copy of the Racktables tables the lookups read, kept in an SQLite file.
+
+    Each refresh only pulls what changed since the previous one: objects that
+    have new ObjectHistory entries, addresses with new IPv4Log entries, and
+    rows above the highest Object and Port id seen so far. Tables without any
+    change tracking are small and are compared by checksum on every refresh.
+    Anything the change tracking misses, such as deletions or rows changed
+    outside of the Racktables UI, is caught by a periodic reconcile that
+    compares checksums of every table bucket by bucket and reloads the buckets
+    that differ.
+    """
+
+    def __init__(self, path, params):
+        self.path = os.path.expanduser(path)
+        self.source = '{}:{}/{}'.format(params['rt_host'], params['rt_port'], params['rt_database'])
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Transactions are managed explicitly, see refresh
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.db.create_function('INET_NTOA', 1, inetNtoa)
+        self.db.create_function('INET_ATON', 1, inetAton)
+        self.db.create_function('POW', 2, lambda base, exponent: int(base ** exponent))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @property
+    def connection(self):
+        return CacheConnection(self.db)
+
+    def getMeta(self, key):
+        row = self.db.execute("SELECT value FROM cache_meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def setMeta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES (?, ?)", (key, None if value is None else str(value)))
+
+    def isFresh(self, maxAge):
+        lastRefresh = self.getMeta('last_refresh')
+        return lastRefresh is not None and time.time() - float(lastRefresh) < maxAge
+
+    def refresh(self, db, maxAge, reconcileInterval):
+        if self.isFresh(maxAge):
+            return
+        # Only one process refreshes at a time, the others wait here and then find the cache fresh
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            if not self.isFresh(maxAge):
+                connection = db.read
+                if self.getMeta('version') != CACHE_VERSION or self.getMeta('source') != self.source:
+                    self.rebuild(connection)
+                else:
+                    self.pullChanges(connection)
+                    lastReconcile = float(self.getMeta('last_reconcile') or 0)
+                    self.reconcile(connection, full=time.time() - lastReconcile >= reconcileInterval)
+                self.setMeta('last_refresh', time.time())
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def rebuild(self, connection):
+        for table in CACHE_TABLES:
+            self.db.execute("DROP TABLE IF EXISTS `{}`".format(table['name']))
+            self.db.execute("CREATE TABLE `{}` ({}, PRIMARY KEY ({}))".format(table['name'], ', '.join('`{}`'.format(column) for column in table['columns']), ', '.join(table['key'])))
+        for name, columns in CACHE_INDEXES:
+            self.db.execute("CREATE INDEX `{0}_{1}` ON `{0}` ({2})".format(name, '_'.join(columns), ', '.join(columns)))
+        self.db.execute("DELETE FROM cache_meta")
+        # Take the change tracking marks before copying, anything changed during the copy is pulled again next time
+        self.markChanges(connection)
+        with connection.cursor() as cursor:
+            for table in CACHE_TABLES:
+                cursor.execute("SELECT {} FROM `{}`".format(self.columnList(table), table['name']))
+                while True:
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        break
+                    self.insertRows(table, rows)
+        self.setMeta('version', CACHE_VERSION)
+        self.setMeta('source', self.source)
+        self.setMeta('last_reconcile', time.time())
+
+    def columnList(self, table, prefix=''):
+        return ', '.join('{}`{}`'.format(prefix, column) for column in table['columns'])
+
+    def insertRows(self, table, rows):
+        self.db.executemany("INSERT OR REPLACE INTO `{}` ({}) VALUES ({})".format(table['name'], self.columnList(table), ','.join(['?'] * len(table['columns']))), rows)
+
+    def queryChanges(self, connection, sql, args=None):
+        # Older Racktables releases lack some of the history tables, the reconcile covers for them
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, args)
+                return cursor.fetchall()
+        except DBError:
+            return ()
+
+    def markChanges(self, connection):
+        historyMark = self.queryChanges(connection, "SELECT MAX(ctime) FROM ObjectHistory")
+        self.setMeta('mark_object_history', historyMark[0][0] if historyMark else None)
+        ipv4LogMark = self.queryChanges(connection, "SELECT MAX(id) FROM IPv4Log")
+        self.setMeta('mark_ipv4_log', ipv4LogMark[0][0] if ipv4LogMark else None)
+        with connection.cursor() as cursor:
+            for name in ('Object', 'Port'):
+                cursor.execute("SELECT MAX(id) FROM `{}`".format(name))
+                self.setMeta('mark_{}'.format(name.lower()), cursor.fetchone()[0] or 0)
+
+    def pullChanges(self, connection):
+        changedObjects = set()
+        changedAddresses = set()
+
+        historyMark = self.getMeta('mark_object_history')
+        if historyMark is not None:
+            # Entries sharing the last timestamp are read again, which is harmless
+            history = self.queryChanges(connection, "SELECT id, ctime FROM ObjectHistory WHERE ctime>=%s", (historyMark,))
+            changedObjects.update(row[0] for row in history)
+            if history:
+                self.setMeta('mark_object_history', max(row[1] for row in history))
+
+        ipv4LogMark = self.getMeta('mark_ipv4_log')
+        if ipv4LogMark is not None:
+            log = self.queryChanges(connection, "SELECT id, ip FROM IPv4Log WHERE id>%s", (int(ipv4LogMark),))
+            changedAddresses.update(row[1] for row in log)
+            if log:
+                self.setMeta('mark_ipv4_log', max(row[0] for row in log))
+
+        tables = dict((table['name'], table) for table in CACHE_TABLES)
+        with connection.cursor() as cursor:
+            for name in ('Object', 'Port'):
+                mark = int(self.getMeta('mark_{}'.format(name.lower())) or 0)
+                cursor.execute("SELECT {} FROM `{}` WHERE id>%s".format(self.columnList(tables[name]), name), (mark,))
+                rows = cursor.fetchall()
+                if rows:
+                    self.insertRows(tables[name], rows)
+                    self.setMeta('mark_{}'.format(name.lower()), max(row[0] for row in rows))
+                    changedObjects.update(row[0] if name == 'Object' else row[1] for row in rows)
+
+            for batch in batches(changedObjects):
+                for table in CACHE_TABLES:
+                    if table.get('object'):
+                        self.replaceRows(cursor, table, "`{}` IN ({})".format(table['object'], inPlaceholders(batch)), batch)
+            for batch in batches(changedAddresses):
+                for table in CACHE_TABLES:
+                    if table.get('address'):
+                        self.replaceRows(cursor, table, "`{}` IN ({})".format(table['address'], inPlaceholders(batch)), batch)
+
+    def replaceRows(self, cursor, table, where, args):
+        self.db.execute("DELETE FROM `{}` WHERE {}".format(table['name'], where.replace('%s', '?')), args)
+        cursor.execute("SELECT {} FROM `{}` WHERE {}".format(self.columnList(table), table['name'], where), args)
+        self.insertRows(table, cursor.fetchall())
+
+    def reconcile(self, connection, full):
+        """Reload the buckets whose checksum differs from the database.
+
+        Only the tables marked always are checked unless full is set.
+        """
+        with connection.cursor() as cursor:
+            for table in CACHE_TABLES:
+                if not (full or table.get('always')):
+                    continue
+                checksumExpression = "BIT_XOR(CRC32(CONCAT_WS('|', {})))".format(', '.join("IFNULL(`{}`, '\\\\N')".format(column) for column in table['columns']))
+                cursor.execute("SELECT FLOOR(`{0}`/{1}), COUNT(*), {2} FROM `{3}` GROUP BY FLOOR(`{0}`/{1})".format(table['bucket'], BUCKET_SIZE, checksumExpression, table['name']))
+                remote = dict((int(row[0]), (int(row[1]), int(row[2]))) for row in cursor.fetchall())
+                local = {}
+                for row in self.db.execute("SELECT {}, {} FROM `{}`".format(self.columnList(table), table['bucket'], table['name'])):
+                    bucket = int(row[-1]) // BUCKET_SIZE
+                    count, checksum = local.get(bucket, (0, 0))
+                    local[bucket] = (count + 1, checksum ^ rowChecksum(row[:-1]))
+                for bucket in sorted(set(remote) | set(local)):
+                    if remote.get(bucket) != local.get(bucket):
+                        self.replaceRows(cursor, table, "`{0}`>=%s AND `{0}`<%s".format(table['bucket']), (bucket * BUCKET_SIZE, (bucket + 1) * BUCKET_SIZE))
+        if full:
+            self.setMeta('last_reconcile', time.time())
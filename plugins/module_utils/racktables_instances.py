@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import concurrent.futures
+import copy
+import functools
+import time
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native
+from ansible.utils.display import Display
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import RACKTABLES_OPTIONS
+
+display = Display()
+
+# Defaults of the options in the instances doc fragment, they are read from the lookup's arguments
+DEFAULT_TIMEOUT = 30
+DEFAULT_WORKERS = 8
+
+# What an entry of rt_instances may set, on top of its name
+INSTANCE_OPTIONS = RACKTABLES_OPTIONS + ('rt_cache_path',)
+
+# Options of the fan out itself, which the per instance runs don't get
+FAN_OUT_OPTIONS = ('rt_instances', 'rt_instance_timeout', 'rt_instance_workers', 'rt_profile')
+
+
+def instanceArguments(kwargs, instance):
+    arguments = dict((key, value) for key, value in kwargs.items() if key not in FAN_OUT_OPTIONS)
+    # The cache path is picked up from the instance by cache_params
+    arguments.update((key, value) for key, value in instance.items() if key not in ('name', 'rt_cache_path'))
+    return arguments
+
+
+def fan_out(run):
+    """Runs a lookup against every Racktables instance in its rt_instances option at once.
+
+    Each instance is queried by a copy of the lookup on a thread of its own, with
+    the instance's connection options laid over the lookup's arguments. The
+    results are merged in the order of rt_instances, each tagged with the name
+    of its instance. An instance that fails, or doesn't answer within
+    rt_instance_timeout seconds, is left out with a warning, the lookup only
+    fails when none of them answered.
+    """
+    @functools.wraps(run)
+    def wrapper(self, terms, variables=None, **kwargs):
+        instances = kwargs.get('rt_instances')
+        if not instances:
+            return run(self, terms, variables, **kwargs)
+
+        names = []
+        for position, instance in enumerate(instances):
+            if not isinstance(instance, dict):
+                raise AnsibleError("Each entry of rt_instances must be a dictionary of connection options")
+            unknown = sorted(key for key in instance if key != 'name' and key not in INSTANCE_OPTIONS)
+            if unknown:
+                raise AnsibleError("Unknown options for instance {}: {}".format(instance.get('name', position + 1), ', '.join(unknown)))
+            name = instance.get('name') or instance.get('rt_host') or kwargs.get('rt_host')
+            if not name:
+                raise AnsibleError("Instance {} of rt_instances has neither a name nor an rt_host".format(position + 1))
+            if name in names:
+                raise AnsibleError("Instance {} is listed more than once in rt_instances".format(name))
+            names.append(name)
+        timeout = kwargs.get('rt_instance_timeout') or DEFAULT_TIMEOUT
+        workers = max(1, kwargs.get('rt_instance_workers') or DEFAULT_WORKERS)
+
+        started = {}
+
+        def query(name, instance):
+            started[name] = time.time()
+            # set_options replaces the options of the lookup it is called on, so every thread needs its own copy
+            lookup = copy.copy(self)
+            lookup.rt_instance = instance
+            # Bounds the connection and every query, so a thread given up on below doesn't hang around
+            lookup.rt_timeout = timeout
+            return run(lookup, terms, variables, **instanceArguments(kwargs, instance))
+
+        results = {}
+        errors = {}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(instances)))
+        try:
+            pending = dict((executor.submit(query, name, instance), name) for name, instance in zip(names, instances))
+            while pending:
+                done, notDone = concurrent.futures.wait(pending, timeout=0.1)
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        errors[name] = to_native(e)
+                for future in notDone:
+                    name = pending[future]
+                    # The timeout of each instance runs from when a worker picked it up, not from when it was queued
+                    if name in started and time.time() - started[name] > timeout:
+                        pending.pop(future)
+                        errors[name] = "no answer within {} seconds".format(timeout)
+        finally:
+            executor.shutdown(wait=False)
+
+        if not results:
+            raise AnsibleError("None of the Racktables instances answered: {}".format('; '.join("{}: {}".format(name, errors[name]) for name in names)))
+        for name in names:
+            if name in errors:
+                display.warning("Racktables instance {} was left out of the results: {}".format(name, errors[name]))
+
+        merged = []
+        for name in names:
+            for item in results.get(name, []):
+                if isinstance(item, dict):
+                    item = dict(item, instance=name)
+                merged.append(item)
+        return merged
+    return wrapper
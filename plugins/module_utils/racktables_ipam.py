@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import bisect
+import socket
+import struct
+
+
+def networkEnd(ip, mask):
+    return ip + 2 ** (32 - mask) - 1
+
+
+def formatNetwork(ip, mask):
+    return '{}/{}'.format(socket.inet_ntoa(struct.pack('!I', ip)), mask)
+
+
+def buildNetworkIndex(networks):
+    """An index of (ip, mask) networks for findOverlaps: the networks sorted by ip, their start addresses and a set of them."""
+    ordered = sorted(set(networks))
+    return ordered, [network[0] for network in ordered], set(ordered)
+
+
+def findOverlaps(index, ip, mask):
+    """The networks in the index that ip/mask is nested in or that are nested in it, sorted by ip.
+
+    Networks can't partly overlap, so the larger ones are found by looking up
+    each shorter prefix of ip in the set, and the smaller ones by bisecting the
+    start addresses for the range ip/mask covers.
+    """
+    ordered, starts, members = index
+    overlaps = []
+    for shorter in range(mask):
+        supernet = (ip >> (32 - shorter) << (32 - shorter), shorter)
+        if supernet in members:
+            overlaps.append(supernet)
+    first = bisect.bisect_left(starts, ip)
+    last = bisect.bisect_right(starts, networkEnd(ip, mask))
+    overlaps.extend(network for network in ordered[first:last] if network[1] > mask)
+    return overlaps
+
+
+def findFreeSubnet(start, end, mask, existing):
+    """Returns the first address between start and end where an aligned /mask fits, or None.
+
+    existing holds the (ip, mask) of the networks already in that range, sorted
+    by ip. They are walked once, merging nested and adjacent networks, and the
+    first gap that can hold an aligned block of the requested size wins.
+    """
+    size = 2 ** (32 - mask)
+    free = start
+    for ip, existingMask in existing:
+        if ip > free:
+            # Round up to the next boundary of the requested size
+            candidate = (free + size - 1) // size * size
+            if candidate + size <= min(ip, end + 1):
+                return candidate
+        free = max(free, networkEnd(ip, existingMask) + 1)
+        if free > end:
+            return None
+    candidate = (free + size - 1) // size * size
+    if candidate + size <= end + 1:
+        return candidate
+    return None
+
+
+def getNetworksInRange(connection, start, end, lock=False):
+    """The (ip, mask) of every network starting between start and end, sorted by ip.
+
+    With lock set, the rows are read FOR UPDATE, which also stops other
+    transactions from inserting networks into the range until this one ends.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT ip, mask FROM IPv4Network WHERE ip BETWEEN %s AND %s ORDER BY ip, mask{}".format(" FOR UPDATE" if lock else ""),(start,end))
+        return cursor.fetchall()
+
+
+def getTaggedNetworks(connection, tags):
+    """The (id, ip, mask, name) of the networks that have all of the tags, sorted by ip."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT N.id, N.ip, N.mask, N.name FROM IPv4Network N, TagStorage TS, TagTree TT WHERE TS.entity_realm='ipv4net' AND TS.entity_id=N.id AND TT.id=TS.tag_id AND TT.tag IN ({}) GROUP BY N.id, N.ip, N.mask, N.name HAVING COUNT(DISTINCT TT.id)=%s ORDER BY N.ip, N.mask".format(','.join(['%s'] * len(tags))),list(tags) + [len(tags)])
+        return cursor.fetchall()
+
+
+def carveSubnet(connection, containers, mask, lock=False):
+    """Find the first free /mask in the first container, given as (ip, mask), that has room for one.
+
+    Returns (ip, container), or None when every container is full. Networks
+    that are as large as the container or larger are ignored, as the container
+    itself is usually one of them.
+    """
+    for container in containers:
+        if mask <= container[1]:
+            continue
+        start = container[0]
+        end = networkEnd(container[0], container[1])
+        existing = [network for network in getNetworksInRange(connection, start, end, lock) if network[1] > container[1]]
+        ip = findFreeSubnet(start, end, mask, existing)
+        if ip is not None:
+            return ip, container
+    return None
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import collections
+import copy
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import phase
+
+# Defaults of the options in the memo doc fragment, they are read from the lookup's arguments or the environment
+DEFAULT_TTL = 30
+DEFAULT_SIZE = 128
+
+MEMO_OPTIONS = {
+    'rt_memo_ttl': 'RACKTABLES_MEMO_TTL',
+    'rt_memo_size': 'RACKTABLES_MEMO_SIZE',
+    'rt_memo_dir': 'RACKTABLES_MEMO_DIR',
+}
+
+# Arguments and environment variables that don't change what a lookup returns
+UNKEYED = set(MEMO_OPTIONS) | set(MEMO_OPTIONS.values()) | set(['rt_profile', 'RACKTABLES_PROFILE', 'rt_instance_workers'])
+
+# Key -> (time stored, result), least recently used first
+_memo = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def memoOption(kwargs, option, default):
+    value = kwargs.get(option)
+    if value is None:
+        value = os.environ.get(MEMO_OPTIONS[option])
+    if value is None or value == '':
+        return default
+    return value
+
+
+def memoKey(plugin, terms, kwargs):
+    """A digest of everything that decides the result of a call: the plugin, its terms and arguments, and the RACKTABLES_ environment variables."""
+    environment = dict((name, value) for name, value in os.environ.items() if name.startswith('RACKTABLES_') and name not in UNKEYED)
+    arguments = dict((key, value) for key, value in kwargs.items() if key not in UNKEYED)
+    normalized = json.dumps([plugin, terms, arguments, environment], sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def readFile(path, ttl):
+    """The (time stored, result) in a memo file, or None when there is none younger than ttl."""
+    try:
+        stored = os.path.getmtime(path)
+        if time.time() - stored > ttl:
+            return None
+        with open(path) as f:
+            return stored, json.load(f)
+    except (EnvironmentError, ValueError):
+        return None
+
+
+def writeFile(directory, path, result):
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        # Written aside and renamed into place, so concurrent forks never read half a file
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    except EnvironmentError:
+        return
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(result, f)
+        os.rename(temporary, path)
+    except (EnvironmentError, TypeError, ValueError):
+        # Results that aren't plain JSON are only kept in memory
+        try:
+            os.remove(temporary)
+        except EnvironmentError:
+            pass
+
+
+def memoized(plugin):
+    """Serves repeated calls of a lookup with the same arguments from memory for rt_memo_ttl seconds.
+
+    Up to rt_memo_size results are kept per process, the least recently used
+    is dropped first. Ansible evaluates lookups in a forked worker per task and
+    host, so with rt_memo_dir set the results are also shared between the
+    workers through files in that directory. Setting rt_memo_ttl to 0 turns it off.
+    """
+    def decorator(run):
+        @functools.wraps(run)
+        def wrapper(self, terms, variables=None, **kwargs):
+            try:
+                ttl = int(memoOption(kwargs, 'rt_memo_ttl', DEFAULT_TTL))
+                size = int(memoOption(kwargs, 'rt_memo_size', DEFAULT_SIZE))
+            except ValueError:
+                ttl = 0
+            if ttl <= 0 or size <= 0:
+                return run(self, terms, variables, **kwargs)
+            directory = memoOption(kwargs, 'rt_memo_dir', None)
+            key = memoKey(plugin, terms, kwargs)
+            path = os.path.join(os.path.expanduser(directory), '{}-{}.json'.format(plugin, key)) if directory else None
+
+            with phase('memo'):
+                now = time.time()
+                with _lock:
+                    entry = _memo.get(key)
+                    if entry and now - entry[0] <= ttl:
+                        _memo.move_to_end(key)
+                        # Callers are free to change what they get back, the memo keeps its own copy
+                        return copy.deepcopy(entry[1])
+                if path:
+                    entry = readFile(path, ttl)
+                    if entry is not None:
+                        with _lock:
+                            _memo[key] = entry
+                            _memo.move_to_end(key)
+                        return copy.deepcopy(entry[1])
+
+            result = run(self, terms, variables, **kwargs)
+
+            with phase('memo'):
+                with _lock:
+                    _memo[key] = (time.time(), copy.deepcopy(result))
+                    _memo.move_to_end(key)
+                    while len(_memo) > size:
+                        _memo.popitem(last=False)
+                if path:
+                    writeFile(os.path.expanduser(directory), path, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import cProfile
+import functools
+import io
+import itertools
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+# Profiling is switched on by setting this, or the rt_profile option, to the directory the profiles go to
+PROFILE_ENV = 'RACKTABLES_PROFILE'
+
+# Number of functions and allocation sites listed in the summary
+TOP_ENTRIES = 25
+
+# The run being profiled in this process, if any
+_active = None
+
+# Numbers the profiles a process writes, lookups can run several times a second in one worker
+_sequence = itertools.count(1)
+
+
+class NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase(object):
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        timing = self.profile.phases.setdefault(self.name, dict(seconds=0.0, calls=0))
+        timing['seconds'] += time.perf_counter() - self.started
+        timing['calls'] += 1
+
+
+def phase(name):
+    """Times a block as part of the named phase of the run being profiled, does nothing otherwise."""
+    if _active is None:
+        return NULL_PHASE
+    return Phase(_active, name)
+
+
+def publicArguments(arguments):
+    return dict((key, value) for key, value in arguments.items() if 'password' not in key and not key.startswith('_'))
+
+
+class Profile(object):
+    """cProfile, tracemalloc and per phase timings for one lookup or module run.
+
+    stop() writes <plugin>-<time>-<pid>-<n>.prof, loadable with pstats or snakeviz,
+    and a .json summary next to it with the phase timings, the peak memory, the
+    busiest functions and allocation sites, and the arguments of the run.
+    """
+
+    def __init__(self, plugin, directory, arguments):
+        self.plugin = plugin
+        self.directory = directory
+        self.arguments = publicArguments(arguments)
+        self.phases = {}
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        global _active
+        _active = self
+        self.startedAt = time.time()
+        self.started = time.perf_counter()
+        tracemalloc.start()
+        self.profiler.enable()
+
+    def stop(self):
+        global _active
+        self.profiler.disable()
+        elapsed = time.perf_counter() - self.started
+        peak = tracemalloc.get_traced_memory()[1]
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ENTRIES]
+        tracemalloc.stop()
+        _active = None
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        base = os.path.join(self.directory, '{}-{}-{}-{}'.format(self.plugin, time.strftime('%Y%m%dT%H%M%S', time.localtime(self.startedAt)), os.getpid(), next(_sequence)))
+        self.profiler.dump_stats(base + '.prof')
+
+        functions = io.StringIO()
+        pstats.Stats(self.profiler, stream=functions).sort_stats('cumulative').print_stats(TOP_ENTRIES)
+        summary = dict(
+            plugin=self.plugin,
+            arguments=self.arguments,
+            started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.startedAt)),
+            seconds=elapsed,
+            phases=self.phases,
+            # Whatever the phases don't cover is python, such as building results and ipaddress objects
+            other_seconds=max(0.0, elapsed - sum(timing['seconds'] for timing in self.phases.values())),
+            peak_memory_bytes=peak,
+            top_allocations=[dict(location=str(statistic.traceback[0]), bytes=statistic.size, count=statistic.count) for statistic in allocations],
+            top_functions=functions.getvalue().splitlines(),
+        )
+        with open(base + '.json', 'w') as f:
+            json.dump(summary, f, indent=2, default=str)
+        return base
+
+
+def profiled_lookup(plugin):
+    """Profiles a lookup's run() when rt_profile is passed to it or RACKTABLES_PROFILE is set."""
+    def decorator(run):
+        @functools.wraps(run)
+        def wrapper(self, terms, variables=None, **kwargs):
+            directory = kwargs.get('rt_profile') or os.environ.get(PROFILE_ENV)
+            if not directory or _active is not None:
+                return run(self, terms, variables, **kwargs)
+            profile = Profile(plugin, os.path.expanduser(directory), dict(kwargs, terms=terms))
+            profile.start()
+            try:
+                return run(self, terms, variables, **kwargs)
+            finally:
+                profile.stop()
+        return wrapper
+    return decorator
+
+
+def profiled_module(plugin):
+    """Profiles a module's run_module() when its rt_profile option or RACKTABLES_PROFILE is set on the managed host."""
+    def decorator(runModule):
+        @functools.wraps(runModule)
+        def wrapper():
+            directory = os.environ.get(PROFILE_ENV)
+            arguments = {}
+            try:
+                # The arguments are only parsed by AnsibleModule inside the run, peek at them here
+                from ansible.module_utils.basic import _load_params
+                arguments = _load_params()
+                directory = arguments.get('rt_profile') or directory
+            except Exception:
+                pass
+            if not directory:
+                return runModule()
+            profile = Profile(plugin, os.path.expanduser(directory), arguments)
+            profile.start()
+            try:
+                return runModule()
+            finally:
+                # Modules leave through sys.exit, the profile is written on the way out
+                try:
+                    profile.stop()
+                except OSError:
+                    pass
+        return wrapper
+    return decorator
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# Each unit of a rack is split in three atoms, kept as bits of one integer per unit
+ATOMS = ('front', 'interior', 'rear')
+ATOM_BITS = dict((atom, 1 << i) for i, atom in enumerate(ATOMS))
+
+
+def atomMask(atoms):
+    mask = 0
+    for atom in atoms:
+        mask |= ATOM_BITS[atom]
+    return mask
+
+
+def getRacks(connection, racks=None, row=None, location=None, tags=None, lock=False):
+    """Returns the (id, name, height, row, location) of the racks matching every filter given, ordered by name."""
+    sql = "SELECT R.id, R.name, R.height, R.row_name, R.location_name FROM Rack R WHERE 1=1"
+    args = []
+    if racks:
+        sql += " AND R.name IN ({})".format(','.join(['%s'] * len(racks)))
+        args.extend(racks)
+    if row:
+        sql += " AND R.row_name=%s"
+        args.append(row)
+    if location:
+        sql += " AND R.location_name=%s"
+        args.append(location)
+    if tags:
+        sql += " AND R.id IN (SELECT TS.entity_id FROM TagStorage TS, TagTree TT WHERE TS.entity_realm='rack' AND TT.id=TS.tag_id AND TT.tag IN ({}) GROUP BY TS.entity_id HAVING COUNT(DISTINCT TT.id)=%s)".format(','.join(['%s'] * len(tags)))
+        args.extend(tags)
+        args.append(len(tags))
+    sql += " ORDER BY R.name"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, args)
+        rows = cursor.fetchall()
+        if lock:
+            # Racks are objects, locking their rows serialises every mount into them
+            for rack in rows:
+                cursor.execute("SELECT id FROM `Object` WHERE id=%s FOR UPDATE", rack[0])
+    return rows
+
+
+def getRackSpace(connection, rackIds, lock=False):
+    """Returns every (rack_id, unit_no, atom, state, object_id) row of the racks, in one query."""
+    if not rackIds:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT rack_id, unit_no, atom, state, object_id FROM RackSpace WHERE rack_id IN ({})".format(','.join(['%s'] * len(rackIds))) + (" FOR UPDATE" if lock else ""), list(rackIds))
+        return cursor.fetchall()
+
+
+def buildOccupancy(racks, rackSpace):
+    """Returns a list per rack, indexed by unit number, of the bits of the atoms that aren't free.
+
+    Any RackSpace row makes its atom unavailable, whether it is taken by an
+    object or marked absent or unusable.
+    """
+    occupancy = dict((rack[0], [0] * ((rack[2] or 0) + 1)) for rack in racks)
+    for rackId, unit, atom, state, objectId in rackSpace:
+        units = occupancy.get(rackId)
+        if units is not None and 0 < unit < len(units):
+            units[unit] |= ATOM_BITS[atom]
+    return occupancy
+
+
+def findFreeStarts(units, height, mask):
+    """Returns the lowest unit of every run of height units that have all the atoms in mask free."""
+    starts = []
+    run = 0
+    for unit in range(1, len(units)):
+        run = run + 1 if not units[unit] & mask else 0
+        if run >= height:
+            starts.append(unit - height + 1)
+    return starts
+
+
+def usedPercent(units):
+    size = (len(units) - 1) * len(ATOMS)
+    if not size:
+        return 100.0
+    used = sum(bin(bits).count('1') for bits in units)
+    return round(100.0 * used / size, 1)
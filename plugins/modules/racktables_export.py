@@ -0,0 +1,280 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_export
+
+short_description: Exports the Racktables data model to a file
+
+version_added: "2.4"
+
+description:
+    - "Write objects, ports, links, networks, allocations, VLANs and tags from Racktables to a file, one record per line"
+    - "Rows are streamed from the database with server side cursors and written as they arrive, so memory use doesn't grow with the size of the export"
+    - "All tables are read from one consistent snapshot of the database"
+    - "The file is replaced atomically, and only when its content changed"
+
+requirements:
+    - mysqlclient or PyMySQL (python3 library)
+    - msgpack (python3 library), only for I(format=msgpack)
+
+options:
+    path:
+        description:
+            - The file to write the export to
+        required: true
+        type: path
+    format:
+        description:
+            - C(ndjson) writes one JSON document per line
+            - C(msgpack) writes a stream of msgpack maps, which needs the msgpack python library
+        required: false
+        default: ndjson
+        choices: [ ndjson, msgpack ]
+        type: str
+    compression:
+        description:
+            - Compress the file with gzip
+        required: false
+        default: none
+        choices: [ none, gzip ]
+        type: str
+    include:
+        description:
+            - The kinds of records to export, all of them by default
+        required: false
+        type: list
+        choices: [ object, port, link, network, allocation, vlan_domain, vlan, tag, tag_assignment ]
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+    - files
+'''
+
+EXAMPLES = '''
+# Export everything for the CMDB sync
+- name: Export Racktables
+  racktables_export:
+    path: /var/lib/cmdb/racktables.ndjson.gz
+    compression: gzip
+
+# Export only the network model as msgpack
+- name: Export networks and allocations
+  racktables_export:
+    path: /var/lib/monitoring/networks.msgpack
+    format: msgpack
+    include:
+      - network
+      - allocation
+'''
+
+RETURN = '''
+path:
+    description: The file the export was written to
+    type: str
+    returned: always
+counts:
+    description: The number of records exported of each kind
+    type: dict
+    returned: always
+size:
+    description: The size of the file in bytes
+    type: int
+    returned: always
+checksum:
+    description: The SHA1 checksum of the file
+    type: str
+    returned: always
+'''
+import datetime
+import decimal
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+HAVE_MSGPACK = False
+try:
+    import msgpack
+    HAVE_MSGPACK = True
+except ImportError:
+    pass
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils._text import to_bytes, to_text
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+# Rows fetched from the server at a time
+FETCH_SIZE = 1000
+
+# Each kind of record, with the query that streams it and the names of its fields
+EXPORT_SQL = [
+    ('object', "SELECT RTO.id, RTO.name, RTO.label, RTD.dict_value, RTO.asset_no, RTO.has_problems, RTO.comment FROM `Object` RTO LEFT JOIN Dictionary RTD ON RTD.dict_key=RTO.objtype_id ORDER BY RTO.id",
+        ('id', 'name', 'label', 'type', 'asset_no', 'has_problems', 'comment')),
+    ('port', "SELECT RTP.id, RTP.object_id, RTP.name, RTP.label, RTP.l2address, PII.iif_name, POI.oif_name, RTP.reservation_comment FROM Port RTP LEFT JOIN PortInnerInterface PII ON PII.id=RTP.iif_id LEFT JOIN PortOuterInterface POI ON POI.id=RTP.type ORDER BY RTP.id",
+        ('id', 'object_id', 'name', 'label', 'l2address', 'inner_interface', 'outer_interface', 'reservation_comment')),
+    ('link', "SELECT porta, portb, cable FROM Link ORDER BY porta, portb",
+        ('porta', 'portb', 'cable')),
+    ('network', "SELECT N.id, INET_NTOA(N.ip), N.mask, N.name, N.comment, V.domain_id, V.vlan_id FROM IPv4Network N LEFT JOIN VLANIPv4 V ON V.ipv4net_id=N.id ORDER BY N.ip, N.mask",
+        ('id', 'ip', 'mask', 'name', 'comment', 'vlan_domain_id', 'vlan')),
+    ('allocation', "SELECT object_id, INET_NTOA(ip), name, `type` FROM IPv4Allocation ORDER BY object_id, ip",
+        ('object_id', 'ip', 'name', 'type')),
+    ('vlan_domain', "SELECT id, description FROM VLANDomain ORDER BY id",
+        ('id', 'description')),
+    ('vlan', "SELECT domain_id, vlan_id, vlan_type, vlan_descr FROM VLANDescription ORDER BY domain_id, vlan_id",
+        ('domain_id', 'vlan_id', 'type', 'description')),
+    ('tag', "SELECT id, parent_id, tag FROM TagTree ORDER BY id",
+        ('id', 'parent_id', 'tag')),
+    ('tag_assignment', "SELECT entity_realm, entity_id, tag_id FROM TagStorage ORDER BY entity_realm, entity_id, tag_id",
+        ('realm', 'entity_id', 'tag_id')),
+]
+
+def nativeValue(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return to_text(bytes(value), errors='surrogate_or_strict')
+    return value
+
+class HashingWriter(object):
+    """Passes writes on to a file while keeping the SHA1 of everything written."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.sha1.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+def contentChecksum(path, compressed):
+    # Compare the content before compression, which is what was hashed while writing
+    sha1 = hashlib.sha1()
+    try:
+        with (gzip.open(path, 'rb') if compressed else open(path, 'rb')) as existingFile:
+            for chunk in iter(lambda: existingFile.read(65536), b''):
+                sha1.update(chunk)
+    except (IOError, OSError, EOFError):
+        return None
+    return sha1.hexdigest()
+
+@profiled_module('racktables_export')
+def run_module():
+    module_args = dict(
+        path=dict(type='path', required=True),
+        format=dict(type='str', default='ndjson', choices=['ndjson', 'msgpack']),
+        compression=dict(type='str', default='none', choices=['none', 'gzip']),
+        include=dict(type='list', elements='str', required=False, choices=[kind for kind, sql, fields in EXPORT_SQL]),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        path='',
+        counts={},
+        size=0,
+        checksum='',
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        add_file_common_args=True,
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+    if module.params['format'] == 'msgpack' and HAVE_MSGPACK is False:
+        module.fail_json(msg=missing_required_lib('msgpack'))
+
+    path = module.params['path']
+    result['path'] = path
+    include = module.params['include'] or [kind for kind, sql, fields in EXPORT_SQL]
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        module.fail_json(msg="The directory {} does not exist".format(directory), **result)
+
+    if module.params['format'] == 'msgpack':
+        packer = msgpack.Packer(use_bin_type=True)
+        encode = packer.pack
+    else:
+        def encode(record):
+            return to_bytes(json.dumps(record, sort_keys=True, separators=(',', ':'))) + b'\n'
+
+    # Sessions borrowed from the racktables connection can't stream, so always connect directly
+    db = RacktablesDB(module.params, module, persistent=False)
+    connection = db.read
+
+    fd, tmpPath = tempfile.mkstemp(prefix='.racktables_export', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as rawFile:
+            if module.params['compression'] == 'gzip':
+                # No file name or timestamp in the header, so unchanged data produces an identical file
+                output = gzip.GzipFile(filename='', mode='wb', fileobj=rawFile, mtime=0)
+            else:
+                output = rawFile
+            writer = HashingWriter(output)
+            with connection.cursor() as cursor:
+                cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            for kind, sql, fields in EXPORT_SQL:
+                if kind not in include:
+                    continue
+                count = 0
+                with connection.cursor(streaming=True) as cursor:
+                    cursor.execute(sql)
+                    while True:
+                        rows = cursor.fetchmany(FETCH_SIZE)
+                        if not rows:
+                            break
+                        for row in rows:
+                            record = dict(zip(fields, [nativeValue(value) for value in row]))
+                            record['kind'] = kind
+                            writer.write(encode(record))
+                        count += len(rows)
+                result['counts'][kind] = count
+            connection.rollback()
+            if output is not rawFile:
+                output.close()
+        existing = contentChecksum(path, module.params['compression'] == 'gzip') if os.path.exists(path) else None
+        result['changed'] = existing != writer.sha1.hexdigest()
+        if result['changed'] and not module.check_mode:
+            module.atomic_move(tmpPath, path)
+    except DBError as e:
+        module.fail_json(msg="Failed to export Racktables: {}".format(e), **result)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+    if not module.check_mode or os.path.exists(path):
+        file_args = module.load_file_common_arguments(module.params)
+        file_args['path'] = path
+        result['changed'] = module.set_fs_attributes_if_different(file_args, result['changed'])
+    if os.path.exists(path):
+        result['size'] = os.path.getsize(path)
+        result['checksum'] = module.sha1(path)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
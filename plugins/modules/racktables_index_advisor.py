@@ -0,0 +1,286 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_index_advisor
+
+short_description: Checks the Racktables schema for the indexes the collection's queries need
+
+version_added: "2.4"
+
+description:
+    - "Compare the indexes of the Racktables database, as listed in information_schema, with the ones the queries of the collection's modules and lookups need"
+    - "An index is found when the columns a query looks rows up by are the leading columns of an existing index, in any order"
+    - "Optionally run EXPLAIN on a representative query for each index and return the plans"
+    - "Optionally create the missing indexes with ALGORITHM=INPLACE, LOCK=NONE, so the tables stay readable and writable while they are built"
+
+options:
+    plugins:
+        description:
+            - Only check the indexes needed by these modules and lookups, all of them by default
+        required: false
+        type: list
+        elements: str
+    explain:
+        description:
+            - Return the EXPLAIN plan of a representative query for each index
+        required: false
+        default: true
+        type: bool
+    create:
+        description:
+            - Create the missing indexes
+            - Each index is built online, the module fails if the server can't build it without locking the table
+            - Indexes are created one at a time and DDL can't be rolled back, the indexes created before a failure are kept
+        required: false
+        default: false
+        type: bool
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+'''
+
+EXAMPLES = '''
+# Report the missing indexes and the query plans
+- name: Check the Racktables indexes
+  racktables_index_advisor:
+  register: advice
+
+# Create whatever the lookups used by the monitoring sync are missing
+- name: Create the indexes
+  racktables_index_advisor:
+    plugins:
+      - racktables_find
+      - racktables_networks
+    explain: false
+    create: true
+'''
+
+RETURN = '''
+indexes:
+    description:
+        - The indexes checked, with the table, the columns, the plugins that need it and its status
+        - The status is C(present), C(missing), C(created), or C(no_table) when the table doesn't exist in this version of Racktables
+        - index is the existing index that serves the queries, or the name of the one that was or would be created
+        - sql is the statement that creates a missing index
+        - explain is the EXPLAIN output of the representative query, one dictionary per row, after any index was created
+    type: list
+    returned: always
+missing:
+    description: The indexes that are missing after the run, as C(table.index)
+    type: list
+    returned: always
+created:
+    description: The indexes that were created, or would be in check mode, as C(table.index)
+    type: list
+    returned: always
+'''
+import decimal
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils._text import to_text
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+# Prefix of the indexes this module creates, so they can be told apart from the ones Racktables ships with
+INDEX_PREFIX = 'ansible_'
+
+OBJECT_PLUGINS = (
+    'racktables_object', 'racktables_object_port', 'racktables_object_link', 'racktables_object_port_link', 'racktables_object_attribute',
+    'racktables_object_decommission', 'racktables_ipv4_allocation', 'racktables_rack_mount', 'racktables_cable_trace', 'racktables_hierarchy',
+)
+TAG_PLUGINS = (
+    'racktables_networks', 'racktables_network_usage', 'racktables_ipv4_nextfree', 'racktables_ipv4_nextfree_network', 'racktables_rack_space',
+    'racktables_ipv4_allocation', 'racktables_ipv4_network', 'racktables_object_decommission',
+)
+
+# The indexes the collection's queries rely on.
+#   columns: the columns the queries look rows up by, compared with the leading columns of the existing indexes
+#   plugins: the modules and lookups that run those queries
+#   query: a representative query for EXPLAIN, with arguments that don't need to match any row
+ADVISED_INDEXES = (
+    dict(table='Object', columns=('name',), plugins=OBJECT_PLUGINS,
+         query="SELECT id FROM `Object` WHERE name=%s", args=('',)),
+    dict(table='Object', columns=('asset_no',), plugins=('racktables_object',),
+         query="SELECT id FROM `Object` WHERE asset_no=%s", args=('',)),
+    dict(table='Port', columns=('object_id', 'name'), plugins=('racktables_object_port', 'racktables_cable_trace'),
+         query="SELECT id FROM Port WHERE object_id=%s AND name=%s", args=(0, '')),
+    dict(table='Port', columns=('l2address',), plugins=('racktables_find',),
+         query="SELECT object_id, name FROM Port WHERE l2address=%s", args=('',)),
+    dict(table='IPv4Allocation', columns=('ip',), plugins=('racktables_find', 'racktables_ipv4_nextfree', 'racktables_network_usage', 'racktables_ipv4_allocation'),
+         query="SELECT object_id FROM IPv4Allocation WHERE ip BETWEEN %s AND %s", args=(0, 255)),
+    dict(table='IPv4Allocation', columns=('object_id', 'name'), plugins=('racktables_ipv4_allocation',),
+         query="SELECT ip FROM IPv4Allocation WHERE object_id=%s AND name=%s", args=(0, '')),
+    dict(table='IPv4Network', columns=('ip', 'mask'), plugins=('racktables_ipv4_network', 'racktables_find', 'racktables_ipv4_nextfree_network'),
+         query="SELECT id FROM IPv4Network WHERE ip=%s AND mask=%s", args=(0, 24)),
+    dict(table='VLANIPv4', columns=('ipv4net_id',), plugins=('racktables_networks', 'racktables_network_usage', 'racktables_ipv4_network', 'racktables_vlan'),
+         query="SELECT vlan_id FROM VLANIPv4 WHERE ipv4net_id=%s", args=(0,)),
+    dict(table='TagTree', columns=('tag',), plugins=TAG_PLUGINS,
+         query="SELECT id FROM TagTree WHERE tag=%s", args=('',)),
+    dict(table='TagStorage', columns=('entity_realm', 'entity_id'), plugins=('racktables_networks', 'racktables_ipv4_network', 'racktables_object_decommission'),
+         query="SELECT tag_id FROM TagStorage WHERE entity_realm=%s AND entity_id=%s", args=('ipv4net', 0)),
+    dict(table='TagStorage', columns=('tag_id', 'entity_realm'), plugins=TAG_PLUGINS,
+         query="SELECT entity_id FROM TagStorage WHERE tag_id=%s AND entity_realm=%s", args=(0, 'ipv4net')),
+    dict(table='EntityLink', columns=('parent_entity_type', 'parent_entity_id'), plugins=('racktables_hierarchy', 'racktables_object_link', 'racktables_object_port_link', 'racktables_object_decommission'),
+         query="SELECT child_entity_id FROM EntityLink WHERE parent_entity_type='object' AND parent_entity_id=%s", args=(0,)),
+    dict(table='EntityLink', columns=('child_entity_type', 'child_entity_id'), plugins=('racktables_hierarchy', 'racktables_object_link', 'racktables_object_port_link', 'racktables_object_decommission'),
+         query="SELECT parent_entity_id FROM EntityLink WHERE child_entity_type='object' AND child_entity_id=%s", args=(0,)),
+    dict(table='Link', columns=('porta',), plugins=('racktables_cable_trace', 'racktables_object_decommission'),
+         query="SELECT portb FROM Link WHERE porta=%s", args=(0,)),
+    dict(table='Link', columns=('portb',), plugins=('racktables_cable_trace', 'racktables_object_decommission'),
+         query="SELECT porta FROM Link WHERE portb=%s", args=(0,)),
+    dict(table='LinkBackend', columns=('porta',), plugins=('racktables_cable_trace',),
+         query="SELECT portb FROM LinkBackend WHERE porta=%s", args=(0,)),
+    dict(table='LinkBackend', columns=('portb',), plugins=('racktables_cable_trace',),
+         query="SELECT porta FROM LinkBackend WHERE portb=%s", args=(0,)),
+    dict(table='AttributeValue', columns=('object_id',), plugins=('racktables_object_attribute', 'racktables_object_decommission'),
+         query="SELECT attr_id FROM AttributeValue WHERE object_id=%s", args=(0,)),
+    dict(table='RackSpace', columns=('object_id',), plugins=('racktables_rack_mount', 'racktables_object_decommission'),
+         query="SELECT rack_id FROM RackSpace WHERE object_id=%s", args=(0,)),
+    dict(table='RackSpace', columns=('rack_id',), plugins=('racktables_rack_space', 'racktables_rack_mount'),
+         query="SELECT unit_no, atom FROM RackSpace WHERE rack_id=%s", args=(0,)),
+    # Polled on every refresh of the lookup cache, see racktables_cache
+    dict(table='ObjectHistory', columns=('ctime',), plugins=('racktables_object', 'racktables_find', 'racktables_networks'),
+         query="SELECT id FROM ObjectHistory WHERE ctime>=%s", args=('1970-01-01 00:00:00',)),
+)
+
+def nativeValue(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return to_text(bytes(value), errors='surrogate_or_strict')
+    return value
+
+def indexName(table, columns):
+    return '{}{}_{}'.format(INDEX_PREFIX, table.lower(), '_'.join(columns))
+
+def coveringIndex(indexes, columns):
+    """The name of an index whose leading columns are exactly the given ones, in any order."""
+    wanted = set(column.lower() for column in columns)
+    # The primary key first, then the shortest index
+    for name, indexColumns in sorted(indexes.items(), key=lambda index: (index[0] != 'PRIMARY', len(index[1]), index[0])):
+        if set(column.lower() for column in indexColumns[:len(columns)]) == wanted:
+            return name
+    return None
+
+@profiled_module('racktables_index_advisor')
+def run_module():
+    module_args = dict(
+        plugins=dict(type='list', elements='str', required=False),
+        explain=dict(type='bool', required=False, default=True),
+        create=dict(type='bool', required=False, default=False),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        indexes=[],
+        missing=[],
+        created=[],
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    known = set(plugin for advised in ADVISED_INDEXES for plugin in advised['plugins'])
+    unknown = sorted(set(module.params['plugins'] or []) - known)
+    if unknown:
+        module.fail_json(msg="No queries are known for these plugins: {}".format(', '.join(unknown)), **result)
+    advisedIndexes = [advised for advised in ADVISED_INDEXES if not module.params['plugins'] or set(advised['plugins']) & set(module.params['plugins'])]
+
+    # The schema is changed on the primary, so that is also where it is read, replicas follow through replication.
+    # Rows from a session borrowed from the racktables connection come without the column names EXPLAIN needs, so always connect directly.
+    db = RacktablesDB(module.params, module, persistent=False)
+    connection = db.primary
+
+    def readIndexes(tables):
+        """Table -> index name -> columns in index order, for the tables that exist."""
+        indexes = {}
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME IN ({})".format(', '.join(['%s'] * len(tables))),tables)
+            for row in cursor.fetchall():
+                indexes[row[0]] = {}
+            cursor.execute("SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME IN ({}) ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX".format(', '.join(['%s'] * len(tables))),tables)
+            for table, index, column in cursor.fetchall():
+                indexes.setdefault(table, {}).setdefault(index, []).append(column)
+        return indexes
+
+    def explain(advised):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN " + advised['query'],advised['args'])
+            fields = [column[0] for column in cursor.description]
+            return [dict(zip(fields, [nativeValue(value) for value in row])) for row in cursor.fetchall()]
+
+    tables = sorted(set(advised['table'] for advised in advisedIndexes))
+    try:
+        indexes = readIndexes(tables)
+    except DBError as e:
+        module.fail_json(msg="Failed to read the indexes from information_schema: {}".format(e), **result)
+
+    # Several queries can be served by the same missing index, it is only created once
+    toCreate = {}
+    for advised in advisedIndexes:
+        report = dict(table=advised['table'], columns=list(advised['columns']), plugins=sorted(advised['plugins']), status='present', index=None, sql=None)
+        result['indexes'].append(report)
+        if advised['table'] not in indexes:
+            report['status'] = 'no_table'
+            continue
+        report['index'] = coveringIndex(indexes[advised['table']], advised['columns'])
+        if report['index'] is not None:
+            continue
+        report['status'] = 'missing'
+        report['index'] = indexName(advised['table'], advised['columns'])
+        if report['index'] in indexes[advised['table']]:
+            module.fail_json(msg="The index {} on {} exists with other columns than {}, drop or rename it first".format(report['index'], advised['table'], ', '.join(advised['columns'])), **result)
+        report['sql'] = "ALTER TABLE `{}` ADD INDEX `{}` ({}), ALGORITHM=INPLACE, LOCK=NONE".format(advised['table'], report['index'], ', '.join('`{}`'.format(column) for column in advised['columns']))
+        toCreate.setdefault((advised['table'], report['index']), report['sql'])
+
+    if module.params['create'] and toCreate:
+        result['changed'] = True
+        for (table, index), sql in sorted(toCreate.items()):
+            if not module.check_mode:
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql)
+                except DBError as e:
+                    # DDL commits as it goes, whatever was created before stays
+                    module.fail_json(msg="Failed to create the index {} on {}, {} were created before it: {}".format(index, table, ', '.join(result['created']) or 'no indexes', e), **result)
+            result['created'].append('{}.{}'.format(table, index))
+        for report in result['indexes']:
+            if report['status'] == 'missing':
+                report['status'] = 'created'
+
+    result['missing'] = sorted(set('{}.{}'.format(report['table'], report['index']) for report in result['indexes'] if report['status'] == 'missing'))
+
+    if module.params['explain']:
+        for advised, report in zip(advisedIndexes, result['indexes']):
+            if report['status'] == 'no_table':
+                continue
+            try:
+                report['explain'] = explain(advised)
+            except DBError as e:
+                module.fail_json(msg="Failed to explain the query on {}: {}".format(advised['table'], e), **result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
@@ -32,7 +32,16 @@ options:
     ip:
         description:
             - This is the IP address that will be assigned
-        required: true
+            - Either I(ip) or I(tags) is required when I(state=present)
+        required: false
+    tags:
+        description:
+            - Allocate the first free address from the networks that have all of these tags
+            - The address is found and assigned in one locked transaction, so concurrent runs can't be handed the same address
+            - If the interface already has an address, that address is returned instead
+            - Mutually exclusive with I(ip)
+        required: false
+        type: list
     type:
         description:
             - The type of IP/Interface (regular,shared,virtual,router,point2point)) (Default: regular)
@@ -42,29 +51,11 @@ options:
             - Specify whether the allocation should be present or absent
         required: false
         default: present
-    rt_host:
-        description:
-            - Hostname of the database server backing Racktables
-        required: true
-    rt_port:
-        description:
-            - Port for the database connection, defaults to 3306
-        required: false
-    rt_username:
-        description:
-            - Username that has administrative access to the racktables database
-        required: true
-    rt_password:
-        description:
-            - Password for the administrative user
-        required: true
-    rt_database:
-        description:
-            - Name of the database which backs Racktables
-        required: true
 
 author:
     - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
 '''
 
 EXAMPLES = '''
@@ -75,9 +66,40 @@ EXAMPLES = '''
     interface: "eth0"
     ip: "192.0.2.1"
     type: "regular"
+
+# Assign the next free address from a tagged network
+- name: Allocate an IP address to an object
+  racktables_ipv4_allocation:
+    object: "test.lab1"
+    interface: "eth0"
+    tags:
+      - "LAB1-RDU"
+      - "trust"
+      - "application"
+  register: allocation
 '''
 
 RETURN = '''
+ip:
+    description: The address assigned to the interface
+    type: str
+    returned: when state is present
+netmask:
+    description: The netmask of the network the address was allocated from
+    type: str
+    returned: when tags is used
+gateway:
+    description: The gateway of the network the address was allocated from
+    type: str
+    returned: when tags is used
+netname:
+    description: The name of the network the address was allocated from
+    type: str
+    returned: when tags is used
+vlan:
+    description: The VLAN bound to the network the address was allocated from
+    type: int
+    returned: when tags is used
 original_message:
     description: The original name param that was passed in
     type: str
@@ -87,33 +109,26 @@ message:
     type: str
     returned: always
 '''
-HAVE_PYMYSQL = False
 try:
-    import pymysql.cursors
     import ipaddress
-    import os
-    HAVE_PYMYSQL = True
 except ImportError:
     pass
 
-from ansible.errors import AnsibleError
-from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
 
+@profiled_module('racktables_ipv4_allocation')
 def run_module():
-    if HAVE_PYMYSQL is False:
-        raise AnsibleError("Can't run module racktables_object: module PyMySQL is not installed")
     module_args = dict(
         object=dict(type='str', required=True),
         interface=dict(type='str', required=True),
         ip=dict(type='str', required=False),
+        tags=dict(type='list', elements='str', required=False),
         type=dict(type='str', required=False, default="regular"),
         state=dict(type='str', default='present', choices=['present', 'absent']),
-        rt_host=dict(type='str',required=True),
-        rt_port=dict(type='int',required=False,default=3306),
-        rt_username=dict(type='str',required=True),
-        rt_password=dict(type='str',required=True,no_log=True),
-        rt_database=dict(type='str',required=True)
     )
+    module_args.update(racktables_argument_spec())
 
     result = dict(
         changed=False,
@@ -125,66 +140,163 @@ def run_module():
         interface='',
         ip='',
         type='',
+        netmask='',
+        gateway='',
+        netname='',
+        vlan='',
     )
 
     module = AnsibleModule(
         argument_spec=module_args,
+        mutually_exclusive=[('ip', 'tags')],
+        required_if=[('state', 'present', ('ip', 'tags'), True)],
         supports_check_mode=True
     )
 
-    try:
-        connection = pymysql.connect(host=module.params['rt_host'],port=module.params['rt_port'],user=module.params['rt_username'],password=module.params['rt_password'],db=module.params['rt_database'])
-    except:
-        raise AnsibleError("An error occured while connecting to your Racktables database, please check your connection info and try again")
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
 
-    rt_allocation_sql="SELECT RTO.name,INET_NTOA(RTIP.ip),RTIP.name,RTIP.type FROM IPv4Allocation RTIP, Object RTO WHERE RTIP.object_id=RTO.id AND RTO.name=%s AND RTIP.name=%s"
-    rt_allocation={}
-    with connection.cursor() as cursor:
-        cursor.execute(rt_allocation_sql,(module.params['object'],module.params['interface']))
-        rt_allocation = cursor.fetchone()
-        if rt_allocation:
-            result['original_object']=rt_allocation[0]
-            result['original_interface']=rt_allocation[2]
-            result['original_ip']=rt_allocation[1]
-            result['original_type']=rt_allocation[3]
+    db = RacktablesDB(module.params, module)
 
-    if module.check_mode:
+    def getAddressNetwork(connection, address):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT INET_NTOA(N.ip), N.mask, N.name, V.vlan_id FROM IPv4Network N LEFT JOIN VLANIPv4 V ON V.ipv4net_id=N.id WHERE N.ip<=INET_ATON(%s) AND N.ip+POW(2,32-N.mask)>INET_ATON(%s) ORDER BY N.mask DESC LIMIT 1",(address,address))
+            return cursor.fetchone()
+
+    def getTaggedNetworks(connection, tags):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT N.id, INET_NTOA(N.ip), N.mask, N.name, V.vlan_id FROM IPv4Network N, VLANIPv4 V, TagStorage TS, TagTree TT WHERE V.ipv4net_id=N.id AND TS.entity_realm='ipv4net' AND TS.entity_id=N.id AND TT.id=TS.tag_id AND TT.tag IN ({}) GROUP BY N.id, N.ip, N.mask, N.name, V.vlan_id HAVING COUNT(DISTINCT TT.id)=%s ORDER BY N.ip".format(','.join(['%s'] * len(tags))),tags + [len(tags)])
+            return cursor.fetchall()
+
+    def findFreeAddress(connection, network, lock=False):
+        ipnetwork = ipaddress.ip_network("{}/{}".format(network[1],network[2]))
+        # A plain read would come from the snapshot the transaction opened with its first query, which can't see
+        # addresses a concurrent run committed while this one waited for the network lock. A locking read sees them.
+        suffix = " LOCK IN SHARE MODE" if lock else ""
+        used = set()
+        with connection.cursor() as cursor:
+            for table in ('IPv4Allocation', 'IPv4Address'):
+                cursor.execute("SELECT ip FROM {} WHERE ip BETWEEN %s AND %s".format(table) + suffix,(int(ipnetwork.network_address),int(ipnetwork.broadcast_address)))
+                used.update(row[0] for row in cursor.fetchall())
+        for address in ipnetwork.hosts():
+            if address == ipnetwork[1] or address == ipnetwork[2]:
+                # In our scheme, these are the gateway addresses, so we never hand them out
+                continue
+            if int(address) not in used:
+                return str(address)
+        return None
+
+    def setAddressResult(address, network):
+        subnet = ipaddress.ip_network("{}/{}".format(network[0],network[1]))
+        result['ip'] = address
+        result['netmask'] = str(subnet.netmask)
+        result['gateway'] = str(subnet[1])
+        result['netname'] = network[2]
+        result['vlan'] = network[3]
+
+    # Resolves the object and its allocation on the interface in one round trip
+    rt_allocation_sql="SELECT RTO.name,INET_NTOA(RTIP.ip),RTIP.name,RTIP.type,RTIP.object_id,RTIP.ip,RTO.id FROM (SELECT %s AS object, %s AS name) RTQ LEFT JOIN `Object` RTO ON RTO.name=RTQ.object LEFT JOIN IPv4Allocation RTIP ON RTIP.object_id=RTO.id AND RTIP.name=RTQ.name"
+    def getAllocation(connection, lock=False):
+        with connection.cursor() as cursor:
+            cursor.execute(rt_allocation_sql + (" FOR UPDATE" if lock else ""),(module.params['object'],module.params['interface']))
+            row = cursor.fetchone()
+        return (row if row[4] is not None else None), row[6]
+
+    def propsMatch(rt_allocation):
+        return module.params['object'] == rt_allocation[0] and module.params['interface'] == rt_allocation[2] and module.params['ip'] == rt_allocation[1] and module.params['type'] == rt_allocation[3]
+
+    rt_allocation, object_id = getAllocation(db.read)
+    if rt_allocation:
+        result['original_object']=rt_allocation[0]
+        result['original_interface']=rt_allocation[2]
+        result['original_ip']=rt_allocation[1]
+        result['original_type']=rt_allocation[3]
+
+    def exitWithAllocation(connection, rt_allocation):
+        # The interface already has an address, hand that back instead of allocating another
+        network = getAddressNetwork(connection, rt_allocation[1])
+        if network:
+            setAddressResult(rt_allocation[1], network)
+        else:
+            result['ip'] = rt_allocation[1]
+        module.exit_json(**result)
+
+    if module.params['tags'] and module.params['state'] == "present":
+        result['object'] = module.params['object']
+        result['interface'] = module.params['interface']
+        result['type'] = module.params['type']
+        if rt_allocation:
+            exitWithAllocation(db.read, rt_allocation)
+        connection = db.read if module.check_mode else db.primary
+        if not object_id:
+            module.fail_json(msg="Provided object doesn't exist, please check spelling or create object", **result)
+        networks = getTaggedNetworks(connection, sorted(set(module.params['tags'])))
+        if not networks:
+            module.fail_json(msg="No networks were returned, please check your provided tags", **result)
+        if not module.check_mode:
+            # Lock the candidate networks so concurrent allocations from them are serialized
+            with connection.cursor() as cursor:
+                networkIds = [network[0] for network in networks]
+                cursor.execute("SELECT id FROM IPv4Network WHERE id IN ({}) ORDER BY id FOR UPDATE".format(','.join(['%s'] * len(networkIds))),networkIds)
+            # A concurrent run may have given the interface an address while this one waited for the locks, and only a
+            # locking read sees it past this transaction's snapshot
+            rt_allocation, object_id = getAllocation(connection, lock=True)
+            if rt_allocation:
+                connection.rollback()
+                exitWithAllocation(connection, rt_allocation)
+        for network in networks:
+            address = findFreeAddress(connection, network, lock=not module.check_mode)
+            if address:
+                break
+        else:
+            connection.rollback()
+            module.fail_json(msg="Unable to find a free address with the provided tags. Please ask IPEng to create a new network with the following parameters: {}".format(module.params['tags']), **result)
+        setAddressResult(address, network[1:])
+        result['changed'] = True
+        if not module.check_mode:
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO IPv4Allocation (object_id, ip, name, `type`) VALUES(%s, INET_ATON(%s), %s, %s);",(object_id,address,module.params['interface'],module.params['type']))
+            connection.commit()
         module.exit_json(**result)
 
     props_match = False
     if rt_allocation:
-        if module.params['object'] == rt_allocation[0] and module.params['interface'] == rt_allocation[2] and module.params['ip'] == rt_allocation[1] and module.params['type'] == rt_allocation[3]:
-            props_match = True
-    
-    if not props_match and not module.check_mode and module.params['state'] == "present":
+        props_match = propsMatch(rt_allocation)
+
+    needs_change = (module.params['state'] == "present" and not props_match) or (module.params['state'] == "absent" and rt_allocation)
+    if module.check_mode:
+        result['changed'] = bool(needs_change)
+        module.exit_json(**result)
+    if needs_change and db.is_replica:
+        # The replica may be behind, so confirm the current state on the primary before writing
+        rt_allocation, object_id = getAllocation(db.primary, lock=True)
+        props_match = bool(rt_allocation) and propsMatch(rt_allocation)
+    connection = db.primary if needs_change else db.read
+
+    if not props_match and module.params['state'] == "present":
+        if not object_id:
+            module.fail_json(msg="Provided object doesn't exist, please check spelling or create object", **result)
         with connection.cursor() as cursor:
-            cursor.execute("SELECT id FROM Object WHERE name=%s",module.params['object'])
-            try:
-                object_id = cursor.fetchone()[0]
-            except:
-                module.fail_json(msg="Provided object doesn't exist, please check spelling or create object", **result)
+            # The key of IPv4Allocation is the object and address, not the interface, so a moved address is updated in
+            # place. The affected rows are 0 when a concurrent run already made the same change
             if rt_allocation:
-                cursor.execute("UPDATE IPv4Allocation SET ip=INET_ATON(%s), type=%s WHERE object_id=%s AND name=%s;",(module.params['ip'],module.params['type'],object_id,module.params['interface']))
+                cursor.execute("UPDATE IPv4Allocation SET ip=INET_ATON(%s), type=%s WHERE object_id=%s AND ip=%s;",(module.params['ip'],module.params['type'],rt_allocation[4],rt_allocation[5]))
             if not rt_allocation:
                 cursor.execute("INSERT INTO IPv4Allocation (object_id, ip, name, `type`) VALUES(%s, INET_ATON(%s), %s, %s);",(object_id,module.params['ip'],module.params['interface'],module.params['type']))
+            result['changed'] = cursor.rowcount > 0
         connection.commit()
-        result['changed'] = True
         result['object'] = module.params['object']
         result['interface'] = module.params['interface']
         result['ip'] = module.params['ip']
         result['type'] = module.params['type']
-    elif not module.check_mode and module.params['state'] == "absent":
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT id FROM Object WHERE name=%s",module.params['object'])
-            object_id = cursor.fetchone()[0]
-            cursor.execute("SELECT object_id,name FROM IPv4Allocation WHERE object_id=%s AND name=%s",(object_id,module.params['interface']))
-            allocation = cursor.fetchone()
-            if allocation:
-                cursor.execute("DELETE FROM IPv4Allocation WHERE object_id=%s AND name=%s",(object_id,module.params['interface']))
-                connection.commit()
-                result['changed'] = True
-            else:
-                result['changed'] = False
+    elif module.params['state'] == "absent":
+        if rt_allocation:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM IPv4Allocation WHERE object_id=%s AND ip=%s",(rt_allocation[4],rt_allocation[5]))
+                result['changed'] = cursor.rowcount > 0
+            connection.commit()
+        else:
+            result['changed'] = False
 
     module.exit_json(**result)
 
@@ -192,4 +304,4 @@ def main():
     run_module()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,583 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_ipv4_network
+
+short_description: Manages IPv4 networks in Racktables
+
+version_added: "2.4"
+
+description:
+    - "Create, update, and delete IPv4 networks in Racktables"
+    - "New networks can be carved out of a container network, taking the first free aligned subnet of the requested size"
+    - "The network, its tags and its VLAN are written in a single transaction"
+    - "With I(networks), a whole list of networks is managed in one task, such as when importing an IPAM plan"
+
+options:
+    network:
+        description:
+            - The network in CIDR notation
+            - Required when I(state=absent)
+            - Mutually exclusive with I(container) and I(container_tags)
+        required: false
+        type: str
+    networks:
+        description:
+            - A list of networks to manage in one transaction, instead of a single I(network)
+            - Each entry has a C(network) in CIDR notation and the C(name), C(comment), C(tags), C(vlan) and C(vlan_domain) options of that network, C(name) is required when I(state=present)
+            - I(tags) are added to every network, and I(vlan) and I(vlan_domain) apply to the entries that don't set their own
+            - New networks are checked against every network in Racktables, and against each other, before anything is written
+            - Mutually exclusive with I(network), I(container) and I(container_tags)
+        required: false
+        type: list
+        elements: dict
+    allow_nested:
+        description:
+            - Allow the new networks in I(networks) to be nested in, or contain, other networks
+            - Otherwise the module fails without changing anything when one of them would
+        required: false
+        type: bool
+        default: false
+    container:
+        description:
+            - Carve a new network of size I(mask) out of this network, given in CIDR notation
+            - The container doesn't need to exist in Racktables
+            - If a network named I(name) already exists inside the container, that network is managed instead
+        required: false
+        type: str
+    container_tags:
+        description:
+            - Carve a new network of size I(mask) out of the first network with all of these tags that has room for it
+            - If a network named I(name) already exists inside one of these networks, that network is managed instead
+        required: false
+        type: list
+    mask:
+        description:
+            - The prefix length of the network to carve, for example 29 for a /29
+            - Required with I(container) or I(container_tags)
+        required: false
+        type: int
+    name:
+        description:
+            - The name of the network
+            - Required when I(state=present)
+        required: false
+        type: str
+    comment:
+        description:
+            - The comment on the network, left untouched when not set
+        required: false
+        type: str
+    tags:
+        description:
+            - Tags to add to the network, tags it already has are kept
+        required: false
+        type: list
+    vlan:
+        description:
+            - The VLAN to bind the network to, it must already exist in I(vlan_domain)
+            - A binding to another VLAN of I(vlan_domain) is replaced, bindings in other domains are left untouched
+        required: false
+        type: int
+    vlan_domain:
+        description:
+            - The name of the VLAN domain I(vlan) belongs to
+        required: false
+        type: str
+    state:
+        description:
+            - Specify whether the network should be present or absent
+        required: false
+        default: present
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+'''
+
+EXAMPLES = '''
+# Create a network
+- name: Create a network
+  racktables_ipv4_network:
+    network: "192.0.2.0/24"
+    name: "lab1-mgmt"
+    tags:
+      - "LAB1-RDU"
+
+# Carve the next free /29 out of the lab supernet and bind it to a VLAN
+- name: Create a network for a new application
+  racktables_ipv4_network:
+    container: "10.0.0.0/8"
+    mask: 29
+    name: "app01"
+    tags:
+      - "LAB1-RDU"
+      - "application"
+    vlan: 100
+    vlan_domain: "MainDC"
+  register: app_network
+
+# Import the networks of a new site
+- name: Create the networks of LAB1
+  racktables_ipv4_network:
+    networks:
+      - network: "192.0.2.0/26"
+        name: "lab1-web"
+        vlan: 100
+      - network: "192.0.2.64/26"
+        name: "lab1-db"
+        vlan: 200
+        tags:
+          - "database"
+    tags:
+      - "LAB1-RDU"
+    vlan_domain: "LAB1"
+
+# Remove a network
+- name: Remove a network
+  racktables_ipv4_network:
+    network: "192.0.2.0/24"
+    state: absent
+'''
+
+RETURN = '''
+network:
+    description: The network in CIDR notation
+    type: str
+    returned: always
+name:
+    description: The name of the network
+    type: str
+    returned: always
+netmask:
+    description: The netmask of the network
+    type: str
+    returned: always
+container:
+    description: The container the network was carved out of or found in
+    type: str
+    returned: when container or container_tags is used
+tags:
+    description: The tags the network has
+    type: list
+    returned: when state is present
+vlan:
+    description: The VLAN the network is bound to
+    type: int
+    returned: when state is present
+changes:
+    description:
+        - One entry per network that was (or in check mode would be) changed, with its C(network) and the C(before) and C(after) state
+        - Each state has the C(name), C(comment), C(tags), C(vlan_domain) and C(vlan) of the network, or is null when the network doesn't exist
+    type: list
+    returned: when networks is used
+'''
+try:
+    import ipaddress
+except ImportError:
+    pass
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_ipam import buildNetworkIndex, carveSubnet, findOverlaps, formatNetwork, getTaggedNetworks, networkEnd
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+# Maximum number of values bound into a single IN (...) clause, and of rows written per statement
+BATCH_SIZE = 1000
+
+# Number of overlapping networks listed when failing
+MAX_REPORTED = 10
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+@profiled_module('racktables_ipv4_network')
+def run_module():
+    module_args = dict(
+        network=dict(type='str', required=False),
+        networks=dict(type='list', elements='dict', required=False, options=dict(
+            network=dict(type='str', required=True),
+            name=dict(type='str', required=False),
+            comment=dict(type='str', required=False),
+            tags=dict(type='list', elements='str', required=False),
+            vlan=dict(type='int', required=False),
+            vlan_domain=dict(type='str', required=False),
+        )),
+        allow_nested=dict(type='bool', required=False, default=False),
+        container=dict(type='str', required=False),
+        container_tags=dict(type='list', elements='str', required=False),
+        mask=dict(type='int', required=False),
+        name=dict(type='str', required=False),
+        comment=dict(type='str', required=False),
+        tags=dict(type='list', elements='str', required=False),
+        vlan=dict(type='int', required=False),
+        vlan_domain=dict(type='str', required=False),
+        state=dict(type='str', default='present', choices=['present', 'absent']),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        network='',
+        netmask='',
+        name='',
+        container='',
+        tags=[],
+        vlan='',
+        changes=[],
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        mutually_exclusive=[('network', 'networks', 'container', 'container_tags')],
+        required_one_of=[('network', 'networks', 'container', 'container_tags')],
+        required_if=[
+            ('state', 'present', ('name', 'networks'), True),
+            ('state', 'absent', ('network', 'networks'), True),
+        ],
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    if not module.params['networks'] and (module.params['vlan'] is None) != (module.params['vlan_domain'] is None):
+        # With networks, vlan_domain on its own is the domain of the entries' VLANs
+        module.fail_json(msg="parameters are required together: vlan, vlan_domain", **result)
+
+    carving = not module.params['network'] and module.params['networks'] is None
+    if carving and module.params['mask'] is None:
+        module.fail_json(msg="mask is required when container or container_tags is used", **result)
+    if carving and (module.params['mask'] < 1 or module.params['mask'] > 32):
+        module.fail_json(msg="mask must be between 1 and 32", **result)
+
+    try:
+        if module.params['network']:
+            requested = ipaddress.IPv4Network(module.params['network'])
+        if module.params['container']:
+            requestedContainer = ipaddress.IPv4Network(module.params['container'])
+    except ValueError as e:
+        module.fail_json(msg="Invalid network: {}".format(e), **result)
+
+    # The requested networks by (ip, mask), with the common options merged in
+    bulk = {}
+    for entry in module.params['networks'] or []:
+        try:
+            subnet = ipaddress.IPv4Network(entry['network'])
+        except ValueError as e:
+            module.fail_json(msg="Invalid network: {}".format(e), **result)
+        key = (int(subnet.network_address), subnet.prefixlen)
+        if key in bulk:
+            module.fail_json(msg="Network {} is listed more than once".format(subnet), **result)
+        if module.params['state'] == 'present' and not entry['name']:
+            module.fail_json(msg="A name is required for network {}".format(subnet), **result)
+        vlan = entry['vlan'] if entry['vlan'] is not None else module.params['vlan']
+        vlanDomain = entry['vlan_domain'] or module.params['vlan_domain']
+        if vlan is not None and not vlanDomain:
+            module.fail_json(msg="A vlan_domain is required for the VLAN of network {}".format(subnet), **result)
+        bulk[key] = dict(entry, network=str(subnet), tags=sorted(set((module.params['tags'] or []) + (entry['tags'] or []))), vlan=vlan, vlan_domain=vlanDomain)
+
+    db = RacktablesDB(module.params, module)
+
+    rt_network_sql = "SELECT id, ip, mask, name, comment FROM IPv4Network WHERE "
+    def getNetwork(connection, lock=False):
+        with connection.cursor() as cursor:
+            cursor.execute(rt_network_sql + "ip=%s AND mask=%s" + (" FOR UPDATE" if lock else ""),(int(requested.network_address),requested.prefixlen))
+            return cursor.fetchone()
+
+    def getContainers(connection):
+        if module.params['container']:
+            return [(int(requestedContainer.network_address), requestedContainer.prefixlen, '')]
+        return [network[1:] for network in getTaggedNetworks(connection, sorted(set(module.params['container_tags'])))]
+
+    def getNamedNetwork(connection, containers, lock=False):
+        # A network carved by an earlier run, found by name in one of the containers
+        with connection.cursor() as cursor:
+            cursor.execute(rt_network_sql + "name=%s AND mask=%s ORDER BY ip" + (" FOR UPDATE" if lock else ""),(module.params['name'],module.params['mask']))
+            for rt_network in cursor.fetchall():
+                for container in containers:
+                    if container[0] <= rt_network[1] <= networkEnd(container[0], container[1]):
+                        return rt_network, container
+        return None, None
+
+    def getNetworkTags(connection, networkId):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT TT.tag FROM TagStorage TS, TagTree TT WHERE TS.entity_realm='ipv4net' AND TS.entity_id=%s AND TT.id=TS.tag_id ORDER BY TT.tag",networkId)
+            return [row[0] for row in cursor.fetchall()]
+
+    def getNetworkVlan(connection, networkId):
+        with connection.cursor() as cursor:
+            # The binding in vlan_domain comes first, bindings in other domains are left alone
+            cursor.execute("SELECT VD.description, V.vlan_id FROM VLANIPv4 V, VLANDomain VD WHERE VD.id=V.domain_id AND V.ipv4net_id=%s ORDER BY VD.description=%s DESC, VD.description, V.vlan_id",(networkId,module.params['vlan_domain']))
+            return cursor.fetchone()
+
+    def getTagIds(connection, tags):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tag, id FROM TagTree WHERE tag IN ({})".format(','.join(['%s'] * len(tags))),tags)
+            tagIds = dict(cursor.fetchall())
+        missing = [tag for tag in tags if tag not in tagIds]
+        if missing:
+            module.fail_json(msg="The following tags do not exist, please check your spelling: {}".format(', '.join(missing)), **result)
+        return tagIds
+
+    def getVlanDomainId(connection):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT VD.id FROM VLANDomain VD, VLANDescription VDESC WHERE VDESC.domain_id=VD.id AND VD.description=%s AND VDESC.vlan_id=%s",(module.params['vlan_domain'],module.params['vlan']))
+            domain = cursor.fetchone()
+        if not domain:
+            module.fail_json(msg="VLAN {} does not exist in the {} domain".format(module.params['vlan'], module.params['vlan_domain']), **result)
+        return domain[0]
+
+    def plan(connection, lock=False):
+        """Work out the network to manage and what needs to change on it."""
+        container = None
+        if carving:
+            containers = getContainers(connection)
+            if not containers:
+                module.fail_json(msg="No networks were returned, please check your provided container_tags", **result)
+            rt_network, container = getNamedNetwork(connection, containers, lock)
+            if not rt_network:
+                carved = carveSubnet(connection, containers, module.params['mask'], lock)
+                if not carved:
+                    module.fail_json(msg="There is no free /{} left in {}".format(module.params['mask'], ', '.join(formatNetwork(c[0], c[1]) for c in containers)), **result)
+                ip, container = carved
+                target = (ip, module.params['mask'])
+            else:
+                target = (rt_network[1], rt_network[2])
+        else:
+            rt_network = getNetwork(connection, lock)
+            target = (int(requested.network_address), requested.prefixlen)
+
+        changes = {}
+        if module.params['state'] == "absent":
+            if rt_network:
+                changes['delete'] = True
+            return rt_network, target, container, changes
+
+        currentTags = getNetworkTags(connection, rt_network[0]) if rt_network else []
+        currentVlan = getNetworkVlan(connection, rt_network[0]) if rt_network else None
+        if not rt_network:
+            changes['insert'] = True
+        if rt_network and rt_network[3] != module.params['name']:
+            changes['name'] = True
+        if module.params['comment'] is not None and (not rt_network or (rt_network[4] or '') != module.params['comment']):
+            changes['comment'] = True
+        newTags = [tag for tag in sorted(set(module.params['tags'] or [])) if tag not in currentTags]
+        if newTags:
+            changes['tags'] = getTagIds(connection, newTags)
+        if module.params['vlan'] is not None and (not currentVlan or currentVlan != (module.params['vlan_domain'], module.params['vlan'])):
+            changes['vlan'] = getVlanDomainId(connection)
+        result['tags'] = sorted(set(currentTags + newTags))
+        result['vlan'] = module.params['vlan'] if module.params['vlan'] is not None else (currentVlan[1] if currentVlan else '')
+        return rt_network, target, container, changes
+
+    def getNetworksOf(connection, keys, overlapping=False, lock=False):
+        """The existing networks among keys, and with overlapping set the ones they are nested in or that are nested in them."""
+        # Networks can't partly overlap, so the larger ones are looked up by each shorter prefix and the smaller ones by range
+        exact = set(keys)
+        if overlapping:
+            exact.update((ip & ~(2 ** (32 - shorter) - 1), shorter) for ip, mask in keys for shorter in range(mask))
+        networks = {}
+        with connection.cursor() as cursor:
+            for batch in batches(sorted(exact)):
+                cursor.execute(rt_network_sql + " OR ".join(["(ip=%s AND mask=%s)"] * len(batch)) + (" FOR UPDATE" if lock else ""),[value for key in batch for value in key])
+                networks.update(((row[1], row[2]), row) for row in cursor.fetchall())
+            if overlapping:
+                for batch in batches(sorted(keys)):
+                    cursor.execute(rt_network_sql + " OR ".join(["ip BETWEEN %s AND %s"] * len(batch)) + (" FOR UPDATE" if lock else ""),[value for ip, mask in batch for value in (ip, networkEnd(ip, mask))])
+                    networks.update(((row[1], row[2]), row) for row in cursor.fetchall())
+        return networks
+
+    def getTagsOf(connection, networkIds):
+        tags = {}
+        with connection.cursor() as cursor:
+            for batch in batches(networkIds):
+                cursor.execute("SELECT TS.entity_id, TT.tag FROM TagStorage TS, TagTree TT WHERE TS.entity_realm='ipv4net' AND TT.id=TS.tag_id AND TS.entity_id IN ({})".format(inPlaceholders(batch)),batch)
+                for networkId, tag in cursor.fetchall():
+                    tags.setdefault(networkId, set()).add(tag)
+        return tags
+
+    def getVlansOf(connection, networkIds):
+        """The VLAN each network is bound to in every domain it has a binding in, by network id and then domain."""
+        vlans = {}
+        with connection.cursor() as cursor:
+            for batch in batches(networkIds):
+                cursor.execute("SELECT V.ipv4net_id, VD.description, V.vlan_id FROM VLANIPv4 V, VLANDomain VD WHERE VD.id=V.domain_id AND V.ipv4net_id IN ({}) ORDER BY V.ipv4net_id, VD.description, V.vlan_id".format(inPlaceholders(batch)),batch)
+                for networkId, domain, vlan in cursor.fetchall():
+                    vlans.setdefault(networkId, {}).setdefault(domain, vlan)
+        return vlans
+
+    def getVlanDomainIds(connection, vlans):
+        domainIds = {}
+        domains = sorted(set(domain for domain, vlan in vlans))
+        with connection.cursor() as cursor:
+            for batch in batches(domains):
+                cursor.execute("SELECT VD.description, VDESC.vlan_id, VD.id FROM VLANDomain VD, VLANDescription VDESC WHERE VDESC.domain_id=VD.id AND VD.description IN ({})".format(inPlaceholders(batch)),batch)
+                domainIds.update(((row[0], row[1]), row[2]) for row in cursor.fetchall())
+        missing = ["{} in {}".format(vlan, domain) for domain, vlan in sorted(vlans) if (domain, vlan) not in domainIds]
+        if missing:
+            module.fail_json(msg="The following VLANs do not exist: {}".format(', '.join(missing)), **result)
+        return domainIds
+
+    def planBulk(connection, lock=False):
+        """Work out what needs to change on every network in networks."""
+        checkOverlaps = module.params['state'] == 'present' and not module.params['allow_nested']
+        # Only the rows the checks and writes need are read, and locked
+        existing = getNetworksOf(connection, list(bulk), checkOverlaps, lock)
+        if checkOverlaps:
+            # Every network is checked against an in-memory index, rather than with a query each
+            index = buildNetworkIndex(list(existing) + list(bulk))
+            overlaps = []
+            for key in sorted(bulk):
+                nested = findOverlaps(index, *key) if key not in existing else []
+                if nested:
+                    overlaps.append("{} with {}".format(formatNetwork(*key), ', '.join(formatNetwork(*network) for network in nested)))
+            if overlaps:
+                module.fail_json(msg="The following networks would overlap, set allow_nested to create them anyway: {}{}".format('; '.join(overlaps[:MAX_REPORTED]), " and {} more".format(len(overlaps) - MAX_REPORTED) if len(overlaps) > MAX_REPORTED else ''), **result)
+
+        networkIds = sorted(existing[key][0] for key in bulk if key in existing)
+        currentTags = getTagsOf(connection, networkIds)
+        currentVlans = getVlansOf(connection, networkIds)
+
+        writes = dict(delete=[], insert=[], update=[], tags=[], vlans=[])
+        changes = []
+        for key in sorted(bulk):
+            entry = bulk[key]
+            rt_network = existing.get(key)
+            before = None
+            if rt_network:
+                # The binding in the entry's domain is the one compared, bindings in other domains are left alone
+                bound = currentVlans.get(rt_network[0], {})
+                domain = entry['vlan_domain'] if entry['vlan_domain'] in bound else (sorted(bound)[0] if bound else None)
+                vlan = (domain, bound.get(domain))
+                before = dict(name=rt_network[3], comment=rt_network[4] or '', tags=sorted(currentTags.get(rt_network[0], [])), vlan_domain=vlan[0], vlan=vlan[1])
+            if module.params['state'] == 'absent':
+                if rt_network:
+                    writes['delete'].append(rt_network[0])
+                    changes.append(dict(network=entry['network'], before=before, after=None))
+                continue
+            after = dict(
+                name=entry['name'],
+                comment=entry['comment'] if entry['comment'] is not None else (before['comment'] if before else ''),
+                tags=sorted(set(entry['tags']) | set(before['tags'] if before else [])),
+                vlan_domain=entry['vlan_domain'] if entry['vlan'] is not None else (before['vlan_domain'] if before else None),
+                vlan=entry['vlan'] if entry['vlan'] is not None else (before['vlan'] if before else None),
+            )
+            if before == after:
+                continue
+            changes.append(dict(network=entry['network'], before=before, after=after))
+            if not rt_network:
+                writes['insert'].append(key + (after['name'], after['comment']))
+            elif (before['name'], before['comment']) != (after['name'], after['comment']):
+                writes['update'].append((after['name'], after['comment'], rt_network[0]))
+            writes['tags'].extend((key, tag) for tag in after['tags'] if not before or tag not in before['tags'])
+            if after['vlan'] is not None and (not before or (before['vlan_domain'], before['vlan']) != (after['vlan_domain'], after['vlan'])):
+                writes['vlans'].append((key, after['vlan_domain'], after['vlan']))
+
+        tagIds = getTagIds(connection, sorted(set(tag for key, tag in writes['tags']))) if writes['tags'] else {}
+        domainIds = getVlanDomainIds(connection, set((domain, vlan) for key, domain, vlan in writes['vlans'])) if writes['vlans'] else {}
+        return existing, writes, changes, tagIds, domainIds
+
+    if module.params['networks'] is not None:
+        existing, writes, changes, tagIds, domainIds = planBulk(db.read)
+        if changes and not module.check_mode:
+            # Work out the changes again holding locks on the primary, so concurrent runs can't create overlapping networks
+            existing, writes, changes, tagIds, domainIds = planBulk(db.primary, lock=True)
+        result['changes'] = changes
+        result['changed'] = bool(changes)
+
+        if module.check_mode or not changes:
+            module.exit_json(**result)
+
+        connection = db.primary
+        try:
+            with connection.cursor() as cursor:
+                for batch in batches(writes['delete']):
+                    cursor.execute("DELETE FROM TagStorage WHERE entity_realm='ipv4net' AND entity_id IN ({})".format(inPlaceholders(batch)),batch)
+                    cursor.execute("DELETE FROM VLANIPv4 WHERE ipv4net_id IN ({})".format(inPlaceholders(batch)),batch)
+                    cursor.execute("DELETE FROM IPv4Network WHERE id IN ({})".format(inPlaceholders(batch)),batch)
+                networkIds = dict((key, rt_network[0]) for key, rt_network in existing.items())
+                for batch in batches(writes['insert']):
+                    cursor.executemany("INSERT INTO IPv4Network (ip, mask, name, comment) VALUES (%s, %s, %s, %s)",batch)
+                    # The ids of a multi-row insert aren't necessarily consecutive, so they are read back
+                    cursor.execute("SELECT ip, mask, id FROM IPv4Network WHERE " + " OR ".join(["(ip=%s AND mask=%s)"] * len(batch)),[value for network in batch for value in network[:2]])
+                    networkIds.update(((row[0], row[1]), row[2]) for row in cursor.fetchall())
+                for batch in batches(writes['update']):
+                    cursor.executemany("UPDATE IPv4Network SET name=%s, comment=%s WHERE id=%s",batch)
+                for batch in batches(writes['tags']):
+                    cursor.executemany("INSERT INTO TagStorage (entity_realm, entity_id, tag_id, user, date) VALUES ('ipv4net', %s, %s, %s, NOW())",[(networkIds[key], tagIds[tag], module.params['rt_username']) for key, tag in batch])
+                for batch in batches(writes['vlans']):
+                    # Only the binding in the same domain is replaced
+                    cursor.execute("DELETE FROM VLANIPv4 WHERE " + " OR ".join(["(domain_id=%s AND ipv4net_id=%s)"] * len(batch)),[value for key, domain, vlan in batch for value in (domainIds[(domain, vlan)], networkIds[key])])
+                    cursor.executemany("INSERT INTO VLANIPv4 (domain_id, vlan_id, ipv4net_id) VALUES (%s, %s, %s)",[(domainIds[(domain, vlan)], vlan, networkIds[key]) for key, domain, vlan in batch])
+            connection.commit()
+        except DBError as e:
+            connection.rollback()
+            module.fail_json(msg="Failed to update the networks, no changes were made: {}".format(e), **result)
+
+        module.exit_json(**result)
+
+    rt_network, target, container, changes = plan(db.read)
+    if changes and not module.check_mode:
+        # Work out the changes again holding locks on the primary, so concurrent runs can't carve the same subnet
+        rt_network, target, container, changes = plan(db.primary, lock=True)
+
+    subnet = ipaddress.IPv4Network(formatNetwork(target[0], target[1]))
+    result['network'] = str(subnet)
+    result['netmask'] = str(subnet.netmask)
+    result['name'] = module.params['name'] or (rt_network[3] if rt_network else '')
+    if container:
+        result['container'] = formatNetwork(container[0], container[1])
+    result['changed'] = bool(changes)
+
+    if module.check_mode or not changes:
+        module.exit_json(**result)
+
+    connection = db.primary
+    try:
+        with connection.cursor() as cursor:
+            if changes.get('delete'):
+                cursor.execute("DELETE FROM TagStorage WHERE entity_realm='ipv4net' AND entity_id=%s",rt_network[0])
+                cursor.execute("DELETE FROM VLANIPv4 WHERE ipv4net_id=%s",rt_network[0])
+                cursor.execute("DELETE FROM IPv4Network WHERE id=%s",rt_network[0])
+            else:
+                if changes.get('insert'):
+                    cursor.execute("INSERT INTO IPv4Network (ip, mask, name, comment) VALUES (%s, %s, %s, %s)",(target[0],target[1],module.params['name'],module.params['comment'] or ''))
+                    networkId = cursor.lastrowid
+                else:
+                    networkId = rt_network[0]
+                    if changes.get('name') or changes.get('comment'):
+                        comment = module.params['comment'] if module.params['comment'] is not None else rt_network[4]
+                        cursor.execute("UPDATE IPv4Network SET name=%s, comment=%s WHERE id=%s",(module.params['name'],comment,networkId))
+                if changes.get('tags'):
+                    cursor.executemany("INSERT INTO TagStorage (entity_realm, entity_id, tag_id, user, date) VALUES ('ipv4net', %s, %s, %s, NOW())",[(networkId, tagId, module.params['rt_username']) for tagId in sorted(changes['tags'].values())])
+                if changes.get('vlan'):
+                    cursor.execute("DELETE FROM VLANIPv4 WHERE domain_id=%s AND ipv4net_id=%s",(changes['vlan'],networkId))
+                    cursor.execute("INSERT INTO VLANIPv4 (domain_id, vlan_id, ipv4net_id) VALUES (%s, %s, %s)",(changes['vlan'],module.params['vlan'],networkId))
+        connection.commit()
+    except DBError as e:
+        connection.rollback()
+        module.fail_json(msg="Failed to update the network, no changes were made: {}".format(e), **result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,7 @@ version_added: "2.4"
 
 description:
     - "Create, update, and delete objects in Racktables"
+    - "Deleting an object only removes the object itself, use racktables_object_decommission to also remove its ports, addresses, links, tags and attributes"
 
 options:
     name:
@@ -47,29 +48,11 @@ options:
             - Specify whether the object should be present or absent
         required: false
         default: present
-    rt_host:
-        description:
-            - Hostname of the database server backing Racktables
-        required: true
-    rt_port:
-        description:
-            - Port for the database connection, defaults to 3306
-        required: false
-    rt_username:
-        description:
-            - Username that has administrative access to the racktables database
-        required: true
-    rt_password:
-        description:
-            - Password for the administrative user
-        required: true
-    rt_database:
-        description:
-            - Name of the database which backs Racktables
-        required: true
 
 author:
     - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
 '''
 
 EXAMPLES = '''
@@ -93,21 +76,12 @@ message:
     type: str
     returned: always
 '''
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
-
-from ansible.errors import AnsibleError
-from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
 
+@profiled_module('racktables_object')
 def run_module():
-    if HAVE_PYMYSQL is False:
-        raise AnsibleError("Can't run module racktables_object: module PyMySQL is not installed")
     module_args = dict(
         name=dict(type='str', required=True),
         label=dict(type='str', required=False, default=""),
@@ -115,12 +89,8 @@ def run_module():
         assetnumber=dict(type='str', required=False),
         comment=dict(type='str', required=False, default=""),
         state=dict(type='str', default='present', choices=['present', 'absent']),
-        rt_host=dict(type='str',required=True),
-        rt_port=dict(type='int',required=False,default=3306),
-        rt_username=dict(type='str',required=True),
-        rt_password=dict(type='str',required=True,no_log=True),
-        rt_database=dict(type='str',required=True)
     )
+    module_args.update(racktables_argument_spec())
 
     result = dict(
         changed=False,
@@ -141,59 +111,77 @@ def run_module():
         supports_check_mode=True
     )
 
-    try:
-        connection = pymysql.connect(host=module.params['rt_host'],port=module.params['rt_port'],user=module.params['rt_username'],password=module.params['rt_password'],db=module.params['rt_database'])
-    except:
-        raise AnsibleError("An error occured while connecting to your Racktables database, please check your connection info and try again")
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
 
-    rt_object_sql="SELECT RTO.name,RTO.label,RTO.asset_no,RTO.comment,RTD.dict_value FROM Object RTO, Dictionary RTD WHERE RTD.dict_key=RTO.objtype_id AND RTO.name=%s"
-    rt_object={}
-    with connection.cursor() as cursor:
-        cursor.execute(rt_object_sql,module.params['name'])
-        rt_object = cursor.fetchone()
-        if rt_object:
-            result['original_name']=rt_object[0]
-            result['original_label']=rt_object[1]
-            result['original_assetnumber']=rt_object[2]
-            result['original_comment']=rt_object[3]
-            result['original_type']=rt_object[4]
+    db = RacktablesDB(module.params, module)
 
-    if module.check_mode:
-        module.exit_json(**result)
+    # Resolves the object, the id of the requested type and any other object holding the asset number in one round trip
+    rt_object_sql="SELECT RTO.name,RTO.label,RTO.asset_no,RTO.comment,RTD.dict_value,RTO.id,RTT.dict_key,RTA.name FROM (SELECT %s AS name) RTQ LEFT JOIN `Object` RTO ON RTO.name=RTQ.name LEFT JOIN Dictionary RTD ON RTD.dict_key=RTO.objtype_id LEFT JOIN Dictionary RTT ON RTT.chapter_id=1 AND RTT.dict_value=%s LEFT JOIN `Object` RTA ON RTA.asset_no=%s AND RTA.name<>RTQ.name"
+    def getObject(connection, lock=False):
+        with connection.cursor() as cursor:
+            cursor.execute(rt_object_sql + (" FOR UPDATE" if lock else ""),(module.params['name'],module.params['type'],module.params['assetnumber']))
+            row = cursor.fetchone()
+        return (row if row[5] is not None else None), row[6], row[7]
+
+    def propsMatch(rt_object):
+        return module.params['label'] == rt_object[1] and module.params['assetnumber'] == rt_object[2] and module.params['comment'] == rt_object[3] and module.params['type'] == rt_object[4]
+
+    rt_object, objtype_id, asset_holder = getObject(db.read)
+    if rt_object:
+        result['original_name']=rt_object[0]
+        result['original_label']=rt_object[1]
+        result['original_assetnumber']=rt_object[2]
+        result['original_comment']=rt_object[3]
+        result['original_type']=rt_object[4]
 
     props_match = False
     if rt_object:
-        if module.params['label'] == rt_object[1] and module.params['assetnumber'] == rt_object[2] and module.params['comment'] == rt_object[3] and module.params['type'] == rt_object[4]:
-            props_match = True
-    
-    if not props_match and not module.check_mode and module.params['state'] == "present":
+        props_match = propsMatch(rt_object)
+
+    needs_change = (module.params['state'] == "present" and not props_match) or (module.params['state'] == "absent" and rt_object)
+    if module.check_mode:
+        result['changed'] = bool(needs_change)
+        module.exit_json(**result)
+    if needs_change and db.is_replica:
+        # The replica may be behind, so confirm the current state on the primary before writing
+        rt_object, objtype_id, asset_holder = getObject(db.primary, lock=True)
+        props_match = bool(rt_object) and propsMatch(rt_object)
+
+    connection = db.primary if needs_change else db.read
+
+    if not props_match and module.params['state'] == "present":
+        if objtype_id is None:
+            module.fail_json(msg="Object type doesn't exist or isn't spelled properly", **result)
+        if asset_holder is not None:
+            module.fail_json(msg="Asset number {} is already used by {}".format(module.params['assetnumber'], asset_holder), **result)
         with connection.cursor() as cursor:
-            cursor.execute("SELECT dict_key FROM Dictionary WHERE dict_value=%s",module.params['type'])
-            try:
-                objtype_id = cursor.fetchone()[0]
-            except:
-                module.fail_json(msg="Object type doesn't exist or isn't spelled properly", **result)
-            if rt_object:
-                cursor.execute("UPDATE Object SET name=%s, label=%s, objtype_id=%s, asset_no=%s, has_problems='no', comment=%s WHERE name=%s;",(module.params['name'],module.params['label'],objtype_id,module.params['assetnumber'],module.params['comment'],module.params['name']))
-            if not rt_object:
-                cursor.execute("INSERT INTO `Object` (name, label, objtype_id, asset_no, has_problems, comment) VALUES(%s, %s, %s, %s, 'no', %s);",(module.params['name'],module.params['label'],objtype_id,module.params['assetnumber'],module.params['comment']))
+            # Object.name is unique, so this inserts or updates in one statement. The IF()s leave the row alone when
+            # the duplicate is another object's asset number, and the affected rows are 1 for an insert, 2 for an
+            # update and 0 when a concurrent run already made the same change
+            cursor.execute("INSERT INTO `Object` (name, label, objtype_id, asset_no, has_problems, comment) VALUES(%s, %s, %s, %s, 'no', %s) ON DUPLICATE KEY UPDATE label=IF(name=VALUES(name),VALUES(label),label), objtype_id=IF(name=VALUES(name),VALUES(objtype_id),objtype_id), asset_no=IF(name=VALUES(name),VALUES(asset_no),asset_no), has_problems=IF(name=VALUES(name),'no',has_problems), comment=IF(name=VALUES(name),VALUES(comment),comment);",(module.params['name'],module.params['label'],objtype_id,module.params['assetnumber'],module.params['comment']))
+            result['changed'] = cursor.rowcount > 0
+        if not result['changed']:
+            # Nothing was written either because a concurrent run made the same change, or because another object took
+            # the asset number after it was checked, which the IF()s silently skip
+            rt_object, objtype_id, asset_holder = getObject(connection, lock=True)
+            if not rt_object or not propsMatch(rt_object):
+                connection.rollback()
+                module.fail_json(msg="Asset number {} is already used by {}".format(module.params['assetnumber'], asset_holder), **result)
         connection.commit()
-        result['changed'] = True
         result['name'] = module.params['name']
         result['label'] = module.params['label']
         result['assetnumber'] = module.params['assetnumber']
         result['comment'] = module.params['comment']
         result['type'] = module.params['type']
-    elif not module.check_mode and module.params['state'] == "absent":
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT id FROM `Object` WHERE name=%s",module.params['name'])
-            objectId = cursor.fetchone()
-            if objectId:
-                cursor.execute("DELETE FROM `Object` WHERE name=%s",module.params['name'])
-                connection.commit()
-                result['changed'] = True
-            else:
-                result['changed'] = False
+    elif module.params['state'] == "absent":
+        if rt_object:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM `Object` WHERE id=%s",rt_object[5])
+                result['changed'] = cursor.rowcount > 0
+            connection.commit()
+        else:
+            result['changed'] = False
 
     module.exit_json(**result)
 
@@ -201,4 +189,4 @@ def main():
     run_module()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
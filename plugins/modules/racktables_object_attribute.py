@@ -0,0 +1,326 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_object_attribute
+
+short_description: Manages attribute values of objects in Racktables
+
+version_added: "2.4"
+
+description:
+    - "Set or remove the attribute values (such as CPU, RAM, serial number or OS) of one or many objects in Racktables"
+    - "Only the values that differ from what Racktables already has are written, in a single transaction"
+    - "Attributes must be enabled for the object's type in Racktables (the attribute map), otherwise the module fails without changing anything"
+
+options:
+    object:
+        description:
+            - The name of the object to set I(attributes) on
+            - Either I(object) or I(objects) is required
+        required: false
+        type: str
+    objects:
+        description:
+            - A dictionary of object names, each mapped to a dictionary of attribute names and values
+            - Values in I(attributes) apply to every one of these objects, unless the object sets the same attribute itself
+        required: false
+        type: dict
+    attributes:
+        description:
+            - A dictionary of attribute names and values
+            - Values of C(dict) attributes are given as the text of the dictionary entry, C(date) attributes take C(YYYY-MM-DD) or a unix timestamp
+            - A null value removes the attribute from the object
+        required: false
+        type: dict
+    state:
+        description:
+            - Specify whether the attribute values should be present or absent
+            - When C(absent), the given attributes are removed from the objects and their values are ignored
+        required: false
+        default: present
+        choices: [ present, absent ]
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+'''
+
+EXAMPLES = '''
+# Record the hardware facts of the current host
+- name: Set hardware attributes
+  racktables_object_attribute:
+    object: "{{ inventory_hostname }}"
+    attributes:
+      "HW type": "Dell PowerEdge R640"
+      "OEM S/N 1": "{{ ansible_product_serial }}"
+      "SW type": "{{ ansible_distribution }} {{ ansible_distribution_version }}"
+      "DRAM, GB": "{{ (ansible_memtotal_mb / 1024) | round | int }}"
+
+# Sync the whole fleet from the controller in one task
+- name: Set hardware attributes on every host
+  racktables_object_attribute:
+    objects: "{{ dict(ansible_play_hosts | zip(ansible_play_hosts | map('extract', hostvars, 'rt_attributes'))) }}"
+    attributes:
+      "Contact person": "infra@example.com"
+  run_once: true
+  delegate_to: localhost
+
+# Clear an attribute
+- name: Remove the contact
+  racktables_object_attribute:
+    object: "test.lab1"
+    attributes:
+      "Contact person":
+    state: absent
+'''
+
+RETURN = '''
+changes:
+    description: One entry per attribute value that was (or in check mode would be) changed, with the C(object), C(attribute), C(before) and C(after) values
+    type: list
+    returned: always
+missing:
+    description: Requested object names that don't exist in Racktables
+    type: list
+    returned: always
+'''
+import calendar
+import struct
+import time
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils._text import to_text
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+# Maximum number of values bound into a single IN (...) clause, and of rows written per statement
+BATCH_SIZE = 1000
+
+# The AttributeValue column holding each type of attribute
+VALUE_COLUMNS = {
+    'string': 0,
+    'uint': 1,
+    'dict': 1,
+    'date': 1,
+    'float': 2,
+}
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+def floatDigits(value):
+    # float_value is a single precision FLOAT, which MySQL returns rounded to 6 significant digits
+    return '{:.6g}'.format(struct.unpack('f', struct.pack('f', value))[0])
+
+@profiled_module('racktables_object_attribute')
+def run_module():
+    module_args = dict(
+        object=dict(type='str', required=False),
+        objects=dict(type='dict', required=False),
+        attributes=dict(type='dict', required=False),
+        state=dict(type='str', default='present', choices=['present', 'absent']),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        changes=[],
+        missing=[],
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        mutually_exclusive=[('object', 'objects')],
+        required_one_of=[('object', 'objects')],
+        required_by={'object': 'attributes'},
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    # The requested values per object, objects' own values win over the common attributes
+    requested = {}
+    if module.params['object']:
+        requested[module.params['object']] = dict(module.params['attributes'])
+    else:
+        for name, attributes in module.params['objects'].items():
+            if attributes is not None and not isinstance(attributes, dict):
+                module.fail_json(msg="The attributes of {} must be a dictionary".format(name), **result)
+            requested[name] = dict(module.params['attributes'] or {})
+            requested[name].update(attributes or {})
+
+    db = RacktablesDB(module.params, module)
+
+    def getAttributes(connection):
+        # The whole Attribute table and attribute map are small, so they are read once and resolved in memory
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name, id, type FROM Attribute")
+            attributes = dict((row[0], row[1:]) for row in cursor.fetchall())
+            cursor.execute("SELECT objtype_id, attr_id, chapter_id FROM AttributeMap")
+            attributeMap = dict(((row[0], row[1]), row[2]) for row in cursor.fetchall())
+        return attributes, attributeMap
+
+    def getObjects(connection, names):
+        rtObjects = {}
+        with connection.cursor() as cursor:
+            for batch in batches(names):
+                cursor.execute("SELECT name, id, objtype_id FROM `Object` WHERE name IN ({})".format(inPlaceholders(batch)),batch)
+                rtObjects.update((row[0], row[1:]) for row in cursor.fetchall())
+        return rtObjects
+
+    def getValues(connection, objectIds, lock=False):
+        values = {}
+        with connection.cursor() as cursor:
+            for batch in batches(objectIds):
+                cursor.execute("SELECT object_id, attr_id, string_value, uint_value, float_value FROM AttributeValue WHERE object_id IN ({})".format(inPlaceholders(batch)) + (" FOR UPDATE" if lock else ""),batch)
+                values.update(((row[0], row[1]), row[2:]) for row in cursor.fetchall())
+        return values
+
+    def getDictionary(connection, chapterIds):
+        dictionary = {}
+        with connection.cursor() as cursor:
+            for batch in batches(chapterIds):
+                cursor.execute("SELECT chapter_id, dict_value, dict_key FROM Dictionary WHERE chapter_id IN ({})".format(inPlaceholders(batch)),batch)
+                for chapterId, value, key in cursor.fetchall():
+                    dictionary[(chapterId, value)] = key
+                    dictionary[(chapterId, key)] = value
+        return dictionary
+
+    def convertValue(name, attrType, value, chapterId, dictionary):
+        """Turn a requested value into the (string_value, uint_value, float_value) Racktables stores."""
+        stored = [None, None, None]
+        try:
+            if attrType == 'string':
+                stored[0] = to_text(value)
+            elif attrType == 'uint':
+                stored[1] = int(value)
+                if stored[1] < 0:
+                    raise ValueError("must not be negative")
+            elif attrType == 'float':
+                stored[2] = float(value)
+            elif attrType == 'date':
+                if isinstance(value, int) or to_text(value).isdigit():
+                    stored[1] = int(value)
+                else:
+                    stored[1] = calendar.timegm(time.strptime(to_text(value), '%Y-%m-%d'))
+            elif attrType == 'dict':
+                if (chapterId, to_text(value)) not in dictionary:
+                    raise ValueError("is not an entry of its dictionary chapter")
+                stored[1] = dictionary[(chapterId, to_text(value))]
+        except ValueError as e:
+            module.fail_json(msg="Invalid value {!r} for the {} attribute {}: {}".format(value, attrType, name, e), **result)
+        return tuple(stored)
+
+    def sameValue(attrType, before, after):
+        column = VALUE_COLUMNS[attrType]
+        if attrType == 'float' and before[column] is not None and after[column] is not None:
+            return floatDigits(before[column]) == floatDigits(after[column])
+        return before[column] == after[column]
+
+    def displayValue(attrType, stored, chapterId, dictionary):
+        if stored is None:
+            return None
+        if attrType == 'dict':
+            return dictionary.get((chapterId, stored[1]), stored[1])
+        if attrType == 'date' and stored[1] is not None:
+            return time.strftime('%Y-%m-%d', time.gmtime(stored[1]))
+        return stored[VALUE_COLUMNS[attrType]]
+
+    def plan(connection, lock=False):
+        """Work out the attribute values to write and to delete."""
+        attributes, attributeMap = getAttributes(connection)
+        unknown = sorted(set(name for values in requested.values() for name in values if name not in attributes))
+        if unknown:
+            module.fail_json(msg="The following attributes do not exist, please check your spelling: {}".format(', '.join(unknown)), **result)
+
+        rtObjects = getObjects(connection, sorted(requested))
+        result['missing'] = sorted(name for name in requested if name not in rtObjects)
+        if module.params['object'] and result['missing']:
+            module.fail_json(msg="Object {} doesn't exist".format(module.params['object']), **result)
+        current = getValues(connection, sorted(objectId for objectId, objtypeId in rtObjects.values()), lock)
+
+        invalid = []
+        for name in sorted(rtObjects):
+            objtypeId = rtObjects[name][1]
+            invalid.extend("{} on {}".format(attrName, name) for attrName in sorted(requested[name]) if (objtypeId, attributes[attrName][0]) not in attributeMap)
+        if invalid:
+            module.fail_json(msg="The following attributes aren't enabled for the object's type: {}".format(', '.join(invalid)), **result)
+
+        dictionary = {}
+        chapterIds = sorted(set(chapterId for chapterId in attributeMap.values() if chapterId))
+        if chapterIds and any(attributes[attrName][1] == 'dict' for values in requested.values() for attrName in values):
+            dictionary = getDictionary(connection, chapterIds)
+
+        upserts = []
+        deletes = []
+        changes = []
+        for name in sorted(rtObjects):
+            objectId, objtypeId = rtObjects[name]
+            for attrName in sorted(requested[name]):
+                attrId, attrType = attributes[attrName]
+                chapterId = attributeMap[(objtypeId, attrId)]
+                before = current.get((objectId, attrId))
+                if module.params['state'] == 'absent' or requested[name][attrName] is None:
+                    if before is None:
+                        continue
+                    deletes.append((objectId, attrId))
+                    after = None
+                else:
+                    after = convertValue(attrName, attrType, requested[name][attrName], chapterId, dictionary)
+                    if before is not None and sameValue(attrType, before, after):
+                        continue
+                    upserts.append((objectId, objtypeId, attrId) + after)
+                changes.append(dict(
+                    object=name,
+                    attribute=attrName,
+                    before=displayValue(attrType, before, chapterId, dictionary),
+                    after=displayValue(attrType, after, chapterId, dictionary),
+                ))
+        return upserts, deletes, changes
+
+    upserts, deletes, changes = plan(db.read)
+    if changes and not module.check_mode:
+        # Work out the changes again holding locks on the primary, the replica may be behind
+        upserts, deletes, changes = plan(db.primary, lock=True)
+
+    result['changes'] = changes
+    result['changed'] = bool(changes)
+
+    if module.check_mode or not changes:
+        module.exit_json(**result)
+
+    connection = db.primary
+    try:
+        with connection.cursor() as cursor:
+            for batch in batches(upserts):
+                cursor.executemany("INSERT INTO AttributeValue (object_id, object_tid, attr_id, string_value, uint_value, float_value) VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE string_value=VALUES(string_value), uint_value=VALUES(uint_value), float_value=VALUES(float_value)",batch)
+            for batch in batches(deletes):
+                cursor.executemany("DELETE FROM AttributeValue WHERE object_id=%s AND attr_id=%s",batch)
+        connection.commit()
+    except DBError as e:
+        connection.rollback()
+        module.fail_json(msg="Failed to update the attribute values, no changes were made: {}".format(e), **result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_object_decommission
+
+short_description: Removes objects and everything that references them from Racktables
+
+version_added: "2.4"
+
+description:
+    - "Delete objects from Racktables along with their ports, cable links, IPv4 allocations, parent/child links, tags, attributes and rack space"
+    - "All objects are removed in a single transaction, either everything is deleted or nothing is"
+
+options:
+    names:
+        description:
+            - A list of object names to decommission
+            - Mutually exclusive with I(tags)
+        required: false
+        type: list
+    tags:
+        description:
+            - Decommission every object that has all of these tags
+            - Mutually exclusive with I(names)
+        required: false
+        type: list
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+'''
+
+EXAMPLES = '''
+# Remove a list of retired VMs and everything attached to them
+- name: Decommission VMs
+  racktables_object_decommission:
+    names:
+      - "test1.lab1"
+      - "test2.lab1"
+
+# Remove every object tagged as part of a retired cluster
+- name: Decommission a cluster
+  racktables_object_decommission:
+    tags:
+      - "cluster01"
+      - "retired"
+'''
+
+RETURN = '''
+objects:
+    description: The names of the objects that were decommissioned
+    type: list
+    returned: always
+missing:
+    description: Requested object names that don't exist in Racktables
+    type: list
+    returned: always
+counts:
+    description: The number of rows removed from each table
+    type: dict
+    returned: always
+'''
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+# Maximum number of values bound into a single IN (...) clause
+BATCH_SIZE = 1000
+
+# Tables are cleaned up in this order so that nothing is left pointing at a deleted row
+CLEANUP_SQL = [
+    ('Link', "FROM Link WHERE porta IN ({0}) OR portb IN ({0})", 'ports'),
+    ('Port', "FROM Port WHERE id IN ({0})", 'ports'),
+    ('IPv4Allocation', "FROM IPv4Allocation WHERE object_id IN ({0})", 'objects'),
+    ('EntityLink', "FROM EntityLink WHERE (parent_entity_type='object' AND parent_entity_id IN ({0})) OR (child_entity_type='object' AND child_entity_id IN ({0}))", 'objects'),
+    ('TagStorage', "FROM TagStorage WHERE entity_realm='object' AND entity_id IN ({0})", 'objects'),
+    ('AttributeValue', "FROM AttributeValue WHERE object_id IN ({0})", 'objects'),
+    ('RackSpace', "FROM RackSpace WHERE object_id IN ({0})", 'objects'),
+    ('Object', "FROM `Object` WHERE id IN ({0})", 'objects'),
+]
+
+# Rows that can match from two batches, such as a link between ports in different batches, are counted by their key in check mode
+ROW_KEYS = {'Link': 'porta, portb', 'EntityLink': 'id'}
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+@profiled_module('racktables_object_decommission')
+def run_module():
+    module_args = dict(
+        names=dict(type='list', elements='str', required=False),
+        tags=dict(type='list', elements='str', required=False),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        objects=[],
+        missing=[],
+        counts=dict((table, 0) for table, sql, key in CLEANUP_SQL),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        mutually_exclusive=[('names', 'tags')],
+        required_one_of=[('names', 'tags')],
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    db = RacktablesDB(module.params, module)
+    # Only check mode can rely on a replica, the deletes need the ids as the primary sees them
+    connection = db.read if module.check_mode else db.primary
+
+    rtObjects = {}
+    with connection.cursor() as cursor:
+        if module.params['names']:
+            names = sorted(set(module.params['names']))
+            for batch in batches(names):
+                cursor.execute("SELECT id, name FROM `Object` WHERE name IN ({});".format(inPlaceholders(batch)),batch)
+                rtObjects.update(cursor.fetchall())
+            found = set(rtObjects.values())
+            result['missing'] = [name for name in names if name not in found]
+        else:
+            tags = sorted(set(module.params['tags']))
+            cursor.execute("SELECT RTO.id, RTO.name FROM `Object` RTO, TagStorage TS, TagTree TT WHERE TS.entity_realm='object' AND TS.entity_id=RTO.id AND TT.id=TS.tag_id AND TT.tag IN ({}) GROUP BY RTO.id, RTO.name HAVING COUNT(DISTINCT TT.id)=%s;".format(inPlaceholders(tags)),tags + [len(tags)])
+            rtObjects.update(cursor.fetchall())
+
+        objectIds = sorted(rtObjects)
+        portIds = []
+        for batch in batches(objectIds):
+            cursor.execute("SELECT id FROM Port WHERE object_id IN ({});".format(inPlaceholders(batch)),batch)
+            portIds.extend(row[0] for row in cursor.fetchall())
+    ids = dict(objects=objectIds, ports=sorted(portIds))
+    result['objects'] = sorted(rtObjects.values())
+
+    if not objectIds:
+        module.exit_json(**result)
+
+    try:
+        with connection.cursor() as cursor:
+            for table, sql, key in CLEANUP_SQL:
+                matched = set()
+                for batch in batches(ids[key]):
+                    placeholders = inPlaceholders(batch)
+                    params = batch * sql.count('{0}')
+                    if module.check_mode and table in ROW_KEYS:
+                        cursor.execute("SELECT " + ROW_KEYS[table] + " " + sql.format(placeholders),params)
+                        matched.update(cursor.fetchall())
+                        result['counts'][table] = len(matched)
+                    elif module.check_mode:
+                        cursor.execute("SELECT COUNT(*) " + sql.format(placeholders),params)
+                        result['counts'][table] += cursor.fetchone()[0]
+                    else:
+                        cursor.execute("DELETE " + sql.format(placeholders),params)
+                        result['counts'][table] += cursor.rowcount
+        if not module.check_mode:
+            connection.commit()
+    except DBError as e:
+        connection.rollback()
+        module.fail_json(msg="Failed to decommission objects, no changes were made: {}".format(e), **result)
+    result['changed'] = True
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
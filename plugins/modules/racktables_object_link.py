@@ -24,50 +24,77 @@ options:
     parent:
         description:
             - The name of the parent object
-        required: true
+            - Required when I(child) or I(children) is used
+        required: false
     child:
         description:
             - The name of the child object
-        required: true
-    state:
-        description:
-            - Specify whether the object should be present or absent
+            - Mutually exclusive with I(children) and I(links)
         required: false
-        default: present
-    rt_host:
+    children:
         description:
-            - Hostname of the database server backing Racktables
-        required: true
-    rt_port:
-        description:
-            - Port for the database connection, defaults to 3306
+            - A list of child object names to link to I(parent)
+            - Mutually exclusive with I(child) and I(links)
         required: false
-    rt_username:
+        type: list
+    links:
         description:
-            - Username that has administrative access to the racktables database
-        required: true
-    rt_password:
+            - A list of parent/child pairs to link, each a dictionary with C(parent) and C(child) keys
+            - Mutually exclusive with I(parent), I(child) and I(children)
+        required: false
+        type: list
+    exclusive:
         description:
-            - Password for the administrative user
-        required: true
-    rt_database:
+            - When I(state=present), remove any other children linked to the managed parents
+            - The removals are made in the same transaction as the new links
+        required: false
+        default: false
+        type: bool
+    state:
         description:
-            - Name of the database which backs Racktables
-        required: true
+            - Specify whether the object should be present or absent
+        required: false
+        default: present
 
 author:
     - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
 '''
 
 EXAMPLES = '''
 # Link two objects in Racktables
 - name: Link two objects
   racktables_object_link:
-    parent: "test.lab1",
+    parent: "test.lab1"
     child: "test-child.lab1"
+
+# Attach many VMs to a cluster, dropping any VMs that are no longer listed
+- name: Link VMs to their cluster
+  racktables_object_link:
+    parent: "cluster01.lab1"
+    children: "{{ groups['cluster01_vms'] }}"
+    exclusive: true
+
+# Link several parent/child pairs in one run
+- name: Link hypervisors to clusters
+  racktables_object_link:
+    links:
+      - parent: "cluster01.lab1"
+        child: "hv01.lab1"
+      - parent: "cluster02.lab1"
+        child: "hv02.lab1"
 '''
 
 RETURN = '''
+added:
+    description: The parent/child pairs that were linked
+    type: list
+    returned: always
+removed:
+    description: The parent/child pairs that were unlinked
+    type: list
+    returned: always
 original_message:
     description: The original name param that was passed in
     type: str
@@ -77,31 +104,24 @@ message:
     type: str
     returned: always
 '''
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
-
-from ansible.errors import AnsibleError
-from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
 
+@profiled_module('racktables_object_link')
 def run_module():
-    if HAVE_PYMYSQL is False:
-        raise AnsibleError("Can't run module racktables_object: module PyMySQL is not installed")
     module_args = dict(
-        parent=dict(type='str', required=True),
-        child=dict(type='str', required=True),
+        parent=dict(type='str', required=False),
+        child=dict(type='str', required=False),
+        children=dict(type='list', elements='str', required=False),
+        links=dict(type='list', elements='dict', required=False, options=dict(
+            parent=dict(type='str', required=True),
+            child=dict(type='str', required=True)
+        )),
+        exclusive=dict(type='bool', required=False, default=False),
         state=dict(type='str', default='present', choices=['present', 'absent']),
-        rt_host=dict(type='str',required=True),
-        rt_port=dict(type='int',required=False,default=3306),
-        rt_username=dict(type='str',required=True),
-        rt_password=dict(type='str',required=True,no_log=True),
-        rt_database=dict(type='str',required=True)
     )
+    module_args.update(racktables_argument_spec())
 
     result = dict(
         changed=False,
@@ -109,70 +129,124 @@ def run_module():
         original_child='',
         parent='',
         child='',
+        added=[],
+        removed=[],
     )
 
     module = AnsibleModule(
         argument_spec=module_args,
+        mutually_exclusive=[('child', 'children', 'links'), ('parent', 'links')],
+        required_one_of=[('child', 'children', 'links')],
         supports_check_mode=True
     )
 
-    try:
-        connection = pymysql.connect(host=module.params['rt_host'],port=module.params['rt_port'],user=module.params['rt_username'],password=module.params['rt_password'],db=module.params['rt_database'])
-    except:
-        raise AnsibleError("An error occured while connecting to your Racktables database, please check your connection info and try again")
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    if module.params['links']:
+        desiredLinks = [(link['parent'], link['child']) for link in module.params['links']]
+    else:
+        if not module.params['parent']:
+            module.fail_json(msg="parent is required when child or children is specified", **result)
+        children = module.params['children'] or [module.params['child']]
+        desiredLinks = [(module.params['parent'], child) for child in children]
+    # Drop duplicate pairs while keeping the order they were given in
+    desiredLinks = list(dict.fromkeys(desiredLinks))
+
+    db = RacktablesDB(module.params, module)
 
-    def validateParentCompat(parent,child):
+    def inPlaceholders(values):
+        return ','.join(['%s'] * len(values))
+
+    def getObjects(connection, names):
         with connection.cursor() as cursor:
-            cursor.execute("SELECT OPC.parent_objtype_id, OPC.child_objtype_id FROM ObjectParentCompat OPC, `Object` RTOP, `Object` RTOC WHERE OPC.parent_objtype_id=RTOP.objtype_id AND OPC.child_objtype_id=RTOC.objtype_id AND RTOP.name=%s AND RTOC.name=%s;",(parent,child))
-            compat = cursor.fetchone()
-            if compat:
-                return True
-            else:
-                return False
-    
-    def getEntityLink(parent,child):
+            cursor.execute("SELECT id, name, objtype_id FROM `Object` WHERE name IN ({});".format(inPlaceholders(names)),names)
+            return dict((row[1], (row[0], row[2])) for row in cursor.fetchall())
+
+    def getObjectNames(connection, ids):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, name FROM `Object` WHERE id IN ({});".format(inPlaceholders(ids)),ids)
+            return dict(cursor.fetchall())
+
+    def getParentCompat(connection, parentTypes):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT parent_objtype_id, child_objtype_id FROM ObjectParentCompat WHERE parent_objtype_id IN ({});".format(inPlaceholders(parentTypes)),parentTypes)
+            return set(cursor.fetchall())
+
+    def getEntityLinks(connection, parentIds, childIds, lock=False):
         with connection.cursor() as cursor:
-            cursor.execute("SELECT RTE.id, RTE.parent_entity_type, RTE.parent_entity_id, RTOP.name, RTE.child_entity_type, RTE.child_entity_id, RTOC.name FROM EntityLink RTE, `Object` RTOP, `Object` RTOC WHERE RTE.parent_entity_id=RTOP.id AND RTE.child_entity_id=RTOC.id AND RTE.parent_entity_type='object' AND RTE.child_entity_type='object' AND RTOP.name=%s AND RTOC.name=%s;",(parent,child))
-            entityLink= cursor.fetchone()
-            if entityLink:
-                return entityLink
-            else:
-                return None
-
-    existingEntity = getEntityLink(module.params['parent'], module.params['child'])
-    if existingEntity:
-        result['original_parent'] = existingEntity[0]
-        result['original_child'] = existingEntity[1]
-        props_match = True
-
-    if module.check_mode:
+            cursor.execute("SELECT id, parent_entity_id, child_entity_id FROM EntityLink WHERE parent_entity_type='object' AND child_entity_type='object' AND (parent_entity_id IN ({}) OR child_entity_id IN ({})){};".format(inPlaceholders(parentIds),inPlaceholders(childIds)," FOR UPDATE" if lock else ""),parentIds + childIds)
+            return cursor.fetchall()
+
+    def planLinks(connection, lock=False):
+        names = sorted(set(name for link in desiredLinks for name in link))
+        rtObjects = getObjects(connection, names)
+        missing = [name for name in names if name not in rtObjects]
+        if missing and module.params['state'] == "present":
+            module.fail_json(msg="The following objects do not exist, please check your spelling: {}".format(', '.join(missing)), **result)
+        # Links referencing unknown objects can't exist, so there is nothing to remove for them
+        validLinks = [link for link in desiredLinks if link[0] in rtObjects and link[1] in rtObjects]
+        objectNames = dict((rtObject[0], name) for name, rtObject in rtObjects.items())
+
+        if validLinks:
+            parentIds = sorted(set(rtObjects[link[0]][0] for link in validLinks))
+            childIds = sorted(set(rtObjects[link[1]][0] for link in validLinks))
+            existingLinks = dict(((row[1], row[2]), row[0]) for row in getEntityLinks(connection, parentIds, childIds, lock))
+        else:
+            parentIds = []
+            existingLinks = {}
+        desiredIds = [(rtObjects[parent][0], rtObjects[child][0]) for parent, child in validLinks]
+
+        if len(validLinks) == 1 and desiredIds[0] in existingLinks:
+            result['original_parent'] = validLinks[0][0]
+            result['original_child'] = validLinks[0][1]
+
+        toInsert = []
+        toDelete = []
+        if module.params['state'] == "present":
+            compat = getParentCompat(connection, sorted(set(rtObjects[link[0]][1] for link in validLinks)))
+            incompatible = [link for link in validLinks if (rtObjects[link[0]][1], rtObjects[link[1]][1]) not in compat]
+            if incompatible:
+                module.fail_json(msg="The specified parent and child objects are not compatible: {}".format(', '.join('{} -> {}'.format(*link) for link in incompatible)), **result)
+            toInsert = [linkIds for linkIds in desiredIds if linkIds not in existingLinks]
+            if module.params['exclusive']:
+                # Any other child hanging off one of the managed parents is stale
+                desired = set(desiredIds)
+                toDelete = [linkIds for linkIds in existingLinks if linkIds[0] in parentIds and linkIds not in desired]
+        else:
+            toDelete = [linkIds for linkIds in desiredIds if linkIds in existingLinks]
+
+        unknownIds = sorted(set(linkIds[1] for linkIds in toDelete if linkIds[1] not in objectNames))
+        if unknownIds:
+            objectNames.update(getObjectNames(connection, unknownIds))
+        result['added'] = [dict(parent=objectNames[linkIds[0]], child=objectNames[linkIds[1]]) for linkIds in toInsert]
+        result['removed'] = [dict(parent=objectNames[linkIds[0]], child=objectNames[linkIds[1]]) for linkIds in sorted(toDelete)]
+        result['changed'] = bool(toInsert or toDelete)
+        if len(validLinks) == 1 and module.params['state'] == "present":
+            result['parent'] = validLinks[0][0]
+            result['child'] = validLinks[0][1]
+        return toInsert, toDelete, existingLinks
+
+    toInsert, toDelete, existingLinks = planLinks(db.read)
+    if result['changed'] and not module.check_mode and db.is_replica:
+        # The replica may be behind, so work out the changes again on the primary before writing
+        toInsert, toDelete, existingLinks = planLinks(db.primary, lock=True)
+
+    if module.check_mode or not result['changed']:
         module.exit_json(**result)
 
-    props_match = False
-    
-    if not props_match and not module.check_mode and module.params['state'] == "present":
+    connection = db.primary
+    try:
         with connection.cursor() as cursor:
-            if not validateParentCompat(module.params['parent'], module.params['child']):
-                module.fail_json(msg="The specified parent and child objects are not compatible")
-            cursor.execute("SELECT id FROM `Object` WHERE name=%s",module.params['parent'])
-            parentId = cursor.fetchone()[0]
-            cursor.execute("SELECT id FROM `Object` WHERE name=%s",module.params['child'])
-            childId = cursor.fetchone()[0]
-            cursor.execute("INSERT INTO EntityLink (parent_entity_type, parent_entity_id, child_entity_type, child_entity_id) VALUES('object', %s, 'object', %s);",(parentId, childId))
+            if toDelete:
+                deleteIds = [existingLinks[linkIds] for linkIds in toDelete]
+                cursor.execute("DELETE FROM EntityLink WHERE id IN ({});".format(inPlaceholders(deleteIds)),deleteIds)
+            if toInsert:
+                cursor.executemany("INSERT INTO EntityLink (parent_entity_type, parent_entity_id, child_entity_type, child_entity_id) VALUES('object', %s, 'object', %s);",toInsert)
         connection.commit()
-        result['changed'] = True
-        result['parent'] = module.params['parent']
-        result['child'] = module.params['child']
-    elif not module.check_mode and module.params['state'] == "absent":
-        with connection.cursor() as cursor:
-            entityLink = getEntityLink(module.params['parent'], module.params['child'])
-            print(entityLink)
-            if entityLink:
-                cursor.execute('DELETE FROM EntityLink WHERE id=%s',entityLink[0])
-                connection.commit()
-                result['changed'] = True
-            else:
-                result['changed'] = False
+    except DBError as e:
+        connection.rollback()
+        module.fail_json(msg="Failed to update object links, no changes were made: {}".format(e), **result)
 
     module.exit_json(**result)
 
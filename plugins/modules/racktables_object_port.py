@@ -56,29 +56,11 @@ options:
             - Specify wether the port should be present or absent
         required: false
         default: present
-    rt_host:
-        description:
-            - Hostname of the database server backing Racktables
-        required: true
-    rt_port:
-        description:
-            - Port for the database connection, defaults to 3306
-        required: false
-    rt_username:
-        description:
-            - Username that has administrative access to the racktables database
-        required: true
-    rt_password:
-        description:
-            - Password for the administrative user
-        required: true
-    rt_database:
-        description:
-            - Name of the database which backs Racktables
-        required: true
 
 author:
     - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
 '''
 
 EXAMPLES = '''
@@ -104,21 +86,12 @@ message:
     type: str
     returned: always
 '''
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
-
-from ansible.errors import AnsibleError
-from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
 
+@profiled_module('racktables_object_port')
 def run_module():
-    if HAVE_PYMYSQL is False:
-        raise AnsibleError("Can't run module racktables_object: module PyMySQL is not installed")
     module_args = dict(
         object=dict(type='str', required=True),
         name=dict(type='str', required=True),
@@ -128,12 +101,8 @@ def run_module():
         reservation=dict(type='str', required=False),
         label=dict(type='str', required=False, default=""),
         state=dict(type='str', default='present', choices=['present', 'absent']),
-        rt_host=dict(type='str',required=True),
-        rt_port=dict(type='int',required=False,default=3306),
-        rt_username=dict(type='str',required=True),
-        rt_password=dict(type='str',required=True,no_log=True),
-        rt_database=dict(type='str',required=True)
     )
+    module_args.update(racktables_argument_spec())
 
     result = dict(
         changed=False,
@@ -158,80 +127,61 @@ def run_module():
         supports_check_mode=True
     )
 
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
 
-    try:
-        connection = pymysql.connect(host=module.params['rt_host'],port=module.params['rt_port'],user=module.params['rt_username'],password=module.params['rt_password'],db=module.params['rt_database'])
-    except:
-        raise AnsibleError("An error occured while connecting to your Racktables database, please check your connection info and try again")
+    db = RacktablesDB(module.params, module)
 
-    def validatePortCompatibility(iif, oif):
+    # Resolves the object, the port, the ids of the requested interfaces and whether they're compatible in one round trip
+    rt_port_sql="SELECT RTP.name,RTPI.iif_name,RTPO.oif_name,RTP.l2address,RTP.reservation_comment,RTP.label,RTP.id,RTO.id,PII.id,POI.id,PIC.iif_id FROM (SELECT %s AS object, %s AS name, %s AS iif, %s AS oif) RTQ LEFT JOIN `Object` RTO ON RTO.name=RTQ.object LEFT JOIN Port RTP ON RTP.object_id=RTO.id AND RTP.name=RTQ.name LEFT JOIN PortInnerInterface RTPI ON RTPI.id=RTP.iif_id LEFT JOIN PortOuterInterface RTPO ON RTPO.id=RTP.`type` LEFT JOIN PortInnerInterface PII ON PII.iif_name=RTQ.iif LEFT JOIN PortOuterInterface POI ON POI.oif_name=RTQ.oif LEFT JOIN PortInterfaceCompat PIC ON PIC.iif_id=PII.id AND PIC.oif_id=POI.id"
+    def getPort(connection, lock=False):
         with connection.cursor() as cursor:
-            try:
-                cursor.execute("SELECT id FROM PortInnerInterface WHERE iif_name=%s",iif)
-                iif_id = cursor.fetchone()[0]
-            except:
-                iif_id = 0
-            try:
-                cursor.execute("SELECT id FROM PortOuterInterface WHERE oif_name=%s",oif)
-                oif_id = cursor.fetchone()[0]
-            except:
-                oif_id = 0
-            cursor.execute("SELECT iif_id, oif_id FROM PortInterfaceCompat WHERE iif_id=%s AND oif_id=%s",(iif_id, oif_id))
-            compat = cursor.fetchone()
-            if compat:
-                return True
-            else:
-                return False
-    
-    def validateObjectExists(object_name):
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT id FROM `Object` WHERE name=%s",object_name)
-            rtObject = cursor.fetchone()
-            if rtObject:
-                return True
-            else:
-                return False
+            cursor.execute(rt_port_sql + (" FOR UPDATE" if lock else ""),(module.params['object'],module.params['name'],module.params['innerinterface'],module.params['type']))
+            row = cursor.fetchone()
+        return (row if row[6] is not None else None), row[7:]
 
-    rt_port_sql="SELECT RTP.name,RTPI.iif_name,RTPO.oif_name,RTP.l2address,RTP.reservation_comment,RTP.label FROM Object RTO, Port RTP, PortInnerInterface RTPI, PortOuterInterface RTPO WHERE RTPI.id=RTP.iif_id AND RTPO.id=RTP.`type` AND RTP.object_id=RTO.id AND RTO.name=%s AND RTP.name=%s"
-    rt_port={}
-    with connection.cursor() as cursor:
-        cursor.execute(rt_port_sql,(module.params['object'],module.params['name']))
-        rt_port = cursor.fetchone()
-        if rt_port:
-            result['original_object']=module.params['object']
-            result['original_name']=rt_port[0]
-            result['original_innerinterface']=rt_port[1]
-            result['original_type']=rt_port[2]
-            result['original_l2address']=rt_port[3]
-            result['original_reservation']=rt_port[4]
-            result['original_label']=rt_port[4]
+    def propsMatch(rt_port):
+        return module.params['innerinterface'] == rt_port[1] and module.params['type'] == rt_port[2] and module.params['l2address'] == rt_port[3] and module.params['reservation'] == rt_port[4] and module.params['label'] == rt_port[5]
 
-    if module.check_mode:
-        module.exit_json(**result)
+    rt_port, (rtObjectId, iif_id, oif_id, compat) = getPort(db.read)
+    if rt_port:
+        result['original_object']=module.params['object']
+        result['original_name']=rt_port[0]
+        result['original_innerinterface']=rt_port[1]
+        result['original_type']=rt_port[2]
+        result['original_l2address']=rt_port[3]
+        result['original_reservation']=rt_port[4]
+        result['original_label']=rt_port[5]
 
     props_match = False
     if rt_port:
-        if module.params['innerinterface'] == rt_port[1] and module.params['type'] == rt_port[2] and module.params['l2address'] == rt_port[3] and module.params['reservation'] == rt_port[4] and module.params['label'] == rt_port[5]:
-            props_match = True
-    
-    if not props_match and not module.check_mode and module.params['state'] == "present":
+        props_match = propsMatch(rt_port)
+
+    needs_change = (module.params['state'] == "present" and not props_match) or (module.params['state'] == "absent" and rt_port)
+    if module.check_mode:
+        result['changed'] = bool(needs_change)
+        module.exit_json(**result)
+    if needs_change and db.is_replica:
+        # The replica may be behind, so confirm the current state on the primary before writing
+        rt_port, (rtObjectId, iif_id, oif_id, compat) = getPort(db.primary, lock=True)
+        props_match = bool(rt_port) and propsMatch(rt_port)
+
+    connection = db.primary if needs_change else db.read
+
+    if not props_match and module.params['state'] == "present":
+        if compat is None:
+            module.fail_json(msg="The specified inner and outer port types are not compatible", **result)
+        if not rtObjectId:
+            module.fail_json(msg="The specified object does not exist, please check your spelling", **result)
         with connection.cursor() as cursor:
-            if not validatePortCompatibility(module.params['innerinterface'],module.params['type']):
-                module.fail_json(msg="The specified inner and outer port types are not compatible", **result)
-            if not validateObjectExists(module.params['object']):
-                module.fail_json(msg="The specified object does not exist, please check your spelling", **result)
-            cursor.execute("SELECT id FROM PortInnerInterface WHERE iif_name=%s",module.params['innerinterface'])
-            iif_id = cursor.fetchone()[0]
-            cursor.execute("SELECT id FROM PortOuterInterface WHERE oif_name=%s",module.params['type'])
-            oif_id = cursor.fetchone()[0]
-            cursor.execute("SELECT id FROM `Object` WHERE name=%s",module.params['object'])
-            rtObjectId = cursor.fetchone()[0]
+            # The unique key of Port includes the interfaces, so an existing port is updated by id to change them.
+            # The affected rows are 0 when a concurrent run already made the same change
             if rt_port:
-                cursor.execute("UPDATE Port SET iif_id=%s, `type`=%s, l2address=%s, reservation_comment=%s, label=%s WHERE name=%s;",(iif_id,oif_id,module.params['l2address'],module.params['reservation'],module.params['label'],module.params['name']))
+                cursor.execute("UPDATE Port SET iif_id=%s, `type`=%s, l2address=%s, reservation_comment=%s, label=%s WHERE id=%s;",(iif_id,oif_id,module.params['l2address'],module.params['reservation'],module.params['label'],rt_port[6]))
             if not rt_port:
-                cursor.execute("INSERT INTO Port (object_id, name, iif_id, `type`, l2address, reservation_comment, label) VALUES(%s, %s, %s, %s, %s, %s, %s);",(rtObjectId,module.params['name'],iif_id,oif_id,module.params['l2address'],module.params['reservation'],module.params['label']))
+                cursor.execute("INSERT INTO Port (object_id, name, iif_id, `type`, l2address, reservation_comment, label) VALUES(%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE l2address=VALUES(l2address), reservation_comment=VALUES(reservation_comment), label=VALUES(label);",(rtObjectId,module.params['name'],iif_id,oif_id,module.params['l2address'],module.params['reservation'],module.params['label']))
+            result['changed'] = cursor.rowcount > 0
         connection.commit()
-        result['changed'] = True
         result['object']=module.params['object']
         result['name']=module.params['name']
         result['innerinterface']=module.params['innerinterface']
@@ -239,16 +189,14 @@ def run_module():
         result['l2address']=module.params['l2address']
         result['reservation']=module.params['reservation']
         result['label']=module.params['label']
-    elif not module.check_mode and module.params['state'] == "absent":
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT RTP.object_id, RTP.name FROM Port RTP, `Object` RTO WHERE RTP.object_id=RTO.id AND RTO.name=%s AND RTP.name=%s",(module.params['object'],module.params['name']))
-            port = cursor.fetchone()
-            if port:
-                cursor.execute("DELETE FROM Port WHERE object_id=%s AND name=%s",(port[0],module.params['name']))
-                connection.commit()
-                result['changed'] = True
-            else:
-                result['changed'] = False
+    elif module.params['state'] == "absent":
+        if rt_port:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM Port WHERE id=%s",rt_port[6])
+                result['changed'] = cursor.rowcount > 0
+            connection.commit()
+        else:
+            result['changed'] = False
 
     module.exit_json(**result)
 
@@ -256,4 +204,4 @@ def main():
     run_module()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
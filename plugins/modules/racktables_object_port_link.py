@@ -42,29 +42,11 @@ options:
             - Specify whether the object should be present or absent
         required: false
         default: present
-    rt_host:
-        description:
-            - Hostname of the database server backing Racktables
-        required: true
-    rt_port:
-        description:
-            - Port for the database connection, defaults to 3306
-        required: false
-    rt_username:
-        description:
-            - Username that has administrative access to the racktables database
-        required: true
-    rt_password:
-        description:
-            - Password for the administrative user
-        required: true
-    rt_database:
-        description:
-            - Name of the database which backs Racktables
-        required: true
 
 author:
     - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
 '''
 
 EXAMPLES = '''
@@ -85,31 +67,18 @@ message:
     type: str
     returned: always
 '''
-HAVE_PYMYSQL = False
-try:
-    import pymysql.cursors
-    import ipaddress
-    import os
-    HAVE_PYMYSQL = True
-except ImportError:
-    pass
-
-from ansible.errors import AnsibleError
-from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
 
+@profiled_module('racktables_object_port_link')
 def run_module():
-    if HAVE_PYMYSQL is False:
-        raise AnsibleError("Can't run module racktables_object: module PyMySQL is not installed")
     module_args = dict(
         parent=dict(type='str', required=True),
         child=dict(type='str', required=True),
         state=dict(type='str', default='present', choices=['present', 'absent']),
-        rt_host=dict(type='str',required=True),
-        rt_port=dict(type='int',required=False,default=3306),
-        rt_username=dict(type='str',required=True),
-        rt_password=dict(type='str',required=True,no_log=True),
-        rt_database=dict(type='str',required=True)
     )
+    module_args.update(racktables_argument_spec())
 
     result = dict(
         changed=False,
@@ -124,10 +93,10 @@ def run_module():
         supports_check_mode=True
     )
 
-    try:
-        connection = pymysql.connect(host=module.params['rt_host'],port=module.params['rt_port'],user=module.params['rt_username'],password=module.params['rt_password'],db=module.params['rt_database'])
-    except:
-        raise AnsibleError("An error occured while connecting to your Racktables database, please check your connection info and try again")
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    connection = RacktablesDB(module.params, module).primary
 
     def validateParentCompat(parent,child):
         with connection.cursor() as cursor:
@@ -174,7 +143,6 @@ def run_module():
     elif not module.check_mode and module.params['state'] == "absent":
         with connection.cursor() as cursor:
             entityLink = getEntityLink(module.params['parent'], module.params['child'])
-            print(entityLink)
             if entityLink:
                 cursor.execute('DELETE FROM EntityLink WHERE id=%s',entityLink[0])
                 connection.commit()
@@ -0,0 +1,575 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_plan
+
+short_description: Plans bulk changes to objects, ports and allocations in Racktables and applies them later
+
+version_added: "2.4"
+
+description:
+    - "With I(mode=plan), compare many objects, ports and IPv4 allocations with Racktables using a few bulk queries, and write the exact inserts, updates and deletes needed to a plan file"
+    - "With I(mode=apply), run the operations of a plan file in a single transaction"
+    - "The plan keeps a fingerprint of every row it was worked out from. Before applying, those rows are read again and locked, and nothing is written if any of them changed since the plan was made"
+    - "Entries follow the options of racktables_object, racktables_object_port and racktables_ipv4_allocation"
+
+options:
+    path:
+        description:
+            - The plan file, written with I(mode=plan) and read with I(mode=apply)
+        required: true
+        type: path
+    mode:
+        description:
+            - C(plan) works out the operations and writes them to I(path), Racktables isn't changed
+            - C(apply) runs the operations in I(path)
+        required: false
+        default: plan
+        choices: [ plan, apply ]
+        type: str
+    objects:
+        description:
+            - The objects to manage, only used with I(mode=plan)
+            - Deleting an object only removes the object itself, like racktables_object
+        required: false
+        type: list
+        elements: dict
+        suboptions:
+            name:
+                description: The name of the object
+                required: true
+                type: str
+            label:
+                description: Optional text label for the object
+                required: false
+                default: ""
+                type: str
+            type:
+                description: Object type
+                required: false
+                default: VM
+                type: str
+            assetnumber:
+                description: Optional asset tag for the object
+                required: false
+                type: str
+            comment:
+                description: Optional comment for the object
+                required: false
+                default: ""
+                type: str
+            state:
+                description: Specify whether the object should be present or absent
+                required: false
+                default: present
+                choices: [ present, absent ]
+                type: str
+    ports:
+        description:
+            - The object ports to manage, only used with I(mode=plan)
+            - The object must exist, or be created by I(objects)
+        required: false
+        type: list
+        elements: dict
+        suboptions:
+            object:
+                description: The name of the object
+                required: true
+                type: str
+            name:
+                description: The name of the port
+                required: true
+                type: str
+            innerinterface:
+                description: The type of inner interface of the port
+                required: false
+                default: hardwired
+                choices: [ CFP, CFP2, CPAK, GBIC, hardwired, QSFP+, SFP-100, SFP-1000, SFP+, X2, XENPAK, XFP, XPAK ]
+                type: str
+            type:
+                description: The type of outer interface of the port
+                required: false
+                default: 1000Base-T
+                type: str
+            l2address:
+                description: Optional L2 address of the port
+                required: false
+                type: str
+            reservation:
+                description: An optional reservation comment
+                required: false
+                type: str
+            label:
+                description: An optional label for the port
+                required: false
+                default: ""
+                type: str
+            state:
+                description: Specify whether the port should be present or absent
+                required: false
+                default: present
+                choices: [ present, absent ]
+                type: str
+    allocations:
+        description:
+            - The IPv4 allocations to manage, only used with I(mode=plan)
+            - The object must exist, or be created by I(objects)
+            - Allocating the next free address from tags isn't supported, as the address is only known when it is written, use racktables_ipv4_allocation for that
+        required: false
+        type: list
+        elements: dict
+        suboptions:
+            object:
+                description: The name of the object the address is assigned to
+                required: true
+                type: str
+            interface:
+                description: The interface name the address is assigned to on the object
+                required: true
+                type: str
+            ip:
+                description: The IP address to assign, required when I(state=present)
+                required: false
+                type: str
+            type:
+                description: The type of IP/Interface (regular, shared, virtual, router, point2point)
+                required: false
+                default: regular
+                type: str
+            state:
+                description: Specify whether the allocation should be present or absent
+                required: false
+                default: present
+                choices: [ present, absent ]
+                type: str
+
+notes:
+    - "Check mode doesn't write the plan file with I(mode=plan), and only verifies the plan with I(mode=apply)"
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+'''
+
+EXAMPLES = '''
+# Work out what a rack build would change, for review
+- name: Plan the build of rack A12
+  racktables_plan:
+    path: /var/lib/racktables/a12.plan
+    objects: "{{ a12_servers | map('community.general.dict_kv', 'name') | list }}"
+    ports: "{{ a12_ports }}"
+    allocations: "{{ a12_addresses }}"
+  register: a12
+
+- name: Show the plan
+  debug:
+    var: a12.summary
+
+# Later, once the plan was reviewed
+- name: Apply the plan of rack A12
+  racktables_plan:
+    path: /var/lib/racktables/a12.plan
+    mode: apply
+'''
+
+RETURN = '''
+path:
+    description: The plan file
+    type: str
+    returned: always
+operations:
+    description:
+        - The operations of the plan, in the order they are applied
+        - Each has the C(table) and the C(op) (insert, update or delete), what it identifies the row by, the C(values) written and the C(before) state of the row
+    type: list
+    returned: always
+summary:
+    description: The number of operations of each kind, per table
+    type: dict
+    returned: always
+fingerprint:
+    description: The checksums of the rows the plan was worked out from, per kind of row
+    type: dict
+    returned: always
+stale:
+    description: The kinds of rows that changed since the plan was made, empty when the plan is up to date
+    type: list
+    returned: when mode is apply
+'''
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+
+try:
+    import ipaddress
+except ImportError:
+    pass
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils._text import to_bytes
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+# Bumped whenever the layout of the plan file changes, older plans have to be made again
+PLAN_VERSION = 1
+
+# Maximum number of values bound into a single IN (...) clause, and of rows written per statement
+BATCH_SIZE = 1000
+
+def batches(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def fingerprint(sources):
+    """A checksum per kind of source row, independent of the order the rows were read in."""
+    checksums = {}
+    for kind, rows in sorted(sources.items()):
+        encoded = sorted(json.dumps(list(row), default=str) for row in rows)
+        checksums[kind] = hashlib.sha256(to_bytes('\n'.join(encoded))).hexdigest()
+    return checksums
+
+@profiled_module('racktables_plan')
+def run_module():
+    module_args = dict(
+        path=dict(type='path', required=True),
+        mode=dict(type='str', default='plan', choices=['plan', 'apply']),
+        objects=dict(type='list', elements='dict', required=False, options=dict(
+            name=dict(type='str', required=True),
+            label=dict(type='str', required=False, default=""),
+            type=dict(type='str', required=False, default="VM"),
+            assetnumber=dict(type='str', required=False),
+            comment=dict(type='str', required=False, default=""),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+        )),
+        ports=dict(type='list', elements='dict', required=False, options=dict(
+            object=dict(type='str', required=True),
+            name=dict(type='str', required=True),
+            innerinterface=dict(type='str', required=False, default="hardwired", choices=['CFP', 'CFP2', 'CPAK', 'GBIC', 'hardwired', 'QSFP+', 'SFP-100', 'SFP-1000', 'SFP+', 'X2', 'XENPAK', 'XFP', 'XPAK']),
+            type=dict(type='str', required=False, default="1000Base-T"),
+            l2address=dict(type='str', required=False),
+            reservation=dict(type='str', required=False),
+            label=dict(type='str', required=False, default=""),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+        )),
+        allocations=dict(type='list', elements='dict', required=False, options=dict(
+            object=dict(type='str', required=True),
+            interface=dict(type='str', required=True),
+            ip=dict(type='str', required=False),
+            type=dict(type='str', required=False, default="regular"),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+        )),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        path='',
+        operations=[],
+        summary={},
+        fingerprint={},
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    path = module.params['path']
+    result['path'] = path
+
+    def normalize():
+        """The requested objects, ports and allocations, checked for duplicates and with the addresses in canonical form."""
+        desired = dict(objects=[], ports=[], allocations=[])
+        seen = set()
+        for obj in module.params['objects'] or []:
+            if ('object', obj['name']) in seen:
+                module.fail_json(msg="Object {} is listed more than once".format(obj['name']), **result)
+            seen.add(('object', obj['name']))
+            desired['objects'].append(obj)
+        for port in module.params['ports'] or []:
+            if ('port', port['object'], port['name']) in seen:
+                module.fail_json(msg="Port {} of {} is listed more than once".format(port['name'], port['object']), **result)
+            seen.add(('port', port['object'], port['name']))
+            desired['ports'].append(port)
+        for allocation in module.params['allocations'] or []:
+            if ('allocation', allocation['object'], allocation['interface']) in seen:
+                module.fail_json(msg="Interface {} of {} is listed more than once".format(allocation['interface'], allocation['object']), **result)
+            seen.add(('allocation', allocation['object'], allocation['interface']))
+            if allocation['state'] == 'present' and not allocation['ip']:
+                module.fail_json(msg="An ip is required for interface {} of {}".format(allocation['interface'], allocation['object']), **result)
+            if allocation['ip']:
+                try:
+                    allocation = dict(allocation, ip=str(ipaddress.IPv4Address(allocation['ip'])))
+                except ValueError as e:
+                    module.fail_json(msg="Invalid ip for interface {} of {}: {}".format(allocation['interface'], allocation['object'], e), **result)
+            desired['allocations'].append(allocation)
+        assets = [obj['assetnumber'] for obj in desired['objects'] if obj['state'] == 'present' and obj['assetnumber']]
+        duplicates = sorted(set(asset for asset in assets if assets.count(asset) > 1))
+        if duplicates:
+            module.fail_json(msg="Asset numbers are given to more than one object: {}".format(', '.join(duplicates)), **result)
+        return desired
+
+    def readSources(connection, desired, lock=False):
+        """Every row the plan depends on, read in bulk, by kind."""
+        suffix = " FOR UPDATE" if lock else ""
+        names = sorted(set([obj['name'] for obj in desired['objects']] + [port['object'] for port in desired['ports']] + [allocation['object'] for allocation in desired['allocations']]))
+        assets = sorted(set(obj['assetnumber'] for obj in desired['objects'] if obj['state'] == 'present' and obj['assetnumber']))
+        types = sorted(set(obj['type'] for obj in desired['objects'] if obj['state'] == 'present'))
+        presentPorts = [port for port in desired['ports'] if port['state'] == 'present']
+        iifs = sorted(set(port['innerinterface'] for port in presentPorts))
+        oifs = sorted(set(port['type'] for port in presentPorts))
+        sources = dict(objects=[], assets=[], types=[], interfaces=[], ports=[], allocations=[])
+        with connection.cursor() as cursor:
+            for batch in batches(names):
+                cursor.execute("SELECT id, name, label, objtype_id, asset_no, comment FROM `Object` WHERE name IN ({})".format(inPlaceholders(batch)) + suffix,batch)
+                sources['objects'].extend(cursor.fetchall())
+            for batch in batches(assets):
+                cursor.execute("SELECT name, asset_no FROM `Object` WHERE asset_no IN ({})".format(inPlaceholders(batch)) + suffix,batch)
+                sources['assets'].extend(cursor.fetchall())
+            for batch in batches(types):
+                cursor.execute("SELECT dict_key, dict_value FROM Dictionary WHERE chapter_id=1 AND dict_value IN ({})".format(inPlaceholders(batch)) + suffix,batch)
+                sources['types'].extend(cursor.fetchall())
+            if presentPorts:
+                cursor.execute("SELECT PII.iif_name, POI.oif_name, PII.id, POI.id, PIC.iif_id FROM PortInnerInterface PII JOIN PortOuterInterface POI LEFT JOIN PortInterfaceCompat PIC ON PIC.iif_id=PII.id AND PIC.oif_id=POI.id WHERE PII.iif_name IN ({}) AND POI.oif_name IN ({})".format(inPlaceholders(iifs), inPlaceholders(oifs)) + suffix,iifs + oifs)
+                sources['interfaces'].extend(cursor.fetchall())
+
+            objectIds = dict((row[1], row[0]) for row in sources['objects'])
+            wantedPorts = set((objectIds[port['object']], port['name']) for port in desired['ports'] if port['object'] in objectIds)
+            wantedInterfaces = set((objectIds[allocation['object']], allocation['interface']) for allocation in desired['allocations'] if allocation['object'] in objectIds)
+            wantedAddresses = set((objectIds[allocation['object']], allocation['ip']) for allocation in desired['allocations'] if allocation['object'] in objectIds and allocation['ip'])
+            # Only the rows asked about count, so changes to other ports and addresses of the same objects don't make the plan stale
+            for batch in batches(sorted(set(objectId for objectId, name in wantedPorts))):
+                cursor.execute("SELECT id, object_id, name, iif_id, `type`, l2address, reservation_comment, label FROM Port WHERE object_id IN ({}) ORDER BY id".format(inPlaceholders(batch)) + suffix,batch)
+                sources['ports'].extend(row for row in cursor.fetchall() if (row[1], row[2]) in wantedPorts)
+            for batch in batches(sorted(set(objectId for objectId, name in wantedInterfaces | wantedAddresses))):
+                cursor.execute("SELECT object_id, INET_NTOA(ip), name, `type` FROM IPv4Allocation WHERE object_id IN ({}) ORDER BY ip".format(inPlaceholders(batch)) + suffix,batch)
+                sources['allocations'].extend(row for row in cursor.fetchall() if (row[0], row[2]) in wantedInterfaces or (row[0], row[1]) in wantedAddresses)
+        return sources
+
+    def makePlan(desired, sources):
+        """The operations that take Racktables from the source rows to the desired state, in the order they have to run."""
+        objects = dict((row[1], row) for row in sources['objects'])
+        assetHolders = dict((row[1], row[0]) for row in sources['assets'])
+        typeIds = dict((row[1], row[0]) for row in sources['types'])
+        interfaces = dict(((row[0], row[1]), row[2:]) for row in sources['interfaces'])
+        ports = {}
+        for row in sources['ports']:
+            ports.setdefault((row[1], row[2]), row)
+        allocations = {}
+        for row in sources['allocations']:
+            allocations.setdefault((row[0], row[2]), []).append(row)
+        addressHolders = dict(((row[0], row[1]), row[2]) for row in sources['allocations'])
+
+        errors = []
+        created = set(obj['name'] for obj in desired['objects'] if obj['state'] == 'present' and obj['name'] not in objects)
+        removed = set(obj['name'] for obj in desired['objects'] if obj['state'] == 'absent')
+        operations = dict(objects=[], objectDeletes=[], portDeletes=[], portUpdates=[], portInserts=[], allocationDeletes=[], allocationUpdates=[], allocationInserts=[])
+
+        for obj in desired['objects']:
+            current = objects.get(obj['name'])
+            if obj['state'] == 'absent':
+                if current:
+                    operations['objectDeletes'].append(dict(table='Object', op='delete', id=current[0], name=obj['name'], before=dict(label=current[2], objtype_id=current[3], asset_no=current[4], comment=current[5])))
+                continue
+            if obj['type'] not in typeIds:
+                errors.append("Object type {} of {} doesn't exist".format(obj['type'], obj['name']))
+                continue
+            if obj['assetnumber'] and assetHolders.get(obj['assetnumber'], obj['name']) != obj['name']:
+                errors.append("Asset number {} is already used by {}".format(obj['assetnumber'], assetHolders[obj['assetnumber']]))
+                continue
+            values = dict(label=obj['label'], objtype_id=typeIds[obj['type']], asset_no=obj['assetnumber'], comment=obj['comment'])
+            if current is None:
+                operations['objects'].append(dict(table='Object', op='insert', name=obj['name'], values=values))
+                continue
+            before = dict(label=current[2], objtype_id=current[3], asset_no=current[4], comment=current[5])
+            if before != values:
+                operations['objects'].append(dict(table='Object', op='update', id=current[0], name=obj['name'], values=values, before=before))
+
+        def objectOf(entry, kind):
+            if entry['state'] == 'absent':
+                return objects[entry['object']][0] if entry['object'] in objects else None, True
+            if entry['object'] in removed:
+                errors.append("{} of {} is planned, but the object is removed".format(kind, entry['object']))
+            elif entry['object'] not in objects and entry['object'] not in created:
+                errors.append("{} of {} is planned, but the object doesn't exist".format(kind, entry['object']))
+            else:
+                return objects[entry['object']][0] if entry['object'] in objects else None, True
+            return None, False
+
+        for port in desired['ports']:
+            objectId, valid = objectOf(port, "Port {}".format(port['name']))
+            if not valid:
+                continue
+            current = ports.get((objectId, port['name'])) if objectId else None
+            before = dict(iif_id=current[3], type=current[4], l2address=current[5], reservation_comment=current[6], label=current[7]) if current else None
+            if port['state'] == 'absent':
+                if current:
+                    operations['portDeletes'].append(dict(table='Port', op='delete', id=current[0], object=port['object'], name=port['name'], before=before))
+                continue
+            interface = interfaces.get((port['innerinterface'], port['type']))
+            if interface is None or interface[2] is None:
+                errors.append("The inner and outer port types of port {} of {} are not compatible".format(port['name'], port['object']))
+                continue
+            values = dict(iif_id=interface[0], type=interface[1], l2address=port['l2address'], reservation_comment=port['reservation'], label=port['label'])
+            if current is None:
+                operations['portInserts'].append(dict(table='Port', op='insert', object=port['object'], object_id=objectId, name=port['name'], values=values))
+            elif before != values:
+                operations['portUpdates'].append(dict(table='Port', op='update', id=current[0], object=port['object'], name=port['name'], values=values, before=before))
+
+        for allocation in desired['allocations']:
+            objectId, valid = objectOf(allocation, "Interface {}".format(allocation['interface']))
+            if not valid:
+                continue
+            rows = allocations.get((objectId, allocation['interface']), []) if objectId else []
+            # An interface can have several addresses, the one asked for is the one that is kept
+            current = ([row for row in rows if row[1] == allocation['ip']] + rows + [None])[0]
+            before = dict(ip=current[1], type=current[3]) if current else None
+            if allocation['state'] == 'absent':
+                if current:
+                    operations['allocationDeletes'].append(dict(table='IPv4Allocation', op='delete', object=allocation['object'], object_id=objectId, name=allocation['interface'], ip=current[1], before=before))
+                continue
+            holder = addressHolders.get((objectId, allocation['ip']))
+            if holder is not None and holder != allocation['interface']:
+                errors.append("{} is already allocated to interface {} of {}".format(allocation['ip'], holder, allocation['object']))
+                continue
+            values = dict(ip=allocation['ip'], type=allocation['type'])
+            if current is None:
+                operations['allocationInserts'].append(dict(table='IPv4Allocation', op='insert', object=allocation['object'], object_id=objectId, name=allocation['interface'], values=values))
+            elif before != values:
+                operations['allocationUpdates'].append(dict(table='IPv4Allocation', op='update', object=allocation['object'], object_id=objectId, name=allocation['interface'], ip=current[1], values=values, before=before))
+
+        if errors:
+            module.fail_json(msg="The plan can't be made: {}".format('; '.join(errors)), **result)
+        # Ports and addresses are freed before others take them, and objects are removed after everything that points at them
+        order = ('objects', 'portDeletes', 'portUpdates', 'portInserts', 'allocationDeletes', 'allocationUpdates', 'allocationInserts', 'objectDeletes')
+        return [operation for group in order for operation in operations[group]]
+
+    def summarize(operations):
+        summary = {}
+        for operation in operations:
+            counts = summary.setdefault(operation['table'], dict(insert=0, update=0, delete=0))
+            counts[operation['op']] += 1
+        return summary
+
+    def writeOperations(cursor, operations):
+        objectIds = {}
+        for (table, op), group in itertools.groupby(operations, key=lambda operation: (operation['table'], operation['op'])):
+            for batch in batches(group):
+                if (table, op) == ('Object', 'insert'):
+                    cursor.executemany("INSERT INTO `Object` (name, label, objtype_id, asset_no, has_problems, comment) VALUES (%s, %s, %s, %s, 'no', %s)",[(operation['name'], operation['values']['label'], operation['values']['objtype_id'], operation['values']['asset_no'], operation['values']['comment']) for operation in batch])
+                    # Ports and addresses of the new objects are written with their ids
+                    names = [operation['name'] for operation in batch]
+                    cursor.execute("SELECT name, id FROM `Object` WHERE name IN ({})".format(inPlaceholders(names)),names)
+                    objectIds.update(cursor.fetchall())
+                elif (table, op) == ('Object', 'update'):
+                    cursor.executemany("UPDATE `Object` SET label=%s, objtype_id=%s, asset_no=%s, comment=%s WHERE id=%s",[(operation['values']['label'], operation['values']['objtype_id'], operation['values']['asset_no'], operation['values']['comment'], operation['id']) for operation in batch])
+                elif (table, op) == ('Object', 'delete'):
+                    ids = [operation['id'] for operation in batch]
+                    cursor.execute("DELETE FROM `Object` WHERE id IN ({})".format(inPlaceholders(ids)),ids)
+                elif (table, op) == ('Port', 'insert'):
+                    cursor.executemany("INSERT INTO Port (object_id, name, iif_id, `type`, l2address, reservation_comment, label) VALUES (%s, %s, %s, %s, %s, %s, %s)",[(operation['object_id'] or objectIds[operation['object']], operation['name'], operation['values']['iif_id'], operation['values']['type'], operation['values']['l2address'], operation['values']['reservation_comment'], operation['values']['label']) for operation in batch])
+                elif (table, op) == ('Port', 'update'):
+                    cursor.executemany("UPDATE Port SET iif_id=%s, `type`=%s, l2address=%s, reservation_comment=%s, label=%s WHERE id=%s",[(operation['values']['iif_id'], operation['values']['type'], operation['values']['l2address'], operation['values']['reservation_comment'], operation['values']['label'], operation['id']) for operation in batch])
+                elif (table, op) == ('Port', 'delete'):
+                    ids = [operation['id'] for operation in batch]
+                    cursor.execute("DELETE FROM Port WHERE id IN ({})".format(inPlaceholders(ids)),ids)
+                elif (table, op) == ('IPv4Allocation', 'insert'):
+                    cursor.executemany("INSERT INTO IPv4Allocation (object_id, ip, name, `type`) VALUES (%s, INET_ATON(%s), %s, %s)",[(operation['object_id'] or objectIds[operation['object']], operation['values']['ip'], operation['name'], operation['values']['type']) for operation in batch])
+                elif (table, op) == ('IPv4Allocation', 'update'):
+                    cursor.executemany("UPDATE IPv4Allocation SET ip=INET_ATON(%s), `type`=%s WHERE object_id=%s AND ip=INET_ATON(%s)",[(operation['values']['ip'], operation['values']['type'], operation['object_id'], operation['ip']) for operation in batch])
+                elif (table, op) == ('IPv4Allocation', 'delete'):
+                    cursor.executemany("DELETE FROM IPv4Allocation WHERE object_id=%s AND ip=INET_ATON(%s)",[(operation['object_id'], operation['ip']) for operation in batch])
+
+    db = RacktablesDB(module.params, module)
+
+    if module.params['mode'] == 'plan':
+        desired = normalize()
+        # The plan is only a proposal, the replica is good enough, apply checks every row again on the primary
+        sources = readSources(db.read, desired)
+        operations = makePlan(desired, sources)
+        result['operations'] = operations
+        result['summary'] = summarize(operations)
+        result['fingerprint'] = fingerprint(sources)
+        plan = dict(version=PLAN_VERSION, host=module.params['rt_host'], database=module.params['rt_database'], desired=desired, fingerprint=result['fingerprint'], operations=operations)
+        content = to_bytes(json.dumps(plan, sort_keys=True, separators=(',', ':'))) + b'\n'
+        try:
+            with open(path, 'rb') as planFile:
+                result['changed'] = planFile.read() != content
+        except (IOError, OSError):
+            result['changed'] = True
+        if result['changed'] and not module.check_mode:
+            directory = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(directory):
+                module.fail_json(msg="The directory {} does not exist".format(directory), **result)
+            fd, tmpPath = tempfile.mkstemp(prefix='.racktables_plan', dir=directory)
+            with os.fdopen(fd, 'wb') as tmpFile:
+                tmpFile.write(content)
+            module.atomic_move(tmpPath, path)
+        module.exit_json(**result)
+
+    try:
+        with open(path, 'rb') as planFile:
+            plan = json.loads(planFile.read())
+    except (IOError, OSError, ValueError) as e:
+        module.fail_json(msg="Failed to read the plan {}: {}".format(path, e), **result)
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        module.fail_json(msg="{} isn't a plan this version of racktables_plan can apply, make it again".format(path), **result)
+    if (plan['host'], plan['database']) != (module.params['rt_host'], module.params['rt_database']):
+        module.fail_json(msg="The plan was made for {} on {}, not {} on {}".format(plan['database'], plan['host'], module.params['rt_database'], module.params['rt_host']), **result)
+    result['operations'] = plan['operations']
+    result['summary'] = summarize(plan['operations'])
+    result['fingerprint'] = plan['fingerprint']
+
+    def staleKinds(sources):
+        current = fingerprint(sources)
+        return sorted(kind for kind in set(current) | set(plan['fingerprint']) if current.get(kind) != plan['fingerprint'].get(kind))
+
+    if module.check_mode or not plan['operations']:
+        result['stale'] = staleKinds(readSources(db.read, plan['desired']))
+        if result['stale']:
+            module.fail_json(msg="Racktables changed since the plan was made ({}), make it again".format(', '.join(result['stale'])), **result)
+        result['changed'] = bool(plan['operations'])
+        module.exit_json(**result)
+
+    connection = db.primary
+    try:
+        # Locks every source row until the commit, so nothing can change between the check and the writes
+        result['stale'] = staleKinds(readSources(connection, plan['desired'], lock=True))
+        if result['stale']:
+            connection.rollback()
+            module.fail_json(msg="Racktables changed since the plan was made ({}), no changes were made, make it again".format(', '.join(result['stale'])), **result)
+        with connection.cursor() as cursor:
+            writeOperations(cursor, plan['operations'])
+        connection.commit()
+    except DBError as e:
+        connection.rollback()
+        module.fail_json(msg="Failed to apply the plan, no changes were made: {}".format(e), **result)
+    result['changed'] = True
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_rack_mount
+
+short_description: Mounts objects into rack units in Racktables
+
+version_added: "2.4"
+
+description:
+    - "Mount an object into a set of units of a rack, or unmount it, in a single transaction"
+    - "When the object is already in the rack, it is moved to the requested units"
+    - "The module fails without changing anything if any requested unit is taken by another object, or marked absent or unusable"
+    - "Mounts of the object in other racks are left alone"
+
+options:
+    object:
+        description:
+            - The name of the object
+        required: true
+        type: str
+    rack:
+        description:
+            - The name of the rack
+        required: true
+        type: str
+    unit:
+        description:
+            - The lowest unit the object takes up
+            - Required when I(state) is C(present), when I(state) is C(absent) only these units are freed if it is given
+        required: false
+        type: int
+    height:
+        description:
+            - The number of units the object takes up, starting at I(unit)
+        required: false
+        type: int
+        default: 1
+    atoms:
+        description:
+            - The parts of each unit the object takes up, any of C(front), C(interior) and C(rear)
+        required: false
+        type: list
+        elements: str
+        default: [ front, interior, rear ]
+    state:
+        description:
+            - Specify whether the object should be mounted or not
+        required: false
+        default: present
+        choices: [ present, absent ]
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+'''
+
+EXAMPLES = '''
+# Mount a 2U server at the bottom of a rack
+- name: Mount the server
+  racktables_rack_mount:
+    object: "test.lab1"
+    rack: "A01"
+    unit: 1
+    height: 2
+
+# Mount a switch in the rear half of a unit
+- name: Mount the switch
+  racktables_rack_mount:
+    object: "sw1.lab1"
+    rack: "A01"
+    unit: 42
+    atoms: [ interior, rear ]
+
+# Take an object out of the rack
+- name: Unmount the server
+  racktables_rack_mount:
+    object: "test.lab1"
+    rack: "A01"
+    state: absent
+'''
+
+RETURN = '''
+units:
+    description: The units the object takes up in the rack after the change, lowest first
+    type: list
+    returned: always
+mounted:
+    description: The number of atoms that were (or in check mode would be) added
+    type: int
+    returned: always
+unmounted:
+    description: The number of atoms that were (or in check mode would be) freed
+    type: int
+    returned: always
+'''
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_rackspace import ATOMS, getRacks, getRackSpace
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+@profiled_module('racktables_rack_mount')
+def run_module():
+    module_args = dict(
+        object=dict(type='str', required=True),
+        rack=dict(type='str', required=True),
+        unit=dict(type='int', required=False),
+        height=dict(type='int', required=False, default=1),
+        atoms=dict(type='list', elements='str', required=False, default=list(ATOMS)),
+        state=dict(type='str', default='present', choices=['present', 'absent']),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        units=[],
+        mounted=0,
+        unmounted=0,
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        required_if=[('state', 'present', ('unit',))],
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    invalid = [atom for atom in module.params['atoms'] if atom not in ATOMS]
+    if invalid or not module.params['atoms']:
+        module.fail_json(msg="atoms must be a list of {}".format(', '.join(ATOMS)), **result)
+    if module.params['height'] < 1:
+        module.fail_json(msg="height must be at least 1", **result)
+
+    requested = set()
+    if module.params['unit'] is not None:
+        units = range(module.params['unit'], module.params['unit'] + module.params['height'])
+        requested = set((unit, atom) for unit in units for atom in module.params['atoms'])
+
+    db = RacktablesDB(module.params, module)
+
+    def getObjectId(connection):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM `Object` WHERE name=%s",module.params['object'])
+            rt_object = cursor.fetchone()
+        if not rt_object:
+            module.fail_json(msg="Object {} doesn't exist".format(module.params['object']), **result)
+        return rt_object[0]
+
+    def plan(connection, lock=False):
+        """Work out the atoms to take and to free."""
+        racks = getRacks(connection, racks=[module.params['rack']], lock=lock)
+        if not racks:
+            module.fail_json(msg="Rack {} doesn't exist".format(module.params['rack']), **result)
+        rackId, name, height = racks[0][:3]
+        objectId = getObjectId(connection)
+        outside = sorted(set(unit for unit, atom in requested if unit < 1 or unit > (height or 0)))
+        if outside:
+            module.fail_json(msg="Rack {} has units 1 to {}, {} is outside of it".format(name, height or 0, outside[0]), **result)
+
+        current = set()
+        conflicts = []
+        for rack, unit, atom, state, owner in getRackSpace(connection, [rackId], lock):
+            if state == 'T' and owner == objectId:
+                current.add((unit, atom))
+            elif (unit, atom) in requested:
+                conflicts.append((unit, ATOMS.index(atom), "{} {} ({})".format(unit, atom, "taken" if state == 'T' else "absent" if state == 'A' else "unusable")))
+        if conflicts and module.params['state'] == 'present':
+            module.fail_json(msg="The following atoms of {} aren't free: {}".format(name, ', '.join(conflict[2] for conflict in sorted(conflicts))), **result)
+
+        if module.params['state'] == 'present':
+            mount = sorted(requested - current)
+            unmount = sorted(current - requested)
+            remaining = requested
+        else:
+            unmount = sorted(current & requested if requested else current)
+            mount = []
+            remaining = current - set(unmount)
+        return rackId, objectId, mount, unmount, remaining
+
+    rackId, objectId, mount, unmount, remaining = plan(db.read)
+    if (mount or unmount) and not module.check_mode:
+        # Work out the changes again holding a lock on the rack, so concurrent runs can't take the same units
+        rackId, objectId, mount, unmount, remaining = plan(db.primary, lock=True)
+
+    result['units'] = sorted(set(unit for unit, atom in remaining))
+    result['mounted'] = len(mount)
+    result['unmounted'] = len(unmount)
+    result['changed'] = bool(mount or unmount)
+
+    if module.check_mode or not result['changed']:
+        module.exit_json(**result)
+
+    connection = db.primary
+    try:
+        with connection.cursor() as cursor:
+            if unmount:
+                cursor.executemany("DELETE FROM RackSpace WHERE rack_id=%s AND unit_no=%s AND atom=%s AND object_id=%s",[(rackId, unit, atom, objectId) for unit, atom in unmount])
+            if mount:
+                cursor.executemany("INSERT INTO RackSpace (rack_id, unit_no, atom, state, object_id) VALUES (%s, %s, %s, 'T', %s)",[(rackId, unit, atom, objectId) for unit, atom in mount])
+            # Racktables redraws the rack's thumbnail when it is missing
+            cursor.execute("DELETE FROM RackThumbnail WHERE rack_id=%s",rackId)
+        connection.commit()
+    except DBError as e:
+        connection.rollback()
+        module.fail_json(msg="Failed to update the rack, no changes were made: {}".format(e), **result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
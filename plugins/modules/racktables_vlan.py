@@ -0,0 +1,336 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2020, Chandler Willoughby <cwilloughby@bandwidth.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: racktables_vlan
+
+short_description: Manages the VLANs of a VLAN domain in Racktables
+
+version_added: "2.4"
+
+description:
+    - "Create, update, and delete the VLANs of a VLAN domain in Racktables, and bind IPv4 networks to them"
+    - "The domain is compared with the requested VLANs in one query, and only the differences are written, in a single transaction"
+    - "A missing domain is created along with its default VLAN 1, like Racktables does"
+
+options:
+    domain:
+        description:
+            - The name of the VLAN domain
+        required: true
+        type: str
+    vlans:
+        description:
+            - The VLANs to manage in the domain
+        required: true
+        type: list
+        elements: dict
+        suboptions:
+            id:
+                description:
+                    - The VLAN ID, from 1 to 4094
+                required: true
+                type: int
+                aliases: [ tag ]
+            name:
+                description:
+                    - The description of the VLAN, left untouched on existing VLANs when not set
+                required: false
+                type: str
+            type:
+                description:
+                    - The VLAN type, left untouched on existing VLANs when not set and C(ondemand) for new ones
+                required: false
+                type: str
+                choices: [ ondemand, compulsory, alien ]
+            networks:
+                description:
+                    - The IPv4 networks bound to the VLAN, in CIDR notation, they must already exist
+                    - Networks bound to another VLAN of the domain are moved to this one, and networks bound to this VLAN that aren't listed are unbound
+                    - Bindings in other VLAN domains are left untouched
+                    - The bindings are left untouched when not set
+                required: false
+                type: list
+                elements: str
+    purge:
+        description:
+            - Remove the VLANs of the domain that aren't in I(vlans), apart from the default VLAN 1
+        required: false
+        type: bool
+        default: false
+    state:
+        description:
+            - Specify whether the VLANs should be present or absent
+            - When C(absent), the VLANs in I(vlans) and their network bindings are removed, only their C(id) is used
+            - The domain itself is never removed
+        required: false
+        default: present
+        choices: [ present, absent ]
+
+author:
+    - Chandler Willoughby (@cwilloughby-bw)
+extends_documentation_fragment:
+    - cwilloughby_bw.racktables.racktables
+'''
+
+EXAMPLES = '''
+# Stand up the VLANs of a new site
+- name: Create the VLANs of LAB1
+  racktables_vlan:
+    domain: "LAB1"
+    vlans:
+      - id: 100
+        name: "web"
+        networks:
+          - "192.0.2.0/26"
+      - id: 200
+        name: "db"
+      - id: 999
+        name: "quarantine"
+        type: alien
+
+# Build the list from a range
+- name: Create the customer VLANs
+  racktables_vlan:
+    domain: "LAB1"
+    vlans: "{{ range(2000, 2500) | map('community.general.dict_kv', 'id') | list }}"
+
+# Make the domain match the inventory exactly
+- name: Sync the VLANs of LAB1
+  racktables_vlan:
+    domain: "LAB1"
+    vlans: "{{ lab1_vlans }}"
+    purge: true
+
+# Remove VLANs
+- name: Remove the quarantine VLAN
+  racktables_vlan:
+    domain: "LAB1"
+    vlans:
+      - id: 999
+    state: absent
+'''
+
+RETURN = '''
+domain_created:
+    description: Whether the domain was (or in check mode would be) created
+    type: bool
+    returned: always
+changes:
+    description:
+        - One entry per VLAN that was (or in check mode would be) changed, with its C(vlan) ID and the C(before) and C(after) state
+        - Each state has the C(name), C(type) and C(networks) of the VLAN, or is null when the VLAN doesn't exist
+    type: list
+    returned: always
+'''
+try:
+    import ipaddress
+except ImportError:
+    pass
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables import DBError, HAVE_DB_DRIVER, RacktablesDB, racktables_argument_spec
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_ipam import formatNetwork
+from ansible_collections.cwilloughby_bw.racktables.plugins.module_utils.racktables_profile import profiled_module
+
+# Maximum number of values bound into a single IN (...) clause, and of rows written per statement
+BATCH_SIZE = 1000
+
+# The VLAN every domain has, Racktables doesn't allow removing it
+DEFAULT_VLAN = 1
+
+def batches(values):
+    for i in range(0, len(values), BATCH_SIZE):
+        yield values[i:i + BATCH_SIZE]
+
+def inPlaceholders(values):
+    return ','.join(['%s'] * len(values))
+
+@profiled_module('racktables_vlan')
+def run_module():
+    module_args = dict(
+        domain=dict(type='str', required=True),
+        vlans=dict(type='list', elements='dict', required=True, options=dict(
+            id=dict(type='int', required=True, aliases=['tag']),
+            name=dict(type='str', required=False),
+            type=dict(type='str', required=False, choices=['ondemand', 'compulsory', 'alien']),
+            networks=dict(type='list', elements='str', required=False),
+        )),
+        purge=dict(type='bool', required=False, default=False),
+        state=dict(type='str', default='present', choices=['present', 'absent']),
+    )
+    module_args.update(racktables_argument_spec())
+
+    result = dict(
+        changed=False,
+        domain_created=False,
+        changes=[],
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if HAVE_DB_DRIVER is False:
+        module.fail_json(msg=missing_required_lib('mysqlclient or PyMySQL'))
+
+    requested = {}
+    for vlan in module.params['vlans']:
+        if vlan['id'] < 1 or vlan['id'] > 4094:
+            module.fail_json(msg="VLAN ID {} is not between 1 and 4094".format(vlan['id']), **result)
+        if vlan['id'] in requested:
+            module.fail_json(msg="VLAN {} is listed more than once".format(vlan['id']), **result)
+        if module.params['state'] == 'absent' and vlan['id'] == DEFAULT_VLAN:
+            module.fail_json(msg="The default VLAN {} can't be removed".format(DEFAULT_VLAN), **result)
+        if vlan['networks'] is not None:
+            try:
+                vlan['networks'] = sorted(set(str(ipaddress.IPv4Network(network)) for network in vlan['networks']))
+            except ValueError as e:
+                module.fail_json(msg="Invalid network for VLAN {}: {}".format(vlan['id'], e), **result)
+        requested[vlan['id']] = vlan
+
+    boundTo = {}
+    for vlan in requested.values():
+        for network in vlan['networks'] or []:
+            if network in boundTo:
+                module.fail_json(msg="Network {} is listed for both VLAN {} and VLAN {}".format(network, boundTo[network], vlan['id']), **result)
+            boundTo[network] = vlan['id']
+
+    db = RacktablesDB(module.params, module)
+
+    def getDomain(connection, lock=False):
+        """The domain id and its VLANs with their bound networks, from a single query."""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT VD.id, V.vlan_id, V.vlan_type, V.vlan_descr, N.id, N.ip, N.mask FROM VLANDomain VD LEFT JOIN VLANDescription V ON V.domain_id=VD.id LEFT JOIN VLANIPv4 VI ON VI.domain_id=V.domain_id AND VI.vlan_id=V.vlan_id LEFT JOIN IPv4Network N ON N.id=VI.ipv4net_id WHERE VD.description=%s" + (" FOR UPDATE" if lock else ""),module.params['domain'])
+            rows = cursor.fetchall()
+        domainId = rows[0][0] if rows else None
+        current = {}
+        networkIds = {}
+        for row in rows:
+            if row[1] is None:
+                continue
+            vlan = current.setdefault(row[1], dict(name=row[3], type=row[2], networks=set()))
+            if row[4] is not None:
+                network = formatNetwork(row[5], row[6])
+                vlan['networks'].add(network)
+                networkIds[network] = row[4]
+        return domainId, current, networkIds
+
+    def getNetworkIds(connection, networks, lock=False):
+        networkIds = {}
+        with connection.cursor() as cursor:
+            for batch in batches(networks):
+                subnets = [ipaddress.IPv4Network(network) for network in batch]
+                cursor.execute("SELECT id, ip, mask FROM IPv4Network WHERE " + " OR ".join(["(ip=%s AND mask=%s)"] * len(subnets)) + (" FOR UPDATE" if lock else ""),[value for subnet in subnets for value in (int(subnet.network_address), subnet.prefixlen)])
+                networkIds.update((formatNetwork(row[1], row[2]), row[0]) for row in cursor.fetchall())
+        missing = [network for network in networks if network not in networkIds]
+        if missing:
+            module.fail_json(msg="The following networks do not exist: {}".format(', '.join(missing)), **result)
+        return networkIds
+
+    def describe(vlan):
+        if vlan is None:
+            return None
+        return dict(name=vlan['name'], type=vlan['type'], networks=sorted(vlan['networks']))
+
+    def plan(connection, lock=False):
+        """Work out the VLANs and bindings the domain should end up with, and what to write to get there."""
+        domainId, current, networkIds = getDomain(connection, lock)
+        if domainId is None and module.params['state'] == 'absent':
+            return domainId, {}, []
+
+        unknown = sorted(network for network in boundTo if network not in networkIds)
+        if unknown and module.params['state'] == 'present':
+            networkIds.update(getNetworkIds(connection, unknown, lock))
+
+        desired = dict((vlanId, dict(vlan, networks=set(vlan['networks']))) for vlanId, vlan in current.items())
+        if module.params['state'] == 'absent':
+            for vlanId in requested:
+                desired.pop(vlanId, None)
+        else:
+            if domainId is None and DEFAULT_VLAN not in requested:
+                desired[DEFAULT_VLAN] = dict(name='default', type='compulsory', networks=set())
+            for vlanId, vlan in sorted(requested.items()):
+                target = desired.setdefault(vlanId, dict(name='', type='ondemand', networks=set()))
+                if vlan['name'] is not None:
+                    target['name'] = vlan['name']
+                if vlan['type'] is not None:
+                    target['type'] = vlan['type']
+                if vlan['networks'] is not None:
+                    for other in desired.values():
+                        other['networks'].difference_update(vlan['networks'])
+                    target['networks'] = set(vlan['networks'])
+            if module.params['purge']:
+                for vlanId in [vlanId for vlanId in desired if vlanId not in requested and vlanId != DEFAULT_VLAN]:
+                    del desired[vlanId]
+
+        writes = dict(vlans=[], removed=[], unbind=[], bind=[])
+        changes = []
+        for vlanId in sorted(set(current) | set(desired)):
+            before = describe(current.get(vlanId))
+            after = describe(desired.get(vlanId))
+            if before == after:
+                continue
+            changes.append(dict(vlan=vlanId, before=before, after=after))
+            if after is None:
+                # The VLAN's bindings are removed along with it
+                writes['removed'].append(vlanId)
+                continue
+            if before is None or (before['name'], before['type']) != (after['name'], after['type']):
+                writes['vlans'].append((vlanId, after['type'], after['name']))
+            for network in sorted(set(before['networks'] if before else []) - set(after['networks'])):
+                writes['unbind'].append((vlanId, networkIds[network]))
+            for network in sorted(set(after['networks']) - set(before['networks'] if before else [])):
+                writes['bind'].append((vlanId, networkIds[network]))
+        return domainId, writes, changes
+
+    domainId, writes, changes = plan(db.read)
+    if (changes or (domainId is None and module.params['state'] == 'present')) and not module.check_mode:
+        # Work out the changes again holding locks on the primary, the replica may be behind
+        domainId, writes, changes = plan(db.primary, lock=True)
+
+    result['domain_created'] = domainId is None and module.params['state'] == 'present'
+    result['changes'] = changes
+    result['changed'] = bool(changes) or result['domain_created']
+
+    if module.check_mode or not result['changed']:
+        module.exit_json(**result)
+
+    connection = db.primary
+    try:
+        with connection.cursor() as cursor:
+            if domainId is None:
+                cursor.execute("INSERT INTO VLANDomain (description) VALUES (%s)",module.params['domain'])
+                domainId = cursor.lastrowid
+            # Only this domain's bindings are touched, a network can also be bound to VLANs of other domains
+            for batch in batches(writes['unbind']):
+                cursor.execute("DELETE FROM VLANIPv4 WHERE domain_id=%s AND (" + " OR ".join(["(vlan_id=%s AND ipv4net_id=%s)"] * len(batch)) + ")",[domainId] + [value for binding in batch for value in binding])
+            for batch in batches(writes['vlans']):
+                cursor.executemany("INSERT INTO VLANDescription (domain_id, vlan_id, vlan_type, vlan_descr) VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE vlan_type=VALUES(vlan_type), vlan_descr=VALUES(vlan_descr)",[(domainId,) + vlan for vlan in batch])
+            for batch in batches(writes['bind']):
+                cursor.executemany("INSERT INTO VLANIPv4 (domain_id, vlan_id, ipv4net_id) VALUES (%s, %s, %s)",[(domainId,) + binding for binding in batch])
+            for batch in batches(writes['removed']):
+                cursor.execute("DELETE FROM VLANIPv4 WHERE domain_id=%s AND vlan_id IN ({})".format(inPlaceholders(batch)),[domainId] + batch)
+                cursor.execute("DELETE FROM VLANDescription WHERE domain_id=%s AND vlan_id IN ({})".format(inPlaceholders(batch)),[domainId] + batch)
+        connection.commit()
+    except DBError as e:
+        connection.rollback()
+        module.fail_json(msg="Failed to update the VLANs, no changes were made: {}".format(e), **result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()